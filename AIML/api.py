@@ -1,21 +1,71 @@
 # api.py
+# Every endpoint that scores is async: /predict requests arriving within
+# MICROBATCH_WAIT_S of each other are merged into one service.predict_batch
+# call, and all scoring runs on a fixed pool of SCORE_WORKERS threads, so the
+# event loop never blocks and concurrent callers never queue for threadpool slots.
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
-from pathlib import Path
-from fastapi import FastAPI, Depends, Request
+from fastapi import FastAPI, Depends, Request, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
-from typing import Optional
-import cloudpickle as pickle
+from typing import Any, Dict, List, Optional, Tuple, Union
 
-from inference import load_model, predict_one, MODEL_PATH
+import metrics
+from concurrency import MicroBatcher
+from inference import load_model, parse_events, MODEL_PATH
+from service import AnomalyService, LearnQueueFull
+from shared_model import MULTI_WORKER, SharedModelService
+
+SCORE_WORKERS = 4           # threads that run scoring (bounded: extra work waits in the batcher)
+MICROBATCH_MAX = 64         # /predict requests merged into one scoring call
+MICROBATCH_WAIT_S = 0.002   # how long the first request of a batch waits for others
+MICROBATCH_QUEUE = 10000    # requests waiting for a batch before new ones wait for room
+
+def _score_items(service: AnomalyService, items: List[Tuple[Dict[str, Any], bool]]) -> List[Any]:
+    """Micro-batched /predict requests: one predict_batch call per learn flag, results in order."""
+    results: List[Any] = [None] * len(items)
+    for learn in (False, True):
+        idxs = [i for i, (_, l) in enumerate(items) if l is learn]
+        if not idxs:
+            continue
+        try:
+            out: List[Any] = service.predict_batch([items[i][0] for i in idxs], learn=learn)
+        except LearnQueueFull as err:  # the learn queue took none of the group (rejected or timed out)
+            out = [err] * len(idxs)
+        for i, res in zip(idxs, out):
+            results[i] = res
+    return results
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    app.state.model = load_model(MODEL_PATH)
+    if MULTI_WORKER:
+        # uvicorn --workers N with ANOMALY_MULTI_WORKER=1: one worker learns,
+        # the others score a shared snapshot (see shared_model.py)
+        service = app.state.service = await run_in_threadpool(lambda: SharedModelService(MODEL_PATH).start())
+    else:
+        model = await run_in_threadpool(load_model, MODEL_PATH)
+        # scoring is concurrent; learns go through one writer thread and are
+        # snapshotted in the background
+        service = app.state.service = AnomalyService(model, MODEL_PATH).start()
+    app.state.executor = ThreadPoolExecutor(max_workers=SCORE_WORKERS, thread_name_prefix="score")
+    app.state.batcher = MicroBatcher(lambda items: _score_items(service, items), app.state.executor,
+                                     max_batch=MICROBATCH_MAX, max_wait_s=MICROBATCH_WAIT_S,
+                                     max_in_flight=SCORE_WORKERS, maxsize=MICROBATCH_QUEUE).start()
     yield
+    await app.state.batcher.stop()
+    app.state.executor.shutdown(wait=True)
+    # drain the learn queue and flush so nothing learned is lost
+    await run_in_threadpool(service.stop)
 
 app = FastAPI(lifespan=lifespan)
+metrics.instrument_fastapi(app, "anomaly")
 
 class Event(BaseModel):
+    # routing keys, only used when the service runs in sharded mode (SHARD_BY)
+    machine_id: Optional[Union[int, str]] = None
+    machine_type: Optional[str] = None
     avg_fuel_consumption_rate: Optional[float] = None
     idle_fuel_consumption_pct: Optional[float] = None
     rpm_variance: Optional[float] = None
@@ -28,18 +78,52 @@ class Event(BaseModel):
     error_code_frequency: Optional[float] = None
     battery_low_voltage_events: Optional[float] = None
 
-def get_model(request: Request):
-    return request.app.state.model
+def get_service(request: Request) -> AnomalyService:
+    return request.app.state.service
 
-def save_model(model, path: Path = MODEL_PATH):
-    with open(path, "wb") as f:
-        pickle.dump(model, f)
+def get_batcher(request: Request) -> MicroBatcher:
+    return request.app.state.batcher
 
 @app.post("/predict")
-def predict(e: Event, learn: bool = False, model = Depends(get_model)):
+async def predict(e: Event, learn: bool = False, batcher: MicroBatcher = Depends(get_batcher)):
     # pydantic v2 vs v1 compatibility:
     data = e.model_dump(exclude_none=True) if hasattr(e, "model_dump") else e.dict(exclude_none=True)
-    result = predict_one(data, model, learn=learn)
-    if learn:
-        save_model(model)
-    return result
+    res = await batcher.submit((data, learn))
+    if isinstance(res, LearnQueueFull):
+        raise HTTPException(status_code=503, detail=str(res), headers={"Retry-After": "1"})
+    if "error" in res:
+        internal = res["error"].startswith("Internal error")
+        raise HTTPException(status_code=500 if internal else 400, detail=res["error"])
+    return res
+
+@app.post("/predict_batch")
+async def predict_batch_endpoint(request: Request, learn: bool = False):
+    # Body is either a JSON array of events or NDJSON (Content-Type: application/x-ndjson).
+    body = await request.body()
+    try:
+        events = parse_events(body, request.headers.get("content-type", ""))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        results = await asyncio.get_running_loop().run_in_executor(
+            request.app.state.executor, get_service(request).predict_batch, events, learn)
+    except LearnQueueFull as err:
+        raise HTTPException(status_code=503, detail=str(err), headers={"Retry-After": "1"})
+    return {"results": results}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics_endpoint():
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/stats")
+def stats(request: Request, service: AnomalyService = Depends(get_service)):
+    return {**service.stats(), "microbatch": request.app.state.batcher.stats()}
+
+@app.get("/checkpoint")
+def checkpoint_stats(service: AnomalyService = Depends(get_service)):
+    return service.checkpointer.stats()
+
+@app.post("/checkpoint")
+def checkpoint_now(service: AnomalyService = Depends(get_service)):
+    saved = service.checkpointer.flush()
+    return {"saved": saved, **service.checkpointer.stats()}
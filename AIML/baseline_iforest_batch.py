@@ -3,57 +3,264 @@
 Batch baseline with IsolationForest (unsupervised).
 - pip install scikit-learn pandas numpy
 - Fit on earlier data, score later data. Can be rerun periodically in production.
+- --rolling keeps the model and a timestamp watermark between runs and only
+  reads, scores and learns from rows added since (see rolling()).
+- Fitting uses n_jobs=workers; scoring fans chunks of the scored split out to a
+  process pool that memory-maps one saved copy of the model, and each chunk is
+  appended to the output CSV as soon as it is scored (results in input order).
+
+    python baseline_iforest_batch.py [--input CSV] [--split 0.7] [--output CSV]
+                                     [--chunk-size 50000] [--workers N]
+                                     [--rolling [--state PATH] [--window ROWS] [--refresh-fraction F]]
 """
+import argparse
+import hashlib
+import io
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import joblib
 import numpy as np
 import pandas as pd
 from pathlib import Path
+from typing import Any, Dict, Optional
 from sklearn.ensemble import IsolationForest
 from sklearn.preprocessing import StandardScaler
 
-CSV_PATH = "AIML\MachineSensorData_anomalies.csv"
+from features import NUMERIC_COLS
+from fileutil import write_atomic
+from ingest import data_end, read_frame, read_header
+
+CSV_PATH = Path(__file__).resolve().parent / "MachineSensorData_anomalies.csv"
+OUT_PATH = "iforest_batch_scores.csv"
+TRAIN_FRACTION = 0.7       # earliest rows used for fitting; the rest are scored
+SCORE_CHUNK_ROWS = 50_000  # rows per scoring task / output write
+WORKERS = os.cpu_count() or 1
+N_TREES = 200
+CONTAMINATION = 0.01
+# rolling mode
+STATE_PATH = "iforest_rolling.joblib"  # model, scaler, recent window, watermark, read position
+WINDOW_ROWS = 50_000                   # most recent rows kept for regrowing trees
+REFRESH_FRACTION = 0.1                 # share of trees replaced per run (oldest first)
 TIME_COL = "timestamp"
 ID_COL = "machine_id"
+# e.g. Path(".ingest_cache") to keep a parsed copy of the CSV so reruns skip parsing
+CACHE_DIR = None
+
+_worker_clf = None
+
+def _init_worker(model_path: str):
+    global _worker_clf
+    _worker_clf = joblib.load(model_path, mmap_mode="r")  # tree arrays shared via the page cache
+
+def _score_chunk(X: np.ndarray):
+    return score(_worker_clf, X)
 
-NUMERIC_COLS = [
-    "avg_fuel_consumption_rate",
-    "idle_fuel_consumption_pct",
-    "rpm_variance",
-    "coolant_temp_anomalies",
-    "productive_time_mins",
-    "idle_time_mins",
-    "vibration_anomalies",
-    "over_speed_events",
-    "tire_pressure_deviations",
-    "error_code_frequency",
-    "battery_low_voltage_events",
-]
-
-def main():
-    df = pd.read_csv(CSV_PATH)
+def score(clf: IsolationForest, X: np.ndarray):
+    """(anomaly_score, is_anomaly) with higher = more anomalous; same as -score_samples / predict."""
+    s = clf.score_samples(X)
+    return -s, (s - clf.offset_ < 0).astype(int)
+
+def iter_scores(clf: IsolationForest, X: np.ndarray, chunk_rows: int = SCORE_CHUNK_ROWS,
+                workers: int = WORKERS):
+    """Yield (start, scores, preds) per chunk of X in order; chunks run in a process pool."""
+    starts = range(0, len(X), chunk_rows)
+    if workers <= 1 or len(starts) <= 1:
+        for s in starts:
+            yield (s, *score(clf, X[s:s + chunk_rows]))
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        model_path = os.path.join(tmp, "iforest.joblib")
+        joblib.dump(clf, model_path)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(model_path,)) as pool:
+            chunks = (X[s:s + chunk_rows] for s in starts)
+            for s, (scores, preds) in zip(starts, pool.map(_score_chunk, chunks)):
+                yield s, scores, preds
+
+def load_frame(csv_path, offset: int = 0, end: Optional[int] = None) -> pd.DataFrame:
+    """Typed, time-sorted rows of the sensor CSV (bytes [offset, end) if given)."""
+    # typed chunked read: features as float64, every other column kept as passthrough
+    header = read_header(csv_path)
+    meta = [c for c in header if c not in NUMERIC_COLS]
+    df = read_frame(csv_path, NUMERIC_COLS, meta=meta, cache_dir=CACHE_DIR, offset=offset, end=end)
+    for c in meta:
+        try:
+            df[c] = pd.to_numeric(df[c])
+        except ValueError:
+            pass
+    df = df[[c for c in header if c in df.columns]]
     if TIME_COL in df.columns:
         df[TIME_COL] = pd.to_datetime(df[TIME_COL], errors="coerce")
         df = df.sort_values([TIME_COL, ID_COL] if ID_COL in df.columns else [TIME_COL])
+    return df
 
+def write_scores(out_path, df: pd.DataFrame, X: np.ndarray, clf: IsolationForest,
+                 chunk_rows: int = SCORE_CHUNK_ROWS, workers: int = WORKERS, append: bool = False):
+    """Score X chunk by chunk and write df's rows plus the scores as each chunk finishes."""
+    # score_samples: higher means more normal; we invert to make 'higher = more anomalous'
+    out_path = Path(out_path)
+    header = not (append and out_path.exists() and out_path.stat().st_size > 0)
+    with open(out_path, "a" if append else "w", newline="") as f:
+        for start, scores, preds in iter_scores(clf, X, chunk_rows, workers):
+            out = df.iloc[start:start + len(scores)].copy()
+            out["anomaly_score"] = scores
+            out["is_anomaly"] = preds
+            out.to_csv(f, index=False, header=header and start == 0)
+        if not len(df) and header:
+            df.assign(anomaly_score=[], is_anomaly=[]).to_csv(f, index=False)
+
+def main(csv_path=CSV_PATH, split: float = TRAIN_FRACTION, out_path=OUT_PATH,
+         chunk_rows: int = SCORE_CHUNK_ROWS, workers: int = WORKERS, end: Optional[int] = None):
+    df = load_frame(csv_path, end=end)
     n = len(df)
-    train_df = df.iloc[: int(0.7*n)]
-    test_df  = df.iloc[int(0.7*n):]
+    train_df = df.iloc[: int(split*n)]
+    test_df  = df.iloc[int(split*n):]
 
     scaler = StandardScaler()
     X_train = scaler.fit_transform(train_df[NUMERIC_COLS].values)
     X_test  = scaler.transform(test_df[NUMERIC_COLS].values)
 
-    clf = IsolationForest(n_estimators=200, contamination=0.01, random_state=42)
+    # trees are seeded up front, so the fitted forest does not depend on n_jobs
+    clf = IsolationForest(n_estimators=N_TREES, contamination=CONTAMINATION, random_state=42, n_jobs=workers)
     clf.fit(X_train)
-    # score_samples: higher means more normal; we invert to make 'higher = more anomalous'
-    scores = -clf.score_samples(X_test)
-    preds = (clf.predict(X_test) == -1).astype(int)
 
-    out = test_df.copy()
-    out["anomaly_score"] = scores
-    out["is_anomaly"] = preds
-    out_path = Path("iforest_batch_scores.csv")
-    out.to_csv(out_path, index=False)
-    print(f"Saved batch IF scores to {out_path.resolve()}")
+    write_scores(out_path, test_df, X_test, clf, chunk_rows, workers)
+    print(f"Saved batch IF scores to {Path(out_path).resolve()}")
+    return df, scaler, clf, X_train
+
+# ---- rolling mode ----
+
+def _tail_sig(path, offset: int) -> str:
+    """Hash of the bytes just before `offset`: tells an appended-to export from a rewritten one."""
+    with open(path, "rb") as f:
+        f.seek(max(0, offset - 4096))
+        return hashlib.sha1(f.read(min(offset, 4096))).hexdigest()
+
+def _source_state(path, offset: int) -> Dict[str, Any]:
+    return {"path": str(Path(path).resolve()), "offset": offset, "tail_sha1": _tail_sig(path, offset)}
+
+def _resume_offset(path, source: Dict[str, Any]) -> int:
+    """Where the last run stopped reading, or 0 if the file was replaced/truncated."""
+    try:
+        if (source["path"] == str(Path(path).resolve()) and os.path.getsize(path) >= source["offset"]
+                and _tail_sig(path, source["offset"]) == source["tail_sha1"]):
+            return source["offset"]
+    except OSError:
+        pass
+    return 0
+
+def refresh_trees(clf: IsolationForest, X: np.ndarray, n_trees: int, seed: int, workers: int = WORKERS):
+    """
+    Replace the n_trees oldest trees of clf (the front of estimators_) with
+    trees grown on X by a warm-start fit, which appends them and
+    recalibrates offset_ on X so is_anomaly keeps flagging the
+    `contamination` share. X needs at least clf.max_samples_ rows so the
+    new trees are built with the same subsample size as the old ones.
+    """
+    total = len(clf.estimators_)
+    n_trees = min(n_trees, total)
+    del clf.estimators_[:n_trees]
+    del clf.estimators_features_[:n_trees]
+    clf.set_params(warm_start=True, n_estimators=total, max_samples=clf.max_samples_, random_state=seed,
+                   n_jobs=workers)
+    try:
+        clf.fit(X)
+    finally:
+        clf.set_params(warm_start=False)
+
+def save_state(state: Dict[str, Any], path):
+    buf = io.BytesIO()
+    joblib.dump(state, buf)
+    write_atomic(Path(path), buf.getvalue())  # a crash mid-write leaves the previous state intact
+
+def rolling(csv_path=CSV_PATH, state_path=STATE_PATH, out_path=OUT_PATH, split: float = TRAIN_FRACTION,
+            chunk_rows: int = SCORE_CHUNK_ROWS, workers: int = WORKERS, window_rows: int = WINDOW_ROWS,
+            refresh_fraction: float = REFRESH_FRACTION):
+    """
+    Incremental nightly run. The first run (no state file) is a normal batch
+    run that also saves the model, scaler, a window of the latest rows, the
+    timestamp watermark and how far the CSV was read. Later runs read only the
+    bytes appended since (the whole file, keeping rows strictly newer than
+    the watermark, if it was rewritten), score them with the saved model and
+    append them to the output; then the oldest refresh_fraction of the trees
+    are regrown on the recent window. Appended rows are all new, whatever
+    their timestamp; the watermark only filters a full reread. The scaler stays as first fitted, since
+    the kept trees split in its units.
+    """
+    if TIME_COL not in read_header(csv_path):
+        raise ValueError(f"Rolling mode needs a '{TIME_COL}' column in {csv_path}.")
+    end = data_end(csv_path)
+    state_path = Path(state_path)
+    if not state_path.exists():
+        df, scaler, clf, X_train = main(csv_path, split, out_path, chunk_rows, workers, end=end)
+        X_all = scaler.transform(df[NUMERIC_COLS].values)
+        save_state({"scaler": scaler, "clf": clf, "watermark": df[TIME_COL].max(), "window": X_all[-window_rows:],
+                    "runs": 1, "source": _source_state(csv_path, end)}, state_path)
+        print(f"Started rolling state {state_path.resolve()} (watermark {df[TIME_COL].max()})")
+        return
+
+    state = joblib.load(state_path)
+    offset = _resume_offset(csv_path, state["source"])
+    df = load_frame(csv_path, offset, end)  # not past `end`: a half-written last row waits for the next run
+    if not offset:
+        # a reread has no byte position to go by, so rows up to the watermark count as already scored
+        # (NaT never compares greater: unparsable times are dropped)
+        print("Input was rewritten since the last run: rereading it in full (rows are filtered by watermark).")
+        if len(df):
+            df = df[df[TIME_COL] > state["watermark"]]
+    state["source"] = _source_state(csv_path, end)
+    if not len(df):
+        save_state(state, state_path)
+        print(f"No new rows since the last run (watermark {state['watermark']}).")
+        return
+
+    scaler, clf = state["scaler"], state["clf"]
+    clf.set_params(n_jobs=workers)
+    X_new = scaler.transform(df[NUMERIC_COLS].values)
+    # score with the model as it stood (fit on earlier data, score later data), then learn from the new rows
+    write_scores(out_path, df, X_new, clf, chunk_rows, workers, append=True)
+
+    window = np.concatenate([state["window"], X_new])[-window_rows:]
+    n_trees = max(1, int(round(refresh_fraction * len(clf.estimators_))))
+    start = state.pop("next_tree", 0)
+    if start:  # state from before trees were kept oldest-first: rotate the oldest to the front
+        clf.estimators_ = list(clf.estimators_[start:]) + list(clf.estimators_[:start])
+        clf.estimators_features_ = list(clf.estimators_features_[start:]) + list(clf.estimators_features_[:start])
+    if len(window) >= clf.max_samples_:
+        refresh_trees(clf, window, n_trees, seed=42 + state["runs"], workers=workers)
+    else:
+        print(f"Window has {len(window)} rows (< {clf.max_samples_}); keeping all trees.")
+    newest = df[TIME_COL].max()
+    if pd.notna(newest) and not newest <= state["watermark"]:  # late appended rows never move it back
+        state["watermark"] = newest
+    state.update({"window": window, "runs": state["runs"] + 1})
+    save_state(state, state_path)
+    print(f"Scored {len(df)} new rows into {Path(out_path).resolve()} (watermark {state['watermark']})")
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Fit IsolationForest on earlier rows and score the rest.")
+    parser.add_argument("--input", default=CSV_PATH, help="sensor CSV")
+    parser.add_argument("--split", type=float, default=TRAIN_FRACTION, help="fraction of rows (by time) to fit on")
+    parser.add_argument("--output", default=OUT_PATH, help="scores CSV")
+    parser.add_argument("--chunk-size", type=int, default=SCORE_CHUNK_ROWS, help="rows per scoring task")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="fit threads / scoring processes")
+    parser.add_argument("--rolling", action="store_true",
+                        help="score only rows newer than the saved watermark and refresh part of the forest")
+    parser.add_argument("--state", default=STATE_PATH, help="rolling-mode model/watermark file")
+    parser.add_argument("--window", type=int, default=WINDOW_ROWS, help="recent rows the refreshed trees learn from")
+    parser.add_argument("--refresh-fraction", type=float, default=REFRESH_FRACTION,
+                        help="share of trees regrown per rolling run")
+    args = parser.parse_args()
+    if not 0.0 < args.split < 1.0:
+        parser.error("--split must be between 0 and 1")
+    if args.chunk_size < 1 or args.workers < 1 or args.window < 1:
+        parser.error("--chunk-size, --workers and --window must be >= 1")
+    if not 0.0 < args.refresh_fraction <= 1.0:
+        parser.error("--refresh-fraction must be in (0, 1]")
+    if args.rolling:
+        rolling(args.input, args.state, args.output, args.split, args.chunk_size, args.workers,
+                args.window, args.refresh_fraction)
+    else:
+        main(args.input, args.split, args.output, args.chunk_size, args.workers)
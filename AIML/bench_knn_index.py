@@ -0,0 +1,62 @@
+# bench_knn_index.py
+"""
+Recall vs latency of the knn_index.py backends against exact brute force.
+Synthetic standardized company features (Gaussian clusters) stand in for a
+large customer population.
+
+    python bench_knn_index.py [--n 200000] [--dim 4] [--queries 500] [--k 10]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from knn_index import BruteIndex, available_indexes, build_index
+
+PARAMS = {
+    "rp_forest": [{"n_trees": 5, "leaf_size": 64}, {"n_trees": 10, "leaf_size": 64}, {"n_trees": 20, "leaf_size": 128}],
+    "hnsw": [{"ef": 16}, {"ef": 64}, {"ef": 256}],
+}
+
+def make_data(n: int, dim: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(scale=3.0, size=(max(8, n // 5000), dim))
+    X = centers[rng.integers(0, len(centers), n)] + rng.normal(size=(n, dim))
+    return (X - X.mean(axis=0)) / X.std(axis=0)
+
+def recall(found: np.ndarray, exact: np.ndarray) -> float:
+    hits = sum(len(np.intersect1d(f, e, assume_unique=True)) for f, e in zip(found, exact))
+    return hits / exact.size
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--n", type=int, default=200_000)
+    ap.add_argument("--dim", type=int, default=4)
+    ap.add_argument("--queries", type=int, default=500)
+    ap.add_argument("--k", type=int, default=10)
+    args = ap.parse_args()
+
+    X = make_data(args.n, args.dim)
+    Q = X[np.random.default_rng(1).choice(args.n, args.queries, replace=False)]
+    _, exact = BruteIndex(X).kneighbors(Q, args.k)
+
+    print(f"n={args.n:,} dim={args.dim} queries={args.queries} k={args.k}")
+    print(f"{'index':<10} {'params':<34} {'build s':>8} {'batch us/q':>11} {'single us/q':>12} {'recall':>7}")
+    for kind in available_indexes():
+        for params in PARAMS.get(kind, [{}]):
+            t0 = time.perf_counter()
+            index = build_index(kind, X, **params)
+            build_s = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            _, inds = index.kneighbors(Q, args.k)
+            batch_us = (time.perf_counter() - t0) / len(Q) * 1e6
+            n_single = min(50, len(Q))
+            t0 = time.perf_counter()
+            for q in Q[:n_single]:
+                index.kneighbors(q[None, :], args.k)
+            single_us = (time.perf_counter() - t0) / n_single * 1e6
+            print(f"{kind:<10} {str(params):<34} {build_s:>8.2f} {batch_us:>11.1f} {single_us:>12.1f} "
+                  f"{recall(inds, exact):>7.3f}")
+
+if __name__ == "__main__":
+    main()
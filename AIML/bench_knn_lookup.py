@@ -0,0 +1,71 @@
+# bench_knn_lookup.py
+"""
+Micro-benchmark for the per-request company lookup in flask_knn_api.recommend.
+  scan:  the old path, df[ID_COL].astype(str) == id, then df.loc + scaler.transform
+  index: KNNArtifact.index_of (dict) + the cached standardized row
+Synthetic artifacts of 25, 10k and 1M companies are written to a temp dir.
+
+    python bench_knn_lookup.py [sizes...]     # e.g. 25 10000 1000000
+"""
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import StandardScaler
+
+from knn_artifact import KNNArtifact, artifact_from_frame
+
+FEATURE_COLS = ["avg_util", "peak_util_p95", "fleet_now", "stress_index"]
+ASSET_COLS = ["avg_cranes", "avg_bulldozers", "avg_excavators", "avg_compactors", "avg_loaders", "avg_generators"]
+ID_COL = "company_id"
+SIZES = [25, 10_000, 1_000_000]
+
+def make_frame(n: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame(rng.random((n, len(FEATURE_COLS) + len(ASSET_COLS))) * 5,
+                      columns=FEATURE_COLS + ASSET_COLS)
+    df.insert(0, ID_COL, np.arange(1, n + 1))
+    return df
+
+def time_per_call(fn, queries, min_s: float = 0.2) -> float:
+    """Mean seconds per call, repeating the query list until min_s has passed."""
+    calls = 0
+    t0 = time.perf_counter()
+    while True:
+        for q in queries:
+            fn(q)
+        calls += len(queries)
+        elapsed = time.perf_counter() - t0
+        if elapsed >= min_s:
+            return elapsed / calls
+
+def bench(n: int, workdir: Path):
+    df = make_frame(n)
+    scaler = StandardScaler().fit(df[FEATURE_COLS].to_numpy(dtype=float))
+    # id lookup only: skip the O(n^2) neighbour table
+    art = KNNArtifact(artifact_from_frame(workdir / f"n{n}", df, FEATURE_COLS, ID_COL, scaler=scaler, k_max=0))
+    rng = np.random.default_rng(1)
+    queries = [str(i) for i in rng.integers(1, n + 1, size=min(n, 50))]
+
+    def scan(cid):
+        idx = df.index[df[ID_COL].astype(str) == str(cid)].tolist()[0]
+        return scaler.transform(df.loc[idx, FEATURE_COLS].to_numpy(dtype=float)[None, :])
+
+    def indexed(cid):
+        return art.vector(art.index_of(cid))
+
+    for q in queries[:5]:
+        assert np.array_equal(scan(q), indexed(q))
+    t_scan = time_per_call(scan, queries[:5] if n >= 100_000 else queries)
+    t_index = time_per_call(indexed, queries)
+    print(f"{n:>9,} companies | scan {t_scan * 1e6:>10.1f} us | index {t_index * 1e6:>6.2f} us | "
+          f"{t_scan / t_index:>8.0f}x | index load {art.load_s * 1000:.1f} ms")
+
+if __name__ == "__main__":
+    sizes = [int(a) for a in sys.argv[1:]] or SIZES
+    with tempfile.TemporaryDirectory() as d:
+        for n in sizes:
+            bench(n, Path(d))
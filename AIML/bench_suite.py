@@ -0,0 +1,346 @@
+# bench_suite.py
+"""
+Reproducible benchmarks for the anomaly and recommender hot paths.
+Each case runs on the bundled CSVs scaled up synthetically (copy k of the
+sensor data gets new machine/reading ids, timestamps shifted past copy k-1
+and ~1% feature jitter; companies likewise get new ids), seeded, so two runs
+of the same commit see the same bytes:
+  predict / predict_learn:     inference.predict_one per event (p50/p99 latency)
+  stream_river / stream_numpy: streaming_hst_template.run() over the whole file
+  stream_partitioned:          the same, one model per machine_id across a process pool
+  train_river / train_numpy:   train_save_river.train_and_save
+  iforest:                     baseline_iforest_batch.main (fit + parallel scoring)
+  recommend_table / _live:     flask_knn_api.recommend from the neighbour table (k=5)
+                               and through a live kneighbors query (k > K_MAX)
+Every (case, scale) runs in a fresh child process, so peak memory is that
+case's own (ru_maxrss; pool workers are reported separately). Results go to
+a JSON file; --compare prints the change against an earlier one and exits 1
+when throughput drops by more than --tolerance.
+
+    python bench_suite.py [--scales 1 10 100 1000] [--only predict iforest ...] [--repeat 3]
+                          [--out bench.json] [--compare previous.json] [--workdir DIR]
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+HERE = Path(__file__).resolve().parent
+SENSOR_CSV = HERE / "MachineSensorData_anomalies.csv"
+COMPANY_CSV = HERE / "company_cluster_features.csv"
+SCALES = [1, 10]
+SEED = 0
+JITTER = 0.01           # relative noise on the float features of each synthetic copy
+TRAIN_EVENTS = 1500     # events the per-event cases learn before timing starts
+MAX_EVENTS = 20_000     # timed predict_one calls per case (the stream is cycled if shorter)
+MAX_QUERIES = 20_000    # timed recommend calls per case
+TOLERANCE = 0.10        # --compare: throughput drop that counts as a regression
+RESULT_PREFIX = "RESULT "
+
+# ---------- synthetic scale-ups ----------
+
+def scaled_sensor_csv(scale: int, workdir: Path, seed: int = SEED) -> Path:
+    """The sensor CSV repeated `scale` times as one time-ordered stream (cached in workdir)."""
+    out = workdir / f"sensor_x{scale}.csv"
+    if out.exists():
+        return out
+    base = pd.read_csv(SENSOR_CSV)
+    ts = pd.to_datetime(base["timestamp"], utc=True)
+    span = ts.max() - ts.min() + pd.Timedelta(minutes=15)
+    floats = [c for c in base.columns if pd.api.types.is_float_dtype(base[c])]
+    id_step = int(base["machine_id"].max())
+    rid_step = int(base["reading_id"].max() - base["reading_id"].min() + 1)
+    rng = np.random.default_rng(seed)
+    tmp = out.with_suffix(".tmp")
+    for k in range(scale):
+        df = base.copy()
+        if k:
+            df["reading_id"] += k * rid_step
+            df["machine_id"] += k * id_step
+            df["timestamp"] = (ts + k * span).dt.strftime("%Y-%m-%dT%H:%M:%SZ")
+            noise = 1.0 + JITTER * rng.standard_normal((len(df), len(floats)))
+            df[floats] = (df[floats].to_numpy() * noise).round(3)
+        df.to_csv(tmp, mode="a" if k else "w", header=not k, index=False)
+    os.replace(tmp, out)
+    return out
+
+def scaled_companies(scale: int, seed: int = SEED) -> pd.DataFrame:
+    """company_cluster_features.csv repeated `scale` times with fresh ids and jittered numbers."""
+    base = pd.read_csv(COMPANY_CSV)
+    nums = [c for c in base.columns if c != "company_id" and pd.api.types.is_float_dtype(base[c])]
+    step = int(base["company_id"].max())
+    rng = np.random.default_rng(seed)
+    parts = [base]
+    for k in range(1, scale):
+        df = base.copy()
+        df["company_id"] += k * step
+        df[nums] = (df[nums].to_numpy() * (1.0 + JITTER * rng.standard_normal((len(df), len(nums))))).round(3)
+        parts.append(df)
+    return pd.concat(parts, ignore_index=True)
+
+def knn_workdir(scale: int, workdir: Path) -> Path:
+    """A directory holding knn_recommender/ for `scale`, as flask_knn_api expects in its cwd."""
+    from knn_artifact import ARTIFACT_DIR, artifact_from_frame
+    from train_knn_save import FEATURE_COLS, ID_COL, EXTRA_COLS
+    d = workdir / f"knn_x{scale}"
+    if not (d / ARTIFACT_DIR / "meta.json").exists():
+        df = scaled_companies(scale).dropna(subset=FEATURE_COLS).reset_index(drop=True)
+        cols = [ID_COL, *FEATURE_COLS, *EXTRA_COLS] + [c for c in df.columns if c.startswith("avg_")]
+        artifact_from_frame(d / ARTIFACT_DIR, df[cols], FEATURE_COLS, ID_COL)
+    return d
+
+# ---------- measurement ----------
+
+def latency_stats(lat: List[float]) -> Dict[str, Any]:
+    a = np.asarray(lat)
+    return {"n": int(len(a)), "seconds": float(a.sum()), "per_s": float(len(a) / a.sum()),
+            "p50_us": float(np.percentile(a, 50) * 1e6), "p99_us": float(np.percentile(a, 99) * 1e6),
+            "mean_us": float(a.mean() * 1e6)}
+
+def job_stats(n: int, seconds: float) -> Dict[str, Any]:
+    return {"n": int(n), "seconds": float(seconds), "per_s": float(n / seconds)}
+
+def peak_rss_mb() -> Dict[str, Optional[float]]:
+    """Peak RSS of this process and of its largest (pool worker) child, in MiB."""
+    try:
+        import resource
+    except ImportError:
+        return {"peak_rss_mb": None, "peak_child_rss_mb": None}
+    unit = 1024.0 * 1024.0 if sys.platform == "darwin" else 1024.0
+    child = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return {"peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / unit,
+            "peak_child_rss_mb": child / unit if child else None}
+
+def sensor_events(csv_path: Path, n: int) -> List[Dict[str, Any]]:
+    """The first n rows as typed dicts, like the JSON events the APIs receive."""
+    return pd.read_csv(csv_path, nrows=n).to_dict("records")
+
+# ---------- cases (run in the child) ----------
+
+def _predict(csv_path: Path, learn: bool) -> Dict[str, Any]:
+    from inference import predict_one
+    from train_save_river import build_model
+    from features import SCHEMA
+    events = sensor_events(csv_path, TRAIN_EVENTS + MAX_EVENTS)
+    model = build_model()
+    for e in events[:TRAIN_EVENTS]:
+        model.learn_one(SCHEMA.to_x(e))
+    stream = events[TRAIN_EVENTS:] or events
+    lat = []
+    clock = time.perf_counter
+    for i in range(MAX_EVENTS):
+        e = stream[i % len(stream)]
+        t0 = clock()
+        predict_one(e, model, learn=learn)
+        lat.append(clock() - t0)
+    return latency_stats(lat)
+
+def case_predict(scale: int, workdir: Path) -> Dict[str, Any]:
+    return _predict(scaled_sensor_csv(scale, workdir), learn=False)
+
+def case_predict_learn(scale: int, workdir: Path) -> Dict[str, Any]:
+    return _predict(scaled_sensor_csv(scale, workdir), learn=True)
+
+def _stream(scale: int, workdir: Path, engine: str, partition_by: Optional[str] = None) -> Dict[str, Any]:
+    import streaming_hst_template as stream
+    csv_path = scaled_sensor_csv(scale, workdir)
+    out = workdir / f"stream_{engine}{'_' + partition_by if partition_by else ''}_x{scale}.csv"
+    t0 = time.perf_counter()
+    res = stream.run(csv_path, out, engine=engine, partition_by=partition_by, cache_dir=None, progress=False)
+    return job_stats(res["rows"], time.perf_counter() - t0)
+
+def case_stream_river(scale: int, workdir: Path) -> Dict[str, Any]:
+    return _stream(scale, workdir, "river")
+
+def case_stream_numpy(scale: int, workdir: Path) -> Dict[str, Any]:
+    return _stream(scale, workdir, "numpy")
+
+def case_stream_partitioned(scale: int, workdir: Path) -> Dict[str, Any]:
+    return _stream(scale, workdir, "river", partition_by="machine_id")
+
+def _train(scale: int, workdir: Path, engine: str) -> Dict[str, Any]:
+    from train_save_river import train_and_save
+    csv_path = scaled_sensor_csv(scale, workdir)
+    t0 = time.perf_counter()
+    train_and_save(str(csv_path), workdir / f"model_{engine}_x{scale}.pkl", engine=engine)
+    return job_stats(1500 * scale, time.perf_counter() - t0)
+
+def case_train_river(scale: int, workdir: Path) -> Dict[str, Any]:
+    return _train(scale, workdir, "river")
+
+def case_train_numpy(scale: int, workdir: Path) -> Dict[str, Any]:
+    return _train(scale, workdir, "numpy")
+
+def case_iforest(scale: int, workdir: Path) -> Dict[str, Any]:
+    import baseline_iforest_batch as iforest
+    csv_path = scaled_sensor_csv(scale, workdir)
+    t0 = time.perf_counter()
+    df, _, _, _ = iforest.main(str(csv_path), out_path=str(workdir / f"iforest_x{scale}.csv"))
+    return job_stats(len(df), time.perf_counter() - t0)
+
+def _recommend(scale: int, workdir: Path, live: bool) -> Dict[str, Any]:
+    os.chdir(knn_workdir(scale, workdir))   # flask_knn_api loads ./knn_recommender at import
+    os.environ["RESULT_CACHE_SIZE"] = "0"    # time the lookups, not repeats served from the cache
+    import flask_knn_api as api
+    from knn_artifact import K_MAX
+    art = api.watcher.get()
+    k = K_MAX + 5 if live else 5
+    if art.covers(k) == live:
+        raise ValueError(f"k={k} does not take the {'live' if live else 'table'} path at scale {scale}.")
+    rng = np.random.default_rng(SEED)
+    known = list(art.row_index)
+    ids = [known[i] for i in rng.integers(0, len(known), size=min(MAX_QUERIES, 1000))]
+    assets = [c.removeprefix("avg_") for c in art.asset_cols if c.startswith("avg_")]
+    queries = [(ids[i % len(ids)], assets[i % len(assets)], i % 4) for i in range(MAX_QUERIES)]
+    lat = []
+    clock = time.perf_counter
+    for cid, asset, rented in queries:
+        t0 = clock()
+        api.recommend(cid, asset, rented, k=k)
+        lat.append(clock() - t0)
+    return {**latency_stats(lat), "rows": len(art), "k": k}
+
+def case_recommend_table(scale: int, workdir: Path) -> Dict[str, Any]:
+    return _recommend(scale, workdir, live=False)
+
+def case_recommend_live(scale: int, workdir: Path) -> Dict[str, Any]:
+    return _recommend(scale, workdir, live=True)
+
+CASES: Dict[str, Callable[[int, Path], Dict[str, Any]]] = {
+    "predict": case_predict,
+    "predict_learn": case_predict_learn,
+    "stream_river": case_stream_river,
+    "stream_numpy": case_stream_numpy,
+    "stream_partitioned": case_stream_partitioned,
+    "train_river": case_train_river,
+    "train_numpy": case_train_numpy,
+    "iforest": case_iforest,
+    "recommend_table": case_recommend_table,
+    "recommend_live": case_recommend_live,
+}
+
+def run_child(case: str, scale: int, workdir: Path):
+    sys.path.insert(0, str(HERE))
+    with contextlib.redirect_stdout(sys.stderr):   # keep the jobs' own prints off the result line
+        result = CASES[case](scale, workdir)
+    result.update(peak_rss_mb())
+    print(RESULT_PREFIX + json.dumps(result), flush=True)
+
+# ---------- driver ----------
+
+def run_case(case: str, scale: int, workdir: Path) -> Dict[str, Any]:
+    proc = subprocess.run([sys.executable, str(Path(__file__).resolve()), "--child", case, "--scale", str(scale),
+                           "--workdir", str(workdir)], cwd=HERE, capture_output=True, text=True)
+    for line in proc.stdout.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    tail = "\n".join(proc.stderr.strip().splitlines()[-5:])
+    raise RuntimeError(f"{case} x{scale} failed (exit {proc.returncode}):\n{tail}")
+
+def environment() -> Dict[str, Any]:
+    versions = {}
+    for mod in ("numpy", "pandas", "sklearn", "river", "joblib"):
+        try:
+            versions[mod] = __import__(mod).__version__
+        except Exception:
+            versions[mod] = None
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=HERE, capture_output=True, text=True,
+                                timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {"time": datetime.now(timezone.utc).isoformat(timespec="seconds"), "commit": commit,
+            "python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+            "versions": versions, "metrics_enabled": os.environ.get("METRICS_ENABLED", "1") != "0"}
+
+def fmt(v: Optional[float], spec: str) -> str:
+    return format(v, spec) if v is not None else "-".rjust(int(spec.split(".")[0]))
+
+def compare(old: Dict[str, Any], new: Dict[str, Any], tolerance: float) -> List[str]:
+    """Print per-case changes against an earlier run; return the cases that regressed."""
+    before = {(r["case"], r["scale"]): r for r in old["results"]}
+    print(f"\nvs {old['meta'].get('commit') or '?'} ({old['meta'].get('time')})")
+    print(f"{'case':<16} {'scale':>6} {'per_s':>9} {'p99':>9} {'peak MiB':>9}")
+    regressed = []
+    for r in new["results"]:
+        o = before.get((r["case"], r["scale"]))
+        if o is None:
+            continue
+        change = r["per_s"] / o["per_s"] - 1.0
+        p99 = (f"{r['p99_us'] / o['p99_us'] - 1.0:+.1%}" if r.get("p99_us") and o.get("p99_us") else "-")
+        peak = (f"{r['peak_rss_mb'] - o['peak_rss_mb']:+.1f}" if r.get("peak_rss_mb") and o.get("peak_rss_mb")
+                else "-")
+        flag = "  REGRESSION" if change < -tolerance else ""
+        print(f"{r['case']:<16} {r['scale']:>6} {change:>+9.1%} {p99:>9} {peak:>9}{flag}")
+        if flag:
+            regressed.append(f"{r['case']} x{r['scale']}")
+    return regressed
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--scales", type=int, nargs="+", default=SCALES, help="copies of the bundled data (1 = as is)")
+    ap.add_argument("--only", nargs="+", choices=list(CASES), help="cases to run (default: all)")
+    ap.add_argument("--repeat", type=int, default=1, help="runs per case; the median by throughput is kept")
+    ap.add_argument("--out", help="results JSON (default: bench_results/bench-<time>.json)")
+    ap.add_argument("--compare", help="earlier results JSON to diff against")
+    ap.add_argument("--tolerance", type=float, default=TOLERANCE, help="throughput drop flagged by --compare")
+    ap.add_argument("--workdir", help="keep generated data here and reuse it (default: a temp dir)")
+    ap.add_argument("--child", choices=list(CASES), help=argparse.SUPPRESS)
+    ap.add_argument("--scale", type=int, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.child:
+        run_child(args.child, args.scale, Path(args.workdir))
+        return
+
+    tmp = None
+    if args.workdir:
+        workdir = Path(args.workdir).resolve()
+        workdir.mkdir(parents=True, exist_ok=True)
+    else:
+        tmp = tempfile.TemporaryDirectory(prefix="bench_suite_")
+        workdir = Path(tmp.name)
+
+    report = {"meta": {**environment(), "args": {k: v for k, v in vars(args).items() if k not in ("child", "scale")},
+                       "seed": SEED, "max_events": MAX_EVENTS, "max_queries": MAX_QUERIES},
+              "results": []}
+    print(f"{'case':<16} {'scale':>6} {'n':>10} {'seconds':>9} {'per_s':>11} {'p50 us':>9} {'p99 us':>9} "
+          f"{'peak MiB':>9}")
+    try:
+        for scale in args.scales:
+            scaled_sensor_csv(scale, workdir)
+            for case in args.only or CASES:
+                runs = sorted((run_case(case, scale, workdir) for _ in range(args.repeat)), key=lambda r: r["per_s"])
+                r = {"case": case, "scale": scale, **runs[len(runs) // 2],
+                     "runs_per_s": [x["per_s"] for x in runs]}
+                report["results"].append(r)
+                print(f"{case:<16} {scale:>6} {r['n']:>10,} {r['seconds']:>9.3f} {r['per_s']:>11,.0f} "
+                      f"{fmt(r.get('p50_us'), '9.1f')} {fmt(r.get('p99_us'), '9.1f')} {fmt(r['peak_rss_mb'], '9.1f')}")
+    finally:
+        if tmp is not None:
+            tmp.cleanup()
+
+    out = Path(args.out or Path("bench_results") / f"bench-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, indent=2))
+    print(f"Wrote {out.resolve()}")
+
+    if args.compare:
+        regressed = compare(json.loads(Path(args.compare).read_text()), report, args.tolerance)
+        if regressed:
+            print(f"{len(regressed)} regression(s): {', '.join(regressed)}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+# checkpoint.py
+"""
+Background checkpointing for the online River model.
+Learn updates stay in memory; a daemon thread snapshots the model every
+`every_n` learned events or `every_s` seconds (whichever comes first) using
+an atomic write-and-rename, so a crash never leaves a truncated model file behind.
+"""
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+from fileutil import write_atomic
+from inference import MODEL_PATH, PHASE_SECONDS, dump_model
+
+CHECKPOINT_EVERY_N = 500    # learned events between snapshots
+CHECKPOINT_EVERY_S = 30.0   # max seconds a learned event may stay unsaved
+
+class Checkpointer:
+    def __init__(self, model, path: Path = MODEL_PATH,
+                 every_n: int = CHECKPOINT_EVERY_N, every_s: float = CHECKPOINT_EVERY_S,
+                 lock: Optional[threading.Lock] = None,
+                 saver: Optional[Callable[[], int]] = None):
+        """
+        model: the live river Pipeline (mutated in place by learn_one)
+        lock: held by writers while they call learn_one; the snapshot takes it
+              too so it never serializes a half-applied update
+        saver: replaces the single-file snapshot (e.g. ShardRegistry.flush);
+               does its own locking and returns the number of bytes written
+        """
+        self.model = model
+        self.saver = saver
+        self.path = Path(path)
+        self.every_n = max(1, int(every_n))
+        self.every_s = float(every_s)
+        self.lock = lock or threading.Lock()
+
+        self._state_lock = threading.Lock()   # guards the counters below
+        self._save_lock = threading.Lock()    # one snapshot at a time
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self.pending = 0                      # learned events not yet on disk
+        self.dirty_since: Optional[float] = None
+        self.checkpoints = 0
+        self.failures = 0
+        self.last_checkpoint_at: Optional[float] = None
+        self.last_latency_s: Optional[float] = None
+        self.last_bytes: Optional[int] = None
+        self.last_error: Optional[str] = None
+
+    def note_learn(self, n: int = 1):
+        """Record that `n` events were learned; cheap enough for the hot path."""
+        with self._state_lock:
+            if self.pending == 0:
+                self.dirty_since = time.time()
+            self.pending += n
+            due = self.pending >= self.every_n
+        if due:
+            self._wake.set()
+
+    def flush(self) -> bool:
+        """Snapshot now if anything changed since the last checkpoint."""
+        with self._save_lock:
+            with self._state_lock:
+                if self.pending == 0:
+                    return False
+                taken = self.pending
+            t0 = time.perf_counter()
+            try:
+                if self.saver is not None:
+                    with self._state_lock:
+                        self.pending -= taken
+                        self.dirty_since = time.time() if self.pending else None
+                    nbytes = self.saver()
+                else:
+                    with self.lock:
+                        data = dump_model(self.model, self.path)
+                        # counters reset inside the model lock: anything learned after
+                        # this point is not in `data` and stays pending
+                        with self._state_lock:
+                            self.pending -= taken
+                            self.dirty_since = time.time() if self.pending else None
+                    write_atomic(self.path, data)
+                    nbytes = len(data)
+            except Exception as e:
+                with self._state_lock:
+                    if self.pending == 0:
+                        self.dirty_since = time.time()
+                    self.pending += taken
+                    self.failures += 1
+                    self.last_error = str(e)
+                return False
+            with self._state_lock:
+                self.checkpoints += 1
+                self.last_checkpoint_at = time.time()
+                self.last_latency_s = time.perf_counter() - t0
+                PHASE_SECONDS.observe(self.last_latency_s, "save", "one")
+                self.last_bytes = nbytes
+                self.last_error = None
+            return True
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(timeout=min(1.0, self.every_s))
+            self._wake.clear()
+            with self._state_lock:
+                pending = self.pending
+                age = time.time() - self.dirty_since if self.dirty_since else 0.0
+            if pending >= self.every_n or (pending and age >= self.every_s):
+                self.flush()
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="model-checkpointer", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, flush: bool = True):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+        if flush:
+            self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.time()
+        with self._state_lock:
+            return {
+                "path": str(self.path),
+                "pending_events": self.pending,
+                "staleness_s": (now - self.dirty_since) if self.dirty_since else 0.0,
+                "checkpoints_total": self.checkpoints,
+                "failures_total": self.failures,
+                "last_checkpoint_age_s": (now - self.last_checkpoint_at) if self.last_checkpoint_at else None,
+                "last_checkpoint_latency_s": self.last_latency_s,
+                "last_checkpoint_bytes": self.last_bytes,
+                "last_error": self.last_error,
+                "every_n": self.every_n,
+                "every_s": self.every_s,
+            }
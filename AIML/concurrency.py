@@ -0,0 +1,354 @@
+# concurrency.py
+"""
+Concurrency primitives for serving an online model from many threads.
+- RWLock: many concurrent scorers, one exclusive writer (writer-preferring).
+- LearnQueue: bounded queue drained by a single writer thread, so all
+  learn_one calls happen on one thread, in arrival order.
+- MicroBatcher: asyncio front end that groups requests arriving within a
+  few milliseconds into one call on a bounded executor.
+"""
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import Executor
+from typing import Any, Callable, Dict, List, Optional
+
+BACKPRESSURE_POLICIES = ("block", "drop", "reject")
+
+class LearnQueueFull(RuntimeError):
+    """Raised when the learn queue is full and the policy refuses to wait (or waiting timed out)."""
+
+class _Guard:
+    __slots__ = ("_acquire", "_release")
+
+    def __init__(self, acquire, release):
+        self._acquire = acquire
+        self._release = release
+
+    def __enter__(self):
+        self._acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self._release()
+        return False
+
+class RWLock:
+    """
+    Readers-writer lock. Use `with lock.read:` around scoring and
+    `with lock.write:` around learning. Waiting writers block new readers,
+    so a steady stream of scoring requests cannot starve the learner.
+    """
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+        self.read = _Guard(self.acquire_read, self.release_read)
+        self.write = _Guard(self.acquire_write, self.release_write)
+
+    def acquire_read(self):
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._cond:
+            self._readers -= 1
+            if self._readers == 0:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            try:
+                while self._writer or self._readers:
+                    self._cond.wait()
+            finally:
+                self._writers_waiting -= 1
+            self._writer = True
+
+    def release_write(self):
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+_STOP = object()
+
+class LearnQueue:
+    def __init__(self, apply: Callable[[List[Any]], None], maxsize: int = 10000,
+                 policy: str = "block", block_timeout: Optional[float] = 1.0,
+                 max_batch: int = 64):
+        """
+        apply: called on the writer thread with a list of queued items, in order;
+               it is expected to take the model's write lock once per call
+        policy: what put()/put_many() do when the items do not fit
+                "block"  - wait up to block_timeout seconds, then raise LearnQueueFull
+                "drop"   - discard the items and count them
+                "reject" - raise LearnQueueFull immediately
+        max_batch: upper bound on items applied per apply() call, which bounds
+                   how long scorers wait behind one write lock acquisition
+        """
+        if policy not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"Unknown back-pressure policy '{policy}'. Use one of {BACKPRESSURE_POLICIES}.")
+        self.apply = apply
+        self.maxsize = int(maxsize)
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.max_batch = max(1, int(max_batch))
+        self._items: "deque[Any]" = deque()
+        self._mutex = threading.Lock()
+        self._not_empty = threading.Condition(self._mutex)
+        self._not_full = threading.Condition(self._mutex)
+        self._thread: Optional[threading.Thread] = None
+        self._count_lock = threading.Lock()
+        self.enqueued = 0
+        self.learned = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.failed = 0
+        self.last_error: Optional[str] = None
+
+    def _count(self, name: str, n: int = 1):
+        with self._count_lock:
+            setattr(self, name, getattr(self, name) + n)
+
+    def _fits(self, n: int) -> bool:
+        # caller holds self._mutex
+        return self.maxsize <= 0 or len(self._items) + n <= self.maxsize
+
+    def check_room(self, n: int):
+        """
+        With the "reject" policy, raise LearnQueueFull (counting the n items as
+        rejected) if n items would not fit right now; lets callers refuse a
+        batch before doing the work that produces its items.
+        """
+        if self.policy != "reject":
+            return
+        with self._mutex:
+            fits = self._fits(n)
+        if not fits:
+            self._count("rejected", n)
+            raise LearnQueueFull(f"Learn queue cannot take {n} items ({self.depth()}/{self.maxsize} pending).")
+
+    def put(self, item) -> bool:
+        """Queue one item for learning. Returns False if it was dropped."""
+        return self.put_many([item]) == 1
+
+    def put_many(self, items: List[Any]) -> int:
+        """
+        Queue several items, keeping their order, all or nothing: the group is
+        appended in one step once there is room for every item. When there is
+        not, the policy applies to the whole group ("block" waits up to
+        block_timeout for room for all of it, then raises LearnQueueFull;
+        "drop" discards it; "reject" raises), so callers never see part of a
+        batch learned after an error. Returns how many items were queued.
+        """
+        n = len(items)
+        if not n:
+            return 0
+        with self._not_full:
+            if not self._fits(n) and self.policy == "block" and n <= self.maxsize:
+                deadline = None if self.block_timeout is None else time.monotonic() + self.block_timeout
+                while not self._fits(n):
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        break
+                    self._not_full.wait(remaining)
+            queued = self._fits(n)
+            if queued:
+                self._items.extend(items)
+                self._not_empty.notify()
+        if queued:
+            self._count("enqueued", n)
+            return n
+        if self.policy == "drop":
+            self._count("dropped", n)
+            return 0
+        self._count("rejected", n)
+        raise LearnQueueFull(f"Learn queue cannot take {n} items ({self.depth()}/{self.maxsize} pending).")
+
+    def depth(self) -> int:
+        return len(self._items)
+
+    def _take(self) -> List[Any]:
+        # up to max_batch items, waiting for the first; _STOP is passed through as its own batch
+        with self._not_empty:
+            while not self._items:
+                self._not_empty.wait()
+            if self._items[0] is _STOP:
+                return [self._items.popleft()]
+            batch = []
+            while self._items and len(batch) < self.max_batch and self._items[0] is not _STOP:
+                batch.append(self._items.popleft())
+            self._not_full.notify_all()
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._take()
+            if batch[0] is _STOP:
+                return
+            try:
+                self.apply(batch)
+                self._count("learned", len(batch))
+            except Exception as e:
+                self._count("failed", len(batch))
+                self.last_error = str(e)
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="model-learner", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 30.0):
+        """Apply everything already queued, then stop the writer thread."""
+        if self._thread is None:
+            return
+        with self._not_empty:
+            self._items.append(_STOP)  # behind everything queued so far, regardless of maxsize
+            self._not_empty.notify()
+        self._thread.join(timeout=timeout)
+        self._thread = None
+
+    def wait_idle(self, timeout: float = 10.0) -> bool:
+        """Block until every queued item has been applied (handy for tests/benchmarks)."""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            with self._count_lock:
+                done = self.learned + self.failed
+            if done >= self.enqueued and not self._items:
+                return True
+            time.sleep(0.001)
+        return False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._count_lock:
+            return {
+                "depth": len(self._items),
+                "maxsize": self.maxsize,
+                "policy": self.policy,
+                "enqueued_total": self.enqueued,
+                "learned_total": self.learned,
+                "dropped_total": self.dropped,
+                "rejected_total": self.rejected,
+                "failed_total": self.failed,
+                "last_error": self.last_error,
+            }
+
+class MicroBatcher:
+    def __init__(self, fn: Callable[[List[Any]], List[Any]], executor: Executor,
+                 max_batch: int = 64, max_wait_s: float = 0.002, max_in_flight: int = 4,
+                 maxsize: int = 10000):
+        """
+        fn: called on `executor` with a list of submitted items, returns one
+            result per item in the same order; an exception fails the whole call
+        max_batch / max_wait_s: a batch is sent when it is full or when its
+            first item has waited max_wait_s
+        max_in_flight: batches running at once (match the executor's workers);
+            while all are busy, new requests keep filling the next batch
+        maxsize: submitted-but-unsent items before submit() waits for room
+        """
+        self.fn = fn
+        self.executor = executor
+        self.max_batch = max(1, int(max_batch))
+        self.max_wait_s = float(max_wait_s)
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.maxsize = int(maxsize)
+        self._q: Optional[asyncio.Queue] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._task: Optional[asyncio.Task] = None
+        self._running: set = set()
+        self._collecting = False        # a partial batch is waiting for its deadline
+        self.submitted = 0
+        self.dispatched = 0
+        self.batches = 0
+        self.failed = 0
+        self.max_seen = 0
+
+    def start(self):
+        """Start the collector task; call from inside the running event loop."""
+        if self._task is None:
+            self._q = asyncio.Queue(maxsize=self.maxsize)
+            self._slots = asyncio.Semaphore(self.max_in_flight)
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        return self
+
+    async def submit(self, item) -> Any:
+        """Queue one item and wait for its result (or the exception of its batch)."""
+        if self._task is None:
+            raise RuntimeError("MicroBatcher is not started.")
+        fut = asyncio.get_running_loop().create_future()
+        await self._q.put((item, fut))
+        self.submitted += 1
+        return await fut
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._q.get()]
+            self._collecting = True
+            deadline = loop.time() + self.max_wait_s
+            while len(batch) < self.max_batch:
+                if not self._q.empty():
+                    batch.append(self._q.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._q.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self._slots.acquire()
+            task = loop.create_task(self._dispatch(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+            self._collecting = False
+
+    async def _dispatch(self, batch):
+        try:
+            items = [item for item, _ in batch]
+            try:
+                results = await asyncio.get_running_loop().run_in_executor(self.executor, self.fn, items)
+            except Exception as e:
+                self.failed += 1
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+                return
+            self.batches += 1
+            self.dispatched += len(batch)
+            self.max_seen = max(self.max_seen, len(batch))
+            for (_, fut), res in zip(batch, results):
+                if not fut.done():  # the request may have been cancelled meanwhile
+                    fut.set_result(res)
+        finally:
+            self._slots.release()
+
+    async def stop(self):
+        """Send what is already queued, wait for running batches, then stop collecting."""
+        if self._task is None:
+            return
+        while not self._q.empty() or self._collecting or self._running:
+            await asyncio.sleep(self.max_wait_s)
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": self._q.qsize() if self._q is not None else 0,
+            "in_flight": len(self._running),
+            "submitted_total": self.submitted,
+            "batches_total": self.batches,
+            "failed_batches_total": self.failed,
+            "mean_batch_size": round(self.dispatched / self.batches, 2) if self.batches else None,
+            "max_batch_size": self.max_seen,
+        }
@@ -0,0 +1,124 @@
+# features.py
+"""
+The sensor feature schema, shared by training, the batch/stream jobs and
+the APIs (inference.row_to_x is FeatureSchema.to_x of the default schema).
+FeatureSchema fixes the column order once and generates straight-line
+converters for it, so an event is read in a single pass:
+- to_x(event):       {col: float} of the usable fields, like the old row_to_x
+- to_array(event):   float64 vector in schema order, NaN = missing/unparsable
+- to_matrix(events): (n, d) float64 matrix of many events
+Events whose fields are all present and numeric (typed JSON, or CSV rows
+with every value filled in) take a fast path with no per-field branching;
+anything else falls back to the per-field rules: None/"" are missing and
+values float() cannot parse are skipped.
+"""
+from operator import itemgetter
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+NUMERIC_COLS = [
+    "avg_fuel_consumption_rate",
+    "idle_fuel_consumption_pct",
+    "rpm_variance",
+    "coolant_temp_anomalies",
+    "productive_time_mins",
+    "idle_time_mins",
+    "vibration_anomalies",
+    "over_speed_events",
+    "tire_pressure_deviations",
+    "error_code_frequency",
+    "battery_low_voltage_events",
+]
+
+def _slow_to_x(event: Dict[str, Any], columns: Sequence[str]) -> Dict[str, float]:
+    x = {}
+    get = event.get
+    for c in columns:
+        v = get(c)
+        if v is None or v == "":
+            continue
+        try:
+            x[c] = float(v)
+        except Exception:
+            pass
+    return x
+
+class FeatureSchema:
+    def __init__(self, columns: Sequence[str] = NUMERIC_COLS):
+        self.columns: List[str] = list(columns)
+        if len(set(self.columns)) != len(self.columns):
+            raise ValueError("Feature columns must be unique.")
+        self.index: Dict[str, int] = {c: i for i, c in enumerate(self.columns)}
+        self.n_features = len(self.columns)
+        # C-level tuple of all values, in schema order (always a tuple, even for one column)
+        get_all = itemgetter(*self.columns) if self.columns else (lambda event: ())
+        self._values = get_all if len(self.columns) != 1 else (lambda event: (get_all(event),))
+        self._to_x = self._compile_to_x()
+
+    def _compile_to_x(self):
+        # straight-line code over the fixed columns: one dict display when every
+        # field parses, else the same per-field rules as _slow_to_x, unrolled
+        items = ", ".join(f"{c!r}: _float(event[{c!r}])" for c in self.columns)
+        lines = ["def to_x(event):", "    try:", f"        return {{{items}}}", "    except Exception:", "        pass",
+                 "    x = {}", "    get = event.get"]
+        for c in self.columns:
+            lines += [f"    v = get({c!r})",
+                      "    if v is not None and v != '':",
+                      "        try:",
+                      f"            x[{c!r}] = _float(v)",
+                      "        except Exception:",
+                      "            pass"]
+        lines.append("    return x")
+        namespace = {"_float": float}
+        exec(compile("\n".join(lines) + "\n", f"<FeatureSchema to_x {self.n_features} cols>", "exec"), namespace)
+        return namespace["to_x"]
+
+    def to_x(self, event: Dict[str, Any]) -> Dict[str, float]:
+        """Feature dict for River; missing/unparsable fields are left out."""
+        return self._to_x(event)
+
+    def to_array(self, event: Dict[str, Any], out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Features as a float64 vector in schema order (NaN = missing); fills `out` if given."""
+        if out is None:
+            out = np.empty(self.n_features)
+        try:
+            out[:] = self._values(event)
+        except Exception:
+            self._fill_slow(event, out)
+        return out
+
+    def _fill_slow(self, event: Dict[str, Any], out: np.ndarray):
+        vals = []
+        get = event.get
+        for c in self.columns:
+            v = get(c)
+            try:
+                vals.append(np.nan if v is None or v == "" else float(v))
+            except Exception:
+                vals.append(np.nan)
+        out[:] = vals
+
+    def to_matrix(self, events: Iterable[Dict[str, Any]]) -> np.ndarray:
+        """(n, d) float64 matrix, one row per event (NaN = missing)."""
+        events = list(events)
+        try:
+            X = np.array([self._values(e) for e in events], dtype=np.float64)
+            if X.shape == (len(events), self.n_features):
+                return X
+        except Exception:
+            pass
+        X = np.empty((len(events), self.n_features))
+        values = self._values
+        for i, e in enumerate(events):
+            try:
+                X[i] = values(e)
+            except Exception:
+                self._fill_slow(e, X[i])
+        return X
+
+    def from_array(self, row: np.ndarray) -> Dict[str, float]:
+        """Inverse of to_array: feature dict without the NaN entries."""
+        return {c: v for c, v in zip(self.columns, row.tolist()) if v == v}
+
+SCHEMA = FeatureSchema(NUMERIC_COLS)
@@ -0,0 +1,94 @@
+# fileutil.py
+"""
+File primitives shared by the anomaly and KNN services, kept free of model
+imports so either side can use them:
+- write_atomic: temp file + fsync + rename, so readers see the old or the
+  new file, never half of one
+- file_lock: blocking exclusive lock across processes (one writer at a time)
+- OwnerLock: non-blocking exclusive lock held for a process's lifetime
+  (owner election); the OS drops both locks if the process dies
+"""
+import os
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional
+
+def write_atomic(path: Path, data: bytes):
+    """Write bytes to a temp file next to `path`, fsync, then rename over it."""
+    path = Path(path)
+    fd, tmp = tempfile.mkstemp(prefix=f".{path.name}.", suffix=".tmp", dir=path.parent)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except FileNotFoundError:
+            pass
+        raise
+
+@contextmanager
+def file_lock(path: Path):
+    """Blocking exclusive lock on `path` (created if missing) across processes; the OS drops it if we die."""
+    with open(path, "a+") as f:
+        try:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        except ImportError:  # Windows
+            import msvcrt
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)  # gives up after ~10 s of retries
+                    break
+                except OSError:
+                    pass
+        yield  # closing the file releases the lock
+
+class OwnerLock:
+    """Non-blocking exclusive lock on a file, released by the OS if the process dies."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._f = None
+
+    def try_acquire(self) -> bool:
+        if self._f is not None:
+            return True
+        f = open(self.path, "a+")
+        try:
+            try:
+                import fcntl
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except ImportError:  # Windows
+                import msvcrt
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            f.close()
+            return False
+        f.seek(0)
+        f.truncate()
+        f.write(str(os.getpid()))
+        f.flush()
+        self._f = f
+        return True
+
+    @property
+    def held(self) -> bool:
+        return self._f is not None
+
+    def holder(self) -> Optional[int]:
+        try:
+            return int(self.path.read_text().strip() or 0) or None
+        except (OSError, ValueError):
+            return None
+
+    def release(self):
+        if self._f is not None:
+            self._f.close()   # closing the descriptor drops the lock
+            self._f = None
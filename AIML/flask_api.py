@@ -1,26 +1,68 @@
-from flask import Flask, request, jsonify
-from pathlib import Path
-import cloudpickle as pickle
+import atexit
+from flask import Flask, Response, request, jsonify
 
-from inference import load_model, predict_one, MODEL_PATH  # reuse your utils
+from inference import load_model, parse_events, MODEL_PATH  # reuse your utils
+from service import AnomalyService, LearnQueueFull
+from shared_model import MULTI_WORKER, SharedModelService
+import metrics
 
 app = Flask(__name__)
-model = load_model(MODEL_PATH)  # load once at import
+metrics.instrument_flask(app, "anomaly")
 
-def save_model(m, path: Path = MODEL_PATH):
-    with open(path, "wb") as f:
-        pickle.dump(m, f)
+if MULTI_WORKER:
+    # gunicorn -w N flask_api:app with ANOMALY_MULTI_WORKER=1: one worker
+    # learns, the others score a shared snapshot (see shared_model.py)
+    model = None
+    service = SharedModelService(MODEL_PATH).start()
+else:
+    model = load_model(MODEL_PATH)  # load once at import
+    # scoring is concurrent (threaded=True is safe); learns go through one
+    # writer thread and are snapshotted in the background
+    service = AnomalyService(model, MODEL_PATH).start()
+atexit.register(service.stop)
+
+def _learn_flag() -> bool:
+    return request.args.get("learn", "false").lower() == "true"
 
 @app.post("/predict")
 def predict():
     data = request.get_json(force=True) or {}
-    learn = (request.args.get("learn", "false").lower() == "true")
-    result = predict_one(data, model, learn=learn)
-    if learn:
-        save_model(model)
-    return jsonify(result)
+    try:
+        return jsonify(service.predict(data, learn=_learn_flag()))
+    except LearnQueueFull as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": "1"}
+
+@app.post("/predict_batch")
+def predict_batch_endpoint():
+    # Body is either a JSON array of events or NDJSON (Content-Type: application/x-ndjson).
+    try:
+        events = parse_events(request.get_data(), request.content_type or "")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        return jsonify({"results": service.predict_batch(events, learn=_learn_flag())})
+    except LearnQueueFull as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": "1"}
+
+@app.get("/metrics")
+def metrics_endpoint():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.get("/stats")
+def stats():
+    return jsonify(service.stats())
+
+@app.get("/checkpoint")
+def checkpoint_stats():
+    return jsonify(service.checkpointer.stats())
+
+@app.post("/checkpoint")
+def checkpoint_now():
+    saved = service.checkpointer.flush()
+    return jsonify({"saved": saved, **service.checkpointer.stats()})
 
 if __name__ == "__main__":
     # Run the Flask dev server
-    # For production, prefer gunicorn/uvicorn behind a reverse proxy.
+    # For production, prefer gunicorn/uvicorn behind a reverse proxy; with
+    # several workers set ANOMALY_MULTI_WORKER=1 so they share one model.
     app.run(host="0.0.0.0", port=8000, debug=True)
@@ -1,27 +1,66 @@
 # flask_knn_api.py
-from flask import Flask, request, jsonify
+# Production: gunicorn -w 4 flask_knn_api:app  (workers share the mmapped artifact)
+# Live updates (POST /companies, DELETE /companies/<id>, POST /artifact/save) live in one
+# process's memory until saved, so one process takes them all: the first to receive one
+# holds <artifact>/.live.lock for its lifetime and every other process answers 409.
+# Run the read pool without them and send updates to a single-worker instance:
+#   KNN_LIVE_UPDATES=0 gunicorn -w 4 -b :8000 flask_knn_api:app
+#   gunicorn -w 1 -b :8001 flask_knn_api:app
+# POST /artifact/save on the writer publishes a new version that the read workers reload.
+import os
+from flask import Flask, Response, request, jsonify
 from pathlib import Path
+from typing import Any, Dict, List, Optional
 import numpy as np
-import joblib
 
-ARTIFACT_PATH = Path("knn_recommender.joblib")
+from fileutil import OwnerLock
+from knn_artifact import load_artifact, ArtifactWatcher, ARTIFACT_DIR
+from knn_live import LiveKNN
+import metrics
+from metrics import REGISTRY, phase
+from result_cache import ResultCache
+
+# directory written by train_knn_save.py (or `python knn_artifact.py convert` for an old .joblib)
+ARTIFACT_PATH = Path(os.environ.get("KNN_ARTIFACT_DIR", ARTIFACT_DIR))
 
 app = Flask(__name__)
-artifact = joblib.load(ARTIFACT_PATH)  # load once
+metrics.instrument_flask(app, "knn")
+artifact = load_artifact(ARTIFACT_PATH)  # load once; arrays are memory-mapped, index built on first query
+# picks up a retrained artifact without a restart; LiveKNN adds in-place upsert/delete
+watcher = ArtifactWatcher(artifact, wrap=LiveKNN)
+# repeated identical /recommend queries (simulation, dashboards); tied to the
+# artifact object, so a reload starts it afresh, and cleared on in-place updates
+recommend_cache = ResultCache("recommend")
+# "0" turns the live-update endpoints off in this process (e.g. a multi-worker read pool)
+LIVE_UPDATES = os.environ.get("KNN_LIVE_UPDATES", "1") != "0"
+live_lock = OwnerLock(artifact.path / ".live.lock")
+
+FEATURE_COLS = artifact.feature_cols
+ID_COL = artifact.id_col
+_load = artifact.stats()
+print(f"[knn] pid {_load['pid']}: loaded {_load['rows']} rows in {_load['load_s'] * 1000:.1f} ms "
+      f"(mmap={_load['mmap']}, rss {_load['rss_mb']:.1f} MiB)")
 
-scaler = artifact["scaler"]
-nn = artifact["nn"]
-FEATURE_COLS = artifact["feature_cols"]
-ID_COL = artifact["id_col"]
-df = artifact["df"]  # pandas DataFrame
+# mode "one": per /recommend call; mode "batch": per /recommend_batch call
+RECOMMEND_SECONDS = REGISTRY.histogram("knn_recommend_phase_seconds",
+                                       "Recommendation time per phase (lookup/kneighbors/aggregate).", ("phase", "mode"))
+RECOMMENDATIONS = REGISTRY.counter("knn_recommendations_total",
+                                   "Recommendations answered from the precomputed table or a live query.", ("path",))
+REGISTRY.gauge("knn_rows", "Companies in the served KNN artifact.").set_function(lambda: len(watcher.artifact))
+REGISTRY.gauge("knn_reloads", "Artifact versions swapped in since start.").set_function(lambda: watcher.reloads)
+REGISTRY.gauge("knn_unsaved_updates", "In-place company updates not yet saved.").set_function(
+    lambda: watcher.artifact.dirty)
+REGISTRY.gauge("model_size_bytes", "Serialized size of the served model.", ("model",)).set_function(
+    lambda: sum(a.nbytes for a in (watcher.artifact.Xs, watcher.artifact.assets, watcher.artifact.nbr_means)
+                if a is not None), "knn")
 
-def resolve_asset_col(asset: str, df) -> str:
+def resolve_asset_col(asset: str, columns) -> str:
     a = (asset or "").strip().lower()
     # exact match
-    if a in df.columns:
+    if a in columns:
         return a
     # prefer avg_ prefix
-    if f"avg_{a}" in df.columns:
+    if f"avg_{a}" in columns:
         return f"avg_{a}"
     # simple plural/singular toggles
     variants = []
@@ -30,56 +69,169 @@ def resolve_asset_col(asset: str, df) -> str:
     else:
         variants.append(a + "s")
     for v in variants:
-        if v in df.columns:
+        if v in columns:
             return v
-        if f"avg_{v}" in df.columns:
+        if f"avg_{v}" in columns:
             return f"avg_{v}"
     raise ValueError(
         f"Asset '{asset}' not found. Tried '{a}' and 'avg_{a}'. "
-        f"Available examples: {[c for c in df.columns if c.startswith('avg_')][:8]}"
+        f"Available examples: {[c for c in columns if c.startswith('avg_')][:8]}"
     )
 
 def recommend(company_id, asset, current_rented, k=5):
-    asset_col = resolve_asset_col(asset, df)
-    if asset_col not in df.columns:
-        raise ValueError(f"asset '{asset_col}' not found in data.")
-
-    # find the row for this company_id
-    matches = df.index[df[ID_COL].astype(str) == str(company_id)].tolist()
-    if not matches:
-        raise ValueError(f"{ID_COL} {company_id} not found.")
-    idx = matches[0]
-
-    # build the standardized vector for this company and query KNN
-    x = df.loc[idx, FEATURE_COLS].to_numpy(dtype=float)[None, :]
-    xs = scaler.transform(x)
-
-    # ask for k+1 because the closest neighbor will be the company itself
-    n_req = min(k + 1, len(df))
-    dists, inds = nn.kneighbors(xs, n_neighbors=n_req, return_distance=True)
-
-    dists = dists[0].tolist()
-    inds = inds[0].tolist()
-
-    # remove self and keep k
-    pairs = [(d, i) for d, i in zip(dists, inds) if i != idx][:k]
-    if not pairs:
-        raise ValueError("No neighbours found (dataset too small).")
-
-    neigh_idx = [i for _, i in pairs]
-    neigh = df.iloc[neigh_idx].copy()
-    neigh["distance"] = [d for d, _ in pairs]
-
-    # compute cluster mean for the requested asset
-    cluster_mean = float(neigh[asset_col].dropna().mean())
-    if np.isnan(cluster_mean):
-        raise ValueError(f"No valid values for asset '{asset_col}' among neighbours.")
-
-    diff = cluster_mean - float(current_rented)
+    artifact = watcher.get()
+
+    def compute():
+        with artifact.lock.read:
+            return _recommend(artifact, company_id, asset, current_rented, k)
+
+    key = (str(company_id), (asset or "").strip().lower(), float(current_rented), int(k))
+    return recommend_cache.get_or_compute(key, compute, source=artifact)
+
+def _recommend(artifact, company_id, asset, current_rented, k):
+    with phase(RECOMMEND_SECONDS, "lookup", "one"):
+        asset_col = resolve_asset_col(asset, artifact.asset_cols)
+        if asset_col not in artifact.asset_index:
+            raise ValueError(f"asset '{asset_col}' not found in data.")
+
+        # find the row for this company_id (hash lookup built at load time)
+        idx = artifact.index_of(company_id)
+        if idx is None:
+            raise ValueError(f"{artifact.id_col} {company_id} not found.")
+
+    if artifact.covers(k):
+        # precomputed at training time: neighbour means for every k <= K_max
+        RECOMMENDATIONS.inc("table")
+        with phase(RECOMMEND_SECONDS, "aggregate", "one"):
+            cluster_mean = artifact.neighbor_mean(idx, k, asset_col)
+        if np.isnan(cluster_mean):
+            raise ValueError(f"No valid values for asset '{asset_col}' among neighbours.")
+        return round_recommendation(cluster_mean, float(current_rented))
+
+    RECOMMENDATIONS.inc("live")
+    with phase(RECOMMEND_SECONDS, "kneighbors", "one"):
+        # the artifact already holds the standardized vector; query KNN with it
+        xs = artifact.vector(idx)
+
+        # ask for k+1 because the closest neighbor will be the company itself
+        n_req = min(k + 1, len(artifact))
+        dists, inds = artifact.index.kneighbors(xs, n_neighbors=n_req, return_distance=True)
+
+    with phase(RECOMMEND_SECONDS, "aggregate", "one"):
+        dists = dists[0].tolist()
+        inds = inds[0].tolist()
+
+        # remove self and keep k
+        pairs = [(d, i) for d, i in zip(dists, inds) if i != idx][:k]
+        if not pairs:
+            raise ValueError("No neighbours found (dataset too small).")
+
+        # compute cluster mean for the requested asset
+        neigh_idx = [i for _, i in pairs]
+        vals = artifact.assets[neigh_idx, artifact.asset_index[asset_col]]
+        vals = vals[~np.isnan(vals)]
+        if not len(vals):
+            raise ValueError(f"No valid values for asset '{asset_col}' among neighbours.")
+        cluster_mean = float(vals.mean())
+
+    return round_recommendation(cluster_mean, float(current_rented))
+
+def round_recommendation(cluster_mean: float, current_rented: float) -> int:
+    diff = cluster_mean - current_rented
     rec = int(np.floor(diff + 0.5)) if diff > 0 else 0
-    
     return max(rec, 0)
 
+def recommend_batch(items: List[Any]) -> List[Dict[str, Any]]:
+    """
+    Many {company_id, asset, current_rented, k?} requests at once, e.g. every
+    company x every asset type for nightly planning. Asset names are resolved
+    once per distinct name, rows via the id index; k <= K_max is one gather
+    from the neighbour table, the rest share a single kneighbors call. Returns
+    {"recommendation": n} or {"error": ...} per item, in request order.
+    """
+    artifact = watcher.get()
+    with artifact.lock.read:
+        return _recommend_batch(artifact, items)
+
+def _recommend_batch(artifact, items: List[Any]) -> List[Dict[str, Any]]:
+    results: List[Dict[str, Any]] = [None] * len(items)  # type: ignore[list-item]
+    asset_cols: Dict[Any, Any] = {}
+    pos, rows, cols, ks, current = [], [], [], [], []
+    with phase(RECOMMEND_SECONDS, "lookup", "batch"):
+        for i, item in enumerate(items):
+            try:
+                if not isinstance(item, dict):
+                    raise ValueError("Request must be a JSON object.")
+                company_id, asset = item["company_id"], item["asset"]
+                cur = float(item["current_rented"])
+                k = int(item.get("k", 5))
+                if asset not in asset_cols:
+                    try:
+                        asset_cols[asset] = resolve_asset_col(asset, artifact.asset_cols)
+                    except ValueError as e:
+                        asset_cols[asset] = e
+                col = asset_cols[asset]
+                if isinstance(col, ValueError):
+                    raise col
+                idx = artifact.index_of(company_id)
+                if idx is None:
+                    raise ValueError(f"{artifact.id_col} {company_id} not found.")
+                if k < 0:
+                    raise ValueError("k must be >= 0.")
+            except KeyError as e:
+                results[i] = {"error": f"Missing required field: {e}"}
+                continue
+            except (TypeError, ValueError) as e:
+                results[i] = {"error": str(e)}
+                continue
+            pos.append(i)
+            rows.append(idx)
+            cols.append(artifact.asset_index[col])
+            ks.append(k)
+            current.append(cur)
+    if not pos:
+        return results
+
+    rows_a, cols_a, ks_a = np.array(rows), np.array(cols), np.array(ks)
+    means = np.full(len(pos), np.nan)
+    counts = np.ones(len(pos), dtype=np.int64)   # neighbours found (0 -> dataset too small)
+    table = np.array([artifact.covers(k) for k in ks], dtype=bool)
+    live = ~table
+    RECOMMENDATIONS.inc("table", n=int(table.sum()))
+    RECOMMENDATIONS.inc("live", n=int(live.sum()))
+    if live.any():
+        with phase(RECOMMEND_SECONDS, "kneighbors", "batch"):
+            # one kneighbors over the distinct rows, sized for the largest k asked
+            uniq, inv = np.unique(rows_a[live], return_inverse=True)
+            n_req = min(int(ks_a[live].max()) + 1, len(artifact))
+            _, inds = artifact.index.kneighbors(artifact.Xs[uniq], n_neighbors=n_req, return_distance=True)
+
+    with phase(RECOMMEND_SECONDS, "aggregate", "batch"):
+        if table.any():
+            kk = np.minimum(ks_a[table], artifact.k_max)
+            means[table] = artifact.nbr_means[rows_a[table], kk - 1, cols_a[table]]
+        if live.any():
+            inds = inds[inv]                                        # (m, n_req), one row per live item
+            not_self = inds != rows_a[live][:, None]
+            rank = np.cumsum(not_self, axis=1)                      # 1-based rank among non-self neighbours
+            take = not_self & (rank <= ks_a[live][:, None])
+            vals = artifact.assets[inds, cols_a[live][:, None]]     # single gather for every item
+            valid = take & ~np.isnan(vals)
+            n_valid = valid.sum(axis=1)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                means[live] = np.where(valid, vals, 0.0).sum(axis=1) / n_valid
+            means[live] = np.where(n_valid > 0, means[live], np.nan)
+            counts[live] = take.sum(axis=1)
+
+        for j, i in enumerate(pos):
+            if counts[j] == 0:
+                results[i] = {"error": "No neighbours found (dataset too small)."}
+            elif np.isnan(means[j]):
+                results[i] = {"error": f"No valid values for asset '{artifact.asset_cols[cols[j]]}' among neighbours."}
+            else:
+                results[i] = {"recommendation": round_recommendation(float(means[j]), current[j])}
+    return results
+
 @app.post("/recommend")
 def recommend_endpoint():
     try:
@@ -97,6 +249,110 @@ def recommend_endpoint():
     except Exception as e:
         return jsonify({"error": f"Internal error: {e}"}), 500
 
+@app.post("/recommend_batch")
+def recommend_batch_endpoint():
+    """Body: a JSON array of /recommend requests (or {"requests": [...]})."""
+    try:
+        data = request.get_json(force=True, silent=True)
+        if isinstance(data, dict):
+            data = data.get("requests")
+        if not isinstance(data, list):
+            raise ValueError("Body must be a JSON array of requests or {\"requests\": [...]}.")
+        return jsonify(recommend_batch(data))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": f"Internal error: {e}"}), 500
+
+def live_refusal() -> Optional[str]:
+    """Why this process may not apply live updates, or None if it is (or just became) the writer."""
+    if not LIVE_UPDATES:
+        return "Live updates are disabled in this process (KNN_LIVE_UPDATES=0)."
+    if live_lock.try_acquire():
+        return None
+    holder = live_lock.holder()
+    return (f"Live updates are handled by process {holder or 'another process'}; "
+            "send them to the single-worker update instance.")
+
+def upsert_companies(records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Insert/replace companies in the running recommender (per-item errors)."""
+    out = []
+    with watcher.lock:  # no artifact swap while updating
+        live = watcher.artifact
+        for rec in records:
+            try:
+                if not isinstance(rec, dict):
+                    raise ValueError("Company must be a JSON object.")
+                out.append(live.upsert(rec))
+            except (TypeError, ValueError) as e:
+                out.append({"error": str(e)})
+        if any("error" not in r for r in out):
+            recommend_cache.invalidate()
+    return out
+
+def delete_company(company_id) -> Dict[str, Any]:
+    with watcher.lock:
+        res = watcher.artifact.delete(company_id)
+        recommend_cache.invalidate()
+        return res
+
+def save_live() -> str:
+    """Publish in-place updates as a new artifact version (other workers reload it)."""
+    with watcher.lock:
+        version = watcher.artifact.save()
+        watcher.published()
+        return version
+
+@app.post("/companies")
+def upsert_endpoint():
+    """Body: one company object or a JSON array; id, every feature column, optional assets."""
+    refusal = live_refusal()
+    if refusal:
+        return jsonify({"error": refusal}), 409
+    data = request.get_json(force=True, silent=True)
+    if isinstance(data, dict):
+        res = upsert_companies([data])[0]
+        return (jsonify(res), 400) if "error" in res else jsonify(res)
+    if isinstance(data, list):
+        return jsonify(upsert_companies(data))
+    return jsonify({"error": "Body must be a company object or a JSON array of them."}), 400
+
+@app.delete("/companies/<company_id>")
+def delete_endpoint(company_id):
+    refusal = live_refusal()
+    if refusal:
+        return jsonify({"error": refusal}), 409
+    try:
+        return jsonify(delete_company(company_id))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 404
+
+@app.post("/artifact/save")
+def save_endpoint():
+    refusal = live_refusal()
+    if refusal:
+        return jsonify({"error": refusal}), 409
+    try:
+        return jsonify({"version": save_live()})
+    except Exception as e:
+        return jsonify({"error": f"Internal error: {e}"}), 500
+
+@app.post("/artifact/reload")
+def reload_endpoint():
+    # hot reload: new requests switch to the re-read artifact, in-flight ones finish on the old one
+    swapped = watcher.reload()
+    return jsonify({"reloaded": swapped, "version": watcher.artifact.version, "error": watcher.last_error})
+
+@app.get("/metrics")
+def metrics_endpoint():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.get("/stats")
+def stats_endpoint():
+    # per-worker: pid, artifact load time, RSS, whether the index has been built yet
+    return jsonify({**watcher.stats(), "cache": recommend_cache.stats(),
+                    "live_updates": {"enabled": LIVE_UPDATES, "writer": live_lock.held}})
+
 if __name__ == "__main__":
     # Dev server (for production use gunicorn/uwsgi)
     app.run(host="0.0.0.0", port=8000, debug=True)
@@ -0,0 +1,422 @@
+# hst_numpy.py
+"""
+NumPy-backed Half-Space Trees for bulk replay and training.
+Trees are stored as flat heap-ordered arrays (node i has children 2i+1 and
+2i+2): split feature, split value, l_mass and r_mass. Whole blocks of rows
+are scored/learned at once while reproducing River's score-then-learn
+semantics exactly, including the MinMaxScaler running min/max and window
+pivots, so scores match `MinMaxScaler | QuantileFilter(HalfSpaceTrees)`.
+
+    python hst_numpy.py [csv_path] [model.pkl]   # parity check vs River
+"""
+import math
+import random
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from features import NUMERIC_COLS
+
+PADDING = 0.15  # same padding River uses when building the trees
+
+class NumpyHST:
+    def __init__(self, n_features: int, n_trees: int = 25, height: int = 8,
+                 window_size: int = 250, seed: Optional[int] = 42):
+        self.n_features = n_features
+        self.n_trees = n_trees
+        self.height = height
+        self.window_size = window_size
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.limits: Dict[int, Tuple[float, float]] = {}  # per-feature split ranges, default (0, 1)
+        self.n_nodes = 2 ** (height + 1) - 1
+        self.n_internal = 2 ** height - 1
+        self.feature = np.full((n_trees, self.n_nodes), -1, dtype=np.int32)
+        self.threshold = np.zeros((n_trees, self.n_nodes), dtype=np.float64)
+        self.l_mass = np.zeros((n_trees, self.n_nodes), dtype=np.int64)
+        self.r_mass = np.zeros((n_trees, self.n_nodes), dtype=np.int64)
+        self.built = False
+        self.counter = 0
+        self.first_window = True
+
+    @property
+    def size_limit(self) -> float:
+        return 0.1 * self.window_size
+
+    @property
+    def max_score(self) -> int:
+        return self.n_trees * self.window_size * (2 ** (self.height + 1) - 1)
+
+    def build(self, feature_idx: Sequence[int], limits: Optional[Dict[int, Tuple[float, float]]] = None):
+        """
+        Build the random trees over `feature_idx` exactly as River's
+        make_padded_tree does (same rng call order), so a seeded NumpyHST and a
+        seeded HalfSpaceTrees grow identical trees.
+        """
+        limits = limits or {}
+        for t in range(self.n_trees):
+            lim = {i: limits.get(i, (0.0, 1.0)) for i in feature_idx}
+            self._grow(t, 0, lim, self.height)
+        self.built = True
+
+    def _grow(self, t: int, node: int, limits: Dict[int, Tuple[float, float]], height: int):
+        if height == 0:
+            return
+        on = self.rng.choices(population=list(limits.keys()),
+                              weights=[limits[i][1] - limits[i][0] for i in limits])[0]
+        a, b = limits[on]
+        at = self.rng.uniform(a + PADDING * (b - a), b - PADDING * (b - a))
+        self.feature[t, node] = on
+        self.threshold[t, node] = at
+        tmp = limits[on]
+        limits[on] = (tmp[0], at)
+        self._grow(t, 2 * node + 1, limits, height - 1)
+        limits[on] = tmp
+        limits[on] = (at, tmp[1])
+        self._grow(t, 2 * node + 2, limits, height - 1)
+        limits[on] = tmp
+
+    def _paths(self, Xs: np.ndarray, present: np.ndarray):
+        """Yield the (n_trees, n_rows) node index at every depth, root first."""
+        n = Xs.shape[0]
+        trees = np.arange(self.n_trees)[:, None]
+        rows = np.arange(n)[None, :]
+        node = np.zeros((self.n_trees, n), dtype=np.int64)
+        yield node
+        for _ in range(self.height):
+            f = self.feature[trees, node]
+            val = Xs[rows, f]
+            has = present[rows, f]
+            left = 2 * node + 1
+            right = left + 1
+            with np.errstate(invalid="ignore"):
+                go_left = np.where(has, val < self.threshold[trees, node],
+                                   # missing feature: follow the most visited child
+                                   ~(self.l_mass[trees, left] < self.l_mass[trees, right]))
+            node = np.where(go_left, left, right)
+            yield node
+
+    def score_block(self, Xs: np.ndarray, present: np.ndarray) -> np.ndarray:
+        """Scores for scaled rows; read-only. High = more anomalous."""
+        n = Xs.shape[0]
+        if self.first_window or not self.built:
+            return np.zeros(n, dtype=np.float64)
+        trees = np.arange(self.n_trees)[:, None]
+        total = np.zeros((self.n_trees, n), dtype=np.int64)
+        active = np.ones((self.n_trees, n), dtype=bool)
+        size_limit = self.size_limit
+        for depth, node in enumerate(self._paths(Xs, present)):
+            r = self.r_mass[trees, node]
+            total += np.where(active, r << depth, 0)
+            active &= r >= size_limit
+            if not active.any():
+                break
+        return 1.0 - total.sum(axis=0).astype(np.float64) / self.max_score
+
+    def learn_block(self, Xs: np.ndarray, present: np.ndarray):
+        """
+        Add the rows' root-to-leaf paths to l_mass. The caller guarantees the
+        block does not cross a window boundary; rows with missing split
+        features must come one at a time because their path depends on l_mass.
+        """
+        n = Xs.shape[0]
+        if n == 0:
+            return
+        flat_base = (np.arange(self.n_trees) * self.n_nodes)[:, None]
+        size = self.n_trees * self.n_nodes
+        counts = np.zeros(size, dtype=np.int64)
+        for node in self._paths(Xs, present):
+            counts += np.bincount((flat_base + node).ravel(), minlength=size)
+        self.l_mass += counts.reshape(self.n_trees, self.n_nodes)
+        self.counter += n
+        if self.counter == self.window_size:
+            self.r_mass[:] = self.l_mass
+            self.l_mass[:] = 0
+            self.first_window = False
+            self.counter = 0
+
+class NumpyHSTPipeline:
+    """MinMaxScaler -> HalfSpaceTrees -> quantile threshold, on arrays."""
+
+    def __init__(self, feature_names: Sequence[str] = NUMERIC_COLS, n_trees: int = 25,
+                 height: int = 8, window_size: int = 250, seed: Optional[int] = 42,
+                 q: Optional[float] = 0.995, quantile=None):
+        """
+        q: quantile of the running score distribution used as the anomaly
+           threshold; None disables thresholding (scores only)
+        quantile: running estimator with update()/get(); River's
+                  stats.Quantile(q) when not given
+        """
+        self.feature_names = list(feature_names)
+        d = len(self.feature_names)
+        self.mins = np.full(d, np.inf)
+        self.maxs = np.full(d, -np.inf)
+        self.hst = NumpyHST(d, n_trees=n_trees, height=height, window_size=window_size, seed=seed)
+        self.q = q
+        if quantile is None and q is not None:
+            from river import stats
+            quantile = stats.Quantile(q=q)
+        self.quantile = quantile
+
+    # ---- scaling ----
+    @staticmethod
+    def _scale(X: np.ndarray, mins: np.ndarray, maxs: np.ndarray) -> np.ndarray:
+        # River's safe_div: (x - min) / (max - min), or 0.0 when max == min
+        with np.errstate(invalid="ignore", divide="ignore"):
+            denom = maxs - mins
+            return np.where(denom != 0, (X - mins) / np.where(denom != 0, denom, 1.0), 0.0)
+
+    def _running_bounds(self, X: np.ndarray, present: np.ndarray):
+        """Per-row scaler bounds before and after learning each row."""
+        post_min = np.minimum.accumulate(np.where(present, X, np.inf), axis=0)
+        post_max = np.maximum.accumulate(np.where(present, X, -np.inf), axis=0)
+        np.minimum(post_min, self.mins, out=post_min)
+        np.maximum(post_max, self.maxs, out=post_max)
+        pre_min = np.vstack([self.mins[None, :], post_min[:-1]])
+        pre_max = np.vstack([self.maxs[None, :], post_max[:-1]])
+        return pre_min, pre_max, post_min, post_max
+
+    def transform(self, X: np.ndarray) -> np.ndarray:
+        return self._scale(X, self.mins, self.maxs)
+
+    # ---- inference ----
+    def score(self, X: np.ndarray) -> np.ndarray:
+        """Score rows against the current state without learning (like score_one per row)."""
+        X = np.asarray(X, dtype=np.float64)
+        present = ~np.isnan(X)
+        return self.hst.score_block(self.transform(X), present)
+
+    def threshold(self) -> float:
+        if self.quantile is None:
+            return math.inf
+        return self.quantile.get() or math.inf
+
+    def classify(self, scores: np.ndarray) -> np.ndarray:
+        return (np.asarray(scores) >= self.threshold()).astype(np.int64)
+
+    def score_learn(self, X: np.ndarray, block: int = 0,
+                    learn_scaled: str = "post") -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Prequential replay: for every row, score and classify against the state
+        before that row, then learn it -- the same results as calling
+        inference.predict_one(row, model, learn=True) in a loop.
+        learn_scaled="pre" instead feeds the HST the row scaled *before* the
+        scaler learned it, like the component-wise loop in
+        streaming_hst_template.py.
+        Returns (scores, is_anomaly).
+        """
+        X = np.asarray(X, dtype=np.float64)
+        present = ~np.isnan(X)
+        n = X.shape[0]
+        scores = np.zeros(n, dtype=np.float64)
+        is_anom = np.zeros(n, dtype=np.int64)
+        keep = present.any(axis=1)   # rows with no features are skipped, as in row_to_x
+        idx = np.flatnonzero(keep)
+        i = 0
+        while i < len(idx):
+            if not self.hst.built:
+                # River builds the trees from sorted(x) of the first learned row
+                first = np.flatnonzero(present[idx[i]]).tolist()
+                self.hst.build(sorted(first, key=lambda c: self.feature_names[c]), self.hst.limits)
+            room = self.hst.window_size - self.hst.counter
+            seg = idx[i:i + min(room, block or room)]
+            Xb, Pb = X[seg], present[seg]
+            if not Pb[:, self._tree_features()].all():
+                seg = seg[:1]  # missing split feature: path depends on l_mass, go row by row
+                Xb, Pb = X[seg], present[seg]
+            s_pre, s_post = self._step(Xb, Pb, learn_scaled)
+            scores[seg] = s_pre
+            if self.quantile is not None:
+                for j, k in enumerate(seg):
+                    is_anom[k] = int(s_pre[j] >= (self.quantile.get() or math.inf))
+                    self.quantile.update(float(s_post[j]))
+            i += len(seg)
+        return scores, is_anom
+
+    def learn(self, X: np.ndarray, block: int = 0):
+        """Train on rows in order (same end state as model.learn_one per row)."""
+        self.score_learn(X, block=block)
+
+    def _tree_features(self) -> np.ndarray:
+        f = np.unique(self.hst.feature[:, :self.hst.n_internal])
+        return f[f >= 0]
+
+    def _step(self, X: np.ndarray, present: np.ndarray, learn_scaled: str = "post"):
+        pre_min, pre_max, post_min, post_max = self._running_bounds(X, present)
+        xs_pre = self._scale(X, pre_min, pre_max)
+        s_pre = self.hst.score_block(xs_pre, present)
+        if learn_scaled == "pre":
+            s_post = s_pre
+            self.hst.learn_block(xs_pre, present)
+        else:
+            xs_post = self._scale(X, post_min, post_max)
+            # QuantileFilter.learn_one scores the post-scaling row before the HST learns it
+            s_post = self.hst.score_block(xs_post, present) if self.quantile is not None else s_pre
+            self.hst.learn_block(xs_post, present)
+        self.mins, self.maxs = post_min[-1].copy(), post_max[-1].copy()
+        return s_pre, s_post
+
+    # ---- River interop ----
+    @classmethod
+    def from_river(cls, pipeline, feature_names: Optional[Sequence[str]] = None) -> "NumpyHSTPipeline":
+        """
+        Convert a (pickled) `MinMaxScaler | QuantileFilter(HalfSpaceTrees)` pipeline.
+        feature_names defaults to NUMERIC_COLS followed by any other feature
+        the scaler has seen (e.g. window_features.py columns).
+        """
+        scaler, qf = pipeline["scale"], pipeline["filter"]
+        if qf.protect_anomaly_detector:
+            raise ValueError("protect_anomaly_detector=True is not supported by the NumPy engine.")
+        hst = qf.anomaly_detector
+        if feature_names is None:
+            seen = dict.fromkeys(list(scaler.min) + list(scaler.max))
+            feature_names = NUMERIC_COLS + [f for f in seen if f not in NUMERIC_COLS]
+        names = list(feature_names)
+        col = {c: i for i, c in enumerate(names)}
+        unknown = [f for f in list(scaler.min) + list(scaler.max) if f not in col]
+        if unknown:
+            raise ValueError(f"Model uses features not in feature_names: {sorted(set(unknown))}")
+
+        out = cls(names, n_trees=hst.n_trees, height=hst.height, window_size=hst.window_size,
+                  seed=hst.seed, q=qf.q, quantile=_copy(qf.quantile))
+        for f, st in scaler.min.items():
+            out.mins[col[f]] = st.get()
+        for f, st in scaler.max.items():
+            out.maxs[col[f]] = st.get()
+
+        h = out.hst
+        h.limits = {col[f]: tuple(v) for f, v in hst.limits.items() if f in col}
+        h.rng.setstate(hst.rng.getstate())
+        h.counter = hst.counter
+        h.first_window = hst._first_window
+        for t, root in enumerate(hst.trees):
+            stack = [(root, 0)]
+            while stack:
+                node, i = stack.pop()
+                h.l_mass[t, i] = node.l_mass
+                h.r_mass[t, i] = node.r_mass
+                children = getattr(node, "children", None)
+                if children:
+                    if node.feature not in col:
+                        raise ValueError(f"Tree splits on unknown feature '{node.feature}'.")
+                    h.feature[t, i] = col[node.feature]
+                    h.threshold[t, i] = node.threshold
+                    stack.append((children[0], 2 * i + 1))
+                    stack.append((children[1], 2 * i + 2))
+        h.built = bool(hst.trees)
+        return out
+
+    def to_river(self):
+        """Build an equivalent River pipeline (e.g. to serve a NumPy-trained model)."""
+        from river import anomaly, compose, preprocessing
+        from river.anomaly import hst as river_hst
+
+        h = self.hst
+        det = anomaly.HalfSpaceTrees(n_trees=h.n_trees, height=h.height, window_size=h.window_size,
+                                     limits={self.feature_names[i]: v for i, v in h.limits.items()} or None,
+                                     seed=h.seed)
+        det.rng.setstate(h.rng.getstate())
+        det.counter = h.counter
+        det._first_window = h.first_window
+        if h.built:
+            names = self.feature_names
+            new, leaf_cls, branch_cls = object.__new__, river_hst.HSTLeaf, river_hst.HSTBranch
+            trees = []
+            for t in range(h.n_trees):
+                # heap arrays -> nodes, leaves first so every branch finds its children
+                # built; attributes are set directly (as the constructors would) since
+                # thousands of __init__ calls dominate load time
+                feature, threshold = h.feature[t].tolist(), h.threshold[t].tolist()
+                l_mass, r_mass = h.l_mass[t].tolist(), h.r_mass[t].tolist()
+                nodes: List[Any] = [None] * h.n_nodes
+                for i in range(h.n_nodes - 1, h.n_internal - 1, -1):
+                    node = new(leaf_cls)
+                    node.__dict__ = {"r_mass": r_mass[i], "l_mass": l_mass[i]}
+                    nodes[i] = node
+                for i in range(h.n_internal - 1, -1, -1):
+                    node = new(branch_cls)
+                    node.__dict__ = {"children": (nodes[2 * i + 1], nodes[2 * i + 2]), "feature": names[feature[i]],
+                                     "threshold": threshold[i], "l_mass": l_mass[i], "r_mass": r_mass[i]}
+                    nodes[i] = node
+                trees.append(nodes[0])
+            det.trees = trees
+            if hasattr(det, "_tree_nodes"):
+                det._tree_nodes = [list(t.iter_dfs()) for t in trees]
+
+        if self.quantile is None:
+            raise ValueError("to_river() needs a quantile threshold (q is None).")
+        qf = anomaly.QuantileFilter(det, q=self.q, protect_anomaly_detector=False)
+        qf.quantile = _copy(self.quantile)
+        scaler = preprocessing.MinMaxScaler()
+        for i, f in enumerate(self.feature_names):
+            if np.isfinite(self.mins[i]):
+                scaler.min[f].update(float(self.mins[i]))
+                scaler.max[f].update(float(self.maxs[i]))
+        return compose.Pipeline(("scale", scaler), ("filter", qf))
+
+def _copy(obj):
+    import cloudpickle as pickle
+    return pickle.loads(pickle.dumps(obj))
+
+def load_matrix(csv_path, feature_names: Sequence[str] = NUMERIC_COLS) -> np.ndarray:
+    """Sensor CSV -> float matrix in feature_names order, NaN where missing/unparsable."""
+    from ingest import read_matrix
+    return read_matrix(csv_path, feature_names)
+
+def parity_check(csv_path, model_path: Optional[Path] = None) -> Dict[str, Any]:
+    """
+    Replay the CSV prequentially through River (predict_one with learn=True)
+    and through the NumPy engine from the same starting model; report the
+    largest score difference and any is_anomaly mismatches.
+    """
+    import csv
+    import cloudpickle as pickle
+    from inference import predict_one, row_to_x
+
+    if model_path:
+        with open(model_path, "rb") as f:
+            river_model = pickle.load(f)
+    else:
+        from train_save_river import build_model
+        river_model = build_model(q=0.995)
+    np_model = NumpyHSTPipeline.from_river(river_model)
+
+    t0 = time.perf_counter()
+    ref_scores, ref_anom = [], []
+    with open(csv_path, "r", newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            if not row_to_x(row):
+                continue
+            r = predict_one(row, river_model, learn=True)
+            ref_scores.append(r["score"])
+            ref_anom.append(r["is_anomaly"])
+    t_river = time.perf_counter() - t0
+
+    X = load_matrix(csv_path)
+    t0 = time.perf_counter()
+    scores, anom = np_model.score_learn(X)
+    t_numpy = time.perf_counter() - t0
+    keep = ~np.isnan(X).all(axis=1)
+    scores, anom = scores[keep], anom[keep]
+
+    ref_scores = np.asarray(ref_scores)
+    return {
+        "rows": int(len(ref_scores)),
+        "max_abs_score_diff": float(np.max(np.abs(scores - ref_scores))) if len(scores) else 0.0,
+        "is_anomaly_mismatches": int(np.sum(anom != np.asarray(ref_anom))),
+        "river_s": t_river,
+        "numpy_s": t_numpy,
+    }
+
+if __name__ == "__main__":
+    csv_path = sys.argv[1] if len(sys.argv) > 1 else "MachineSensorData_anomalies.csv"
+    model_path = Path(sys.argv[2]) if len(sys.argv) > 2 else None
+    res = parity_check(csv_path, model_path)
+    print(f"{res['rows']} rows | max |score diff| = {res['max_abs_score_diff']:.3g} | "
+          f"is_anomaly mismatches = {res['is_anomaly_mismatches']} | "
+          f"river {res['river_s']:.2f}s vs numpy {res['numpy_s']:.2f}s")
+    if res["max_abs_score_diff"] != 0.0 or res["is_anomaly_mismatches"]:
+        sys.exit(1)
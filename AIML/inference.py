@@ -1,55 +1,139 @@
 # inference.py
-from typing import Dict, Any
+import json
+from typing import Dict, Any, List, Tuple
 from pathlib import Path
 import cloudpickle as pickle  # or pickle/dill
 
+import model_format
+from fileutil import write_atomic
+from features import NUMERIC_COLS, SCHEMA
+from metrics import REGISTRY, RateWindow, phase
+
 MODEL_PATH = Path("/Users/vishnuadithya/Documents/Projects/caterpillars/smart_rental_system/hst_quantile_model.pkl")
 
-# Reuse NUMERIC_COLS and row_to_x from training if you share a utils module
-NUMERIC_COLS = [
-    "avg_fuel_consumption_rate",
-    "idle_fuel_consumption_pct",
-    "rpm_variance",
-    "coolant_temp_anomalies",
-    "productive_time_mins",
-    "idle_time_mins",
-    "vibration_anomalies",
-    "over_speed_events",
-    "tire_pressure_deviations",
-    "error_code_frequency",
-    "battery_low_voltage_events",
-]
-
-def row_to_x(event: Dict[str, Any]) -> Dict[str, float]:
-    x = {}
-    for c in NUMERIC_COLS:
-        v = event.get(c)
-        if v not in (None, ""):
-            try:
-                x[c] = float(v)
-            except Exception:
-                pass
-    return x
+# feature columns and event parsing shared with training and the batch jobs
+row_to_x = SCHEMA.to_x
+
+# mode "one": per event (predict_one, AnomalyService.predict, checkpoint saves);
+# mode "batch": per call (predict_batch, each learn-queue apply)
+PHASE_SECONDS = REGISTRY.histogram("anomaly_phase_seconds", "Anomaly model time per phase (parse/score/learn/save).",
+                                   ("phase", "mode"))
+PREDICTIONS = REGISTRY.counter("anomaly_predictions_total", "Events scored, by outcome.", ("result",))
+ANOMALY_RATE = RateWindow()
+REGISTRY.gauge("anomaly_rate", "Share of anomalies among the most recent scored events.").set_function(ANOMALY_RATE.rate)
+
+def record_outcomes(flags: List[int]):
+    """Count scored events and feed the anomaly-rate window."""
+    n_anom = sum(flags)
+    if n_anom:
+        PREDICTIONS.inc("anomaly", n=n_anom)
+    if len(flags) > n_anom:
+        PREDICTIONS.inc("normal", n=len(flags) - n_anom)
+    ANOMALY_RATE.add_many(flags)
 
 def load_model(model_path: Path = MODEL_PATH):
+    # binary models (model_format.py) are recognised by their magic bytes; anything else is a pickle
+    if model_format.is_binary(model_path):
+        return model_format.load(model_path)
     with open(model_path, "rb") as f:
         return pickle.load(f)
 
-def predict_one(event: Dict[str, Any], model, learn: bool = False) -> Dict[str, Any]:
+def dump_model(model, model_path: Path = MODEL_PATH) -> bytes:
+    """Serialized model: the binary format for *.hstm paths, else a cloudpickle."""
+    return model_format.dumps(model) if model_format.wants_binary(model_path) else pickle.dumps(model)
+
+def save_model(model, model_path: Path = MODEL_PATH):
+    write_atomic(model_path, dump_model(model, model_path))
+
+def predict_one(event: Dict[str, Any], model, learn: bool = False, threshold=None) -> Dict[str, Any]:
     """
     event: dict with numeric fields
     model: the loaded river Pipeline
     learn: if True, keep adapting model after predicting
+    threshold: optional quantile tracker from quantiles.py (update/get) used
+               instead of the pipeline's QuantileFilter to classify; it is
+               fed the returned score when learn=True
     """
+    with phase(PHASE_SECONDS, "parse", "one"):
+        x = event_to_x(event)
+    with phase(PHASE_SECONDS, "score", "one"):
+        score, is_anom = score_x(x, model, threshold)
+    record_outcomes([is_anom])
+
+    if learn:
+        with phase(PHASE_SECONDS, "learn", "one"):
+            model.learn_one(x)  # updates scaler, HST, and the quantile threshold
+            if threshold is not None:
+                threshold.update(score)
+
+    return {"score": score, "is_anomaly": is_anom}
+
+def event_to_x(event: Dict[str, Any]) -> Dict[str, float]:
     x = row_to_x(event)
     if not x:
         raise ValueError("No numeric features present in event.")
+    return x
 
-    # score using scaler->HST, then classify via QuantileFilter
+def score_x(x: Dict[str, float], model, threshold=None) -> Tuple[float, int]:
+    """Read-only scoring: never mutates the model, so it is safe under a shared read lock."""
+    # score using scaler->HST, then classify via QuantileFilter (or the given tracker)
     score = model.score_one(x)              # high = more anomalous
-    is_anom = int(model["filter"].classify(score))  # 0/1
+    if threshold is None:
+        is_anom = int(model["filter"].classify(score))  # 0/1
+    else:
+        thr = threshold.get()
+        is_anom = int(thr is not None and score >= thr)
+    return float(score), is_anom
 
-    if learn:
-        model.learn_one(x)  # updates scaler, HST, and the quantile threshold
 
-    return {"score": float(score), "is_anomaly": is_anom}
+def parse_events(body, content_type: str = "") -> List[Any]:
+    """
+    Parse a batch request body into a list of events.
+    Accepts a JSON array, or NDJSON (one JSON object per line) when the
+    content type says so. Malformed NDJSON lines become ValueError entries so
+    predict_batch can report them per item instead of failing the batch.
+    """
+    if isinstance(body, bytes):
+        body = body.decode("utf-8")
+    ctype = (content_type or "").lower()
+    if "ndjson" in ctype or "jsonl" in ctype or "json-seq" in ctype:
+        events: List[Any] = []
+        for lineno, line in enumerate(body.splitlines(), start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                events.append(json.loads(line))
+            except json.JSONDecodeError as e:
+                events.append(ValueError(f"Invalid JSON on line {lineno}: {e.msg}"))
+        return events
+
+    data = json.loads(body or "[]")
+    if not isinstance(data, list):
+        raise ValueError("Batch body must be a JSON array of events (or NDJSON).")
+    return data
+
+def predict_batch(events: List[Any], model, learn: bool = False) -> List[Dict[str, Any]]:
+    """
+    events: list of event dicts, scored in order
+    model: the loaded river Pipeline
+    learn: if True, each event is scored and then learned before the next one,
+           exactly as a sequence of predict_one calls would do
+    Returns one result per event, in order; a failing event yields {"error": ...}
+    instead of failing the whole batch.
+    """
+    results: List[Dict[str, Any]] = []
+    for event in events:
+        if isinstance(event, Exception):
+            results.append({"error": str(event)})
+            continue
+        if not isinstance(event, dict):
+            results.append({"error": "Event must be a JSON object."})
+            continue
+        try:
+            results.append(predict_one(event, model, learn=learn))
+        except ValueError as e:
+            results.append({"error": str(e)})
+        except Exception as e:
+            results.append({"error": f"Internal error: {e}"})
+    return results
@@ -0,0 +1,307 @@
+# ingest.py
+"""
+Chunked, typed ingestion of the sensor CSV exports.
+Instead of csv.DictReader + float() per field (or one big pd.read_csv),
+the file is read `chunksize` rows at a time with the feature columns typed
+as float64, and handed out as NumPy blocks (meta, X) or as per-row feature
+dicts. Unparsable or missing values become NaN in blocks and are left out
+of feature dicts, the same as row_to_x.
+With `cache_dir` set, the parsed columns are also written to an NPY (or,
+with pyarrow installed, Parquet) cache keyed on the source file's size and
+mtime, so reruns on an unchanged export skip parsing entirely.
+"""
+import csv
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from features import NUMERIC_COLS
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+except ImportError:  # optional: the pandas reader and NPY cache need nothing extra
+    pa = pa_csv = pq = None
+
+CHUNK_ROWS = 100_000    # rows per block
+ENGINE = "auto"         # "auto" (pyarrow if installed) | "pandas" | "pyarrow"
+CACHE_FORMAT = "npy"    # "npy" | "parquet" (needs pyarrow)
+_ARROW_ROW_BYTES = 128  # rough bytes per sensor row, to size pyarrow's read blocks
+
+Block = Tuple[Dict[str, np.ndarray], np.ndarray]  # (meta column -> str array, float64 X)
+
+def read_header(path) -> List[str]:
+    with open(path, "r", newline="", encoding="utf-8") as f:
+        return next(csv.reader(f), [])
+
+def _to_block(df: pd.DataFrame, features: Sequence[str], meta: Sequence[str]) -> Block:
+    n = len(df)
+    X = np.empty((n, len(features)), dtype=np.float64)
+    for j, c in enumerate(features):
+        if c not in df.columns:
+            X[:, j] = np.nan
+            continue
+        s = df[c]
+        if s.dtype == object:
+            s = pd.to_numeric(s.where(s != ""), errors="coerce")
+        X[:, j] = s.to_numpy(dtype=np.float64, na_value=np.nan)
+    m = {c: (df[c].fillna("").to_numpy(dtype=str) if c in df.columns else np.full(n, "", dtype=str))
+         for c in meta}
+    return m, X
+
+class _ByteRange(io.RawIOBase):
+    """Bytes [start, end) of an open binary file (end=None: to EOF), as a readable stream."""
+
+    def __init__(self, f, start: int, end: Optional[int]):
+        f.seek(start)
+        self._f = f
+        self._left = None if end is None else max(0, end - start)
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        n = len(b) if self._left is None else min(len(b), self._left)
+        data = self._f.read(n)
+        b[:len(data)] = data
+        if self._left is not None:
+            self._left -= len(data)
+        return len(data)
+
+def _read_csv(path, present, done, offset, end=None, **kwargs) -> Iterator[pd.DataFrame]:
+    """
+    pd.read_csv chunks skipping `done` data rows; from byte `offset` (a row
+    start) if set, and up to byte `end` (a row start, e.g. data_end) if set.
+    """
+    if not offset and end is None:
+        yield from pd.read_csv(path, skiprows=range(1, done + 1), **kwargs)
+        return
+    with open(path, "rb") as f:
+        src = io.BufferedReader(_ByteRange(f, offset, end))
+        if offset:
+            yield from pd.read_csv(src, header=None, names=present, skiprows=range(done), **kwargs)
+        else:
+            yield from pd.read_csv(src, skiprows=range(1, done + 1), **kwargs)
+
+def _pandas_frames(path, features, meta, present, chunksize, skip=0, offset=0,
+                   end=None) -> Iterator[pd.DataFrame]:
+    usecols = [c for c in present if c in set(features) | set(meta)]
+    typed = {c: (np.float64 if c in features else str) for c in usecols}
+    done = skip
+    try:
+        # float_precision="round_trip" parses exactly like float(), so values
+        # match the csv.DictReader path bit for bit
+        for df in _read_csv(path, present, done, offset, end, usecols=usecols, dtype=typed, chunksize=chunksize,
+                            keep_default_na=False, na_values={c: [""] for c in features},
+                            float_precision="round_trip"):
+            done += len(df)
+            yield df
+        return
+    except ValueError:
+        pass  # junk text in a feature column: finish the file leniently
+    for df in _read_csv(path, present, done, offset, end, usecols=usecols, dtype=str, chunksize=chunksize,
+                        keep_default_na=False):
+        yield df
+
+def _arrow_frames(path, features, meta, present, chunksize) -> Iterator[pd.DataFrame]:
+    usecols = [c for c in present if c in set(features) | set(meta)]
+    types = {c: (pa.float64() if c in features else pa.string()) for c in usecols}
+    reader = pa_csv.open_csv(
+        str(path),
+        read_options=pa_csv.ReadOptions(block_size=max(1 << 20, chunksize * _ARROW_ROW_BYTES)),
+        convert_options=pa_csv.ConvertOptions(column_types=types, include_columns=usecols,
+                                              strings_can_be_null=False),
+    )
+    done = 0
+    try:
+        for batch in reader:
+            done += batch.num_rows
+            yield batch.to_pandas()
+    except pa.ArrowInvalid:
+        # same lenient fallback as the pandas reader, from the first unread row
+        yield from _pandas_frames(path, features, meta, present, chunksize, skip=done)
+
+def _parse_blocks(path, features, meta, chunksize, engine, offset=0, end=None) -> Iterator[Block]:
+    present = read_header(path)
+    if offset or end is not None:  # a byte range (append-only exports): pandas reads from a stream
+        engine = "pandas"
+    if engine == "auto":
+        engine = "pyarrow" if pa_csv is not None else "pandas"
+    if engine == "pyarrow":
+        if pa_csv is None:
+            raise ImportError("engine='pyarrow' needs `pip install pyarrow`.")
+        frames = _arrow_frames(path, features, meta, present, chunksize)
+    elif engine == "pandas":
+        frames = _pandas_frames(path, features, meta, present, chunksize, offset=offset, end=end)
+    else:
+        raise ValueError(f"Unknown engine '{engine}'. Use 'auto', 'pandas' or 'pyarrow'.")
+    for df in frames:
+        yield _to_block(df, features, meta)
+
+# ---- cache ----
+
+def _cache_dir_for(path, features, meta, cache_dir, fmt) -> Path:
+    path = Path(path).resolve()
+    key = json.dumps([str(path), list(features), list(meta), fmt])
+    return Path(cache_dir) / f"{path.stem}-{hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]}"
+
+def _source_sig(path) -> Dict[str, Any]:
+    st = os.stat(path)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+def _read_cache(target: Path, features, meta, chunksize) -> Iterator[Block]:
+    manifest = json.loads((target / "manifest.json").read_text())
+    if manifest["format"] == "parquet":
+        pf = pq.ParquetFile(str(target / "data.parquet"))
+        for batch in pf.iter_batches(batch_size=chunksize):
+            cols = dict(zip(batch.schema.names, batch.columns))
+            X = np.column_stack([cols[f].to_numpy(zero_copy_only=False) for f in features]) \
+                if features else np.empty((batch.num_rows, 0))
+            m = {c: cols[c].to_numpy(zero_copy_only=False).astype(str) for c in meta}
+            yield m, X.astype(np.float64, copy=False)
+        return
+    for i in range(len(manifest["chunks"])):
+        X = np.load(target / f"X_{i:05d}.npy", mmap_mode="r")
+        with np.load(target / f"meta_{i:05d}.npz") as z:
+            m = {c: z[c] for c in meta}
+        yield m, X
+
+def _write_through(blocks: Iterator[Block], path, target: Path, features, meta, fmt) -> Iterator[Block]:
+    """Yield blocks while writing them to a temp dir; publish it only if fully consumed."""
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp = Path(tempfile.mkdtemp(dir=target.parent, prefix=f".{target.name}."))
+    sig = _source_sig(path)
+    chunks: List[int] = []
+    writer = None
+    done = False
+    try:
+        for m, X in blocks:
+            i = len(chunks)
+            if fmt == "parquet":
+                cols = {f: X[:, j] for j, f in enumerate(features)}
+                cols.update(m)
+                table = pa.Table.from_pydict(cols)
+                if writer is None:
+                    writer = pq.ParquetWriter(str(tmp / "data.parquet"), table.schema)
+                writer.write_table(table)
+            else:
+                np.save(tmp / f"X_{i:05d}.npy", X)
+                np.savez(tmp / f"meta_{i:05d}.npz", **m)
+            chunks.append(int(len(X)))
+            yield m, X
+        if writer is not None:
+            writer.close()
+            writer = None
+        manifest = {"source": str(Path(path).resolve()), **sig, "features": list(features),
+                    "meta": list(meta), "format": fmt, "chunks": chunks}
+        (tmp / "manifest.json").write_text(json.dumps(manifest))
+        if target.exists():
+            shutil.rmtree(target, ignore_errors=True)  # stale cache of an older export
+        try:
+            os.rename(tmp, target)
+            done = True
+        except OSError:
+            pass  # another process published the same cache first
+    finally:
+        if writer is not None:
+            writer.close()
+        if not done:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+def _cache_valid(target: Path, path) -> bool:
+    try:
+        manifest = json.loads((target / "manifest.json").read_text())
+    except (OSError, ValueError):
+        return False
+    sig = _source_sig(path)
+    return manifest.get("size") == sig["size"] and manifest.get("mtime_ns") == sig["mtime_ns"]
+
+# ---- public API ----
+
+def iter_blocks(path, features: Sequence[str] = NUMERIC_COLS, meta: Sequence[str] = (),
+                chunksize: int = CHUNK_ROWS, engine: str = ENGINE,
+                cache_dir: Optional[Path] = None, cache_format: str = CACHE_FORMAT,
+                offset: int = 0, end: Optional[int] = None) -> Iterator[Block]:
+    """
+    Yield (meta, X) blocks of up to `chunksize` rows, in file order.
+    X is float64 in `features` order (NaN = missing/unparsable); meta maps
+    each column in `meta` to a str array ("" when missing).
+    Cached NPY blocks keep the chunking they were written with.
+    offset: byte position of a data row to start from (see data_end), for
+    reading only what was appended since a previous run; never cached.
+    end: byte position to stop at (a data_end taken earlier), so a row still
+    being written, or rows appended meanwhile, are left for the next run;
+    never cached.
+    """
+    features, meta = list(features), list(meta)
+    if cache_dir is None or offset or end is not None:
+        yield from _parse_blocks(path, features, meta, chunksize, engine, offset, end)
+        return
+    if cache_format not in ("npy", "parquet"):
+        raise ValueError(f"Unknown cache_format '{cache_format}'. Use 'npy' or 'parquet'.")
+    if cache_format == "parquet" and pq is None:
+        raise ImportError("cache_format='parquet' needs `pip install pyarrow`.")
+    target = _cache_dir_for(path, features, meta, cache_dir, cache_format)
+    if _cache_valid(target, path):
+        yield from _read_cache(target, features, meta, chunksize)
+        return
+    yield from _write_through(_parse_blocks(path, features, meta, chunksize, engine),
+                              path, target, features, meta, cache_format)
+
+def data_end(path) -> int:
+    """Byte offset just past the last complete line, i.e. where the next appended row starts."""
+    with open(path, "rb") as f:
+        end = f.seek(0, os.SEEK_END)
+        pos = end
+        while pos > 0:
+            step = min(1 << 16, pos)
+            f.seek(pos - step)
+            buf = f.read(step)
+            nl = buf.rfind(b"\n")
+            if nl >= 0:
+                return pos - step + nl + 1
+            pos -= step
+    return 0
+
+def iter_feature_dicts(path, features: Sequence[str] = NUMERIC_COLS, meta: Sequence[str] = (),
+                       skip_empty: bool = True, **kwargs) -> Iterator[Tuple[Dict[str, str], Dict[str, float]]]:
+    """
+    Row-at-a-time view for River: yields (meta_row, x) like a DictReader
+    row passed through row_to_x. Rows without any feature are skipped
+    unless skip_empty=False.
+    """
+    features = list(features)
+    for m, X in iter_blocks(path, features, meta, **kwargs):
+        meta_rows = [dict(zip(m, vals)) for vals in zip(*m.values())] if m else None
+        for i, row in enumerate(X.tolist()):
+            x = {c: v for c, v in zip(features, row) if v == v}  # v == v drops NaN
+            if not x and skip_empty:
+                continue
+            yield (meta_rows[i] if meta_rows is not None else {}), x
+
+def read_matrix(path, features: Sequence[str] = NUMERIC_COLS, **kwargs) -> np.ndarray:
+    """Whole file as one float64 matrix (NaN = missing), read in chunks."""
+    blocks = [X for _, X in iter_blocks(path, features, **kwargs)]
+    return np.concatenate(blocks) if blocks else np.empty((0, len(features)))
+
+def read_frame(path, features: Sequence[str] = NUMERIC_COLS, meta: Sequence[str] = (), **kwargs) -> pd.DataFrame:
+    """Typed DataFrame of the meta + feature columns, assembled from chunks."""
+    features, meta = list(features), list(meta)
+    frames = []
+    for m, X in iter_blocks(path, features, meta, **kwargs):
+        df = pd.DataFrame(np.asarray(X), columns=features)
+        for c in reversed(meta):
+            df.insert(0, c, m[c])
+        frames.append(df)
+    if not frames:
+        return pd.DataFrame(columns=meta + features)
+    return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,400 @@
+# knn_artifact.py
+"""
+Memory-mapped artifact for the company KNN recommender.
+An artifact is a directory of raw .npy arrays plus a small meta.json:
+  Xs      standardized feature matrix (n, f) float64
+  ids     company ids as strings (n,)
+  assets  raw asset/utilization columns (n, a) float64, NaN = missing
+  extra   optional passthrough text columns (industry, state, ...)
+  nbr_*   optional neighbour table: each row's K_max nearest other rows
+          (indices, distances) and, for every k <= K_max, the mean of each
+          asset column over the first k of them, so recommend() is a lookup
+Arrays are opened with np.load(mmap_mode="r"), so gunicorn workers share one
+copy through the page cache instead of each unpickling a DataFrame; the
+neighbour index (knn_index.py, chosen at training time) is rebuilt lazily
+on first use.
+Writers drop new versioned array files first and then atomically replace
+meta.json, so a reader always sees one complete version; writers to one
+directory take turns on a lock file there.
+
+    python knn_artifact.py [artifact_dir]                      # load time + RSS
+    python knn_artifact.py convert [legacy.joblib] [out_dir]   # one-off legacy conversion
+"""
+import json
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from fileutil import file_lock, write_atomic
+from knn_index import build_from_spec, index_spec
+
+ARTIFACT_DIR = Path("knn_recommender")
+LEGACY_ARTIFACT_PATH = Path("knn_recommender.joblib")
+FORMAT_VERSION = 1
+INDEX_SPEC = index_spec("brute")  # brute keeps the index on the shared mmap
+K_MAX = 20                           # neighbours precomputed per company (0 = no table)
+LOCK_NAME = ".write.lock"            # held while a version is written and older ones removed
+LOCK_CONVERT_NAME = ".convert.lock"  # held while a legacy .joblib is converted
+RELOAD_CHECK_S = 1.0                 # how often ArtifactWatcher stats meta.json
+_NEIGHBOR_CHUNK = 4096               # query rows per kneighbors call while precomputing
+_OPEN_ATTEMPTS = 5                   # meta.json rereads when a concurrent save removes the arrays
+
+def rss_mb() -> Optional[float]:
+    """Resident set size of this process in MiB (Linux /proc, else peak RSS)."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024.0 * 1024.0) if sys.platform == "darwin" else peak / 1024.0
+    except ImportError:
+        return None
+
+def save_artifact(out_dir: Path, ids: Sequence[Any], Xs: np.ndarray, assets: np.ndarray,
+                  asset_cols: List[str], feature_cols: List[str], id_col: str,
+                  mean: np.ndarray, scale: np.ndarray,
+                  extra: Optional[Dict[str, Sequence[Any]]] = None,
+                  index: Optional[Dict[str, Any]] = None,
+                  neighbors: Optional[Dict[str, np.ndarray]] = None) -> Path:
+    """
+    Write a new version of the artifact into out_dir and publish it atomically.
+    index: knn_index.index_spec() of the neighbour index workers should build
+    neighbors: output of precompute_neighbors (nbr_idx, nbr_dist, nbr_means)
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    # one writer at a time per directory (other processes included), so the cleanup
+    # below never deletes arrays a concurrent save has written but not yet published
+    with file_lock(out_dir / LOCK_NAME):
+        stamp = f"{time.time_ns():x}"
+        arrays = {
+            "Xs": np.ascontiguousarray(Xs, dtype=np.float64),
+            "ids": np.asarray([str(i) for i in ids], dtype=str),
+            "assets": np.ascontiguousarray(assets, dtype=np.float64),
+        }
+        for c, vals in (extra or {}).items():
+            arrays[f"extra.{c}"] = np.asarray(["" if v is None else str(v) for v in vals], dtype=str)
+        for name, arr in (neighbors or {}).items():
+            arrays[name] = np.ascontiguousarray(arr)
+        files = {}
+        for name, arr in arrays.items():
+            fname = f"{name}-{stamp}.npy"
+            np.save(out_dir / fname, arr)
+            files[name] = fname
+        meta = {
+            "format_version": FORMAT_VERSION,
+            "version": stamp,
+            "created_at": time.time(),
+            "n_rows": int(len(arrays["ids"])),
+            "id_col": id_col,
+            "feature_cols": list(feature_cols),
+            "asset_cols": list(asset_cols),
+            "extra_cols": list((extra or {}).keys()),
+            "scaler_mean": [float(v) for v in mean],
+            "scaler_scale": [float(v) for v in scale],
+            "index": dict(index or INDEX_SPEC),
+            "k_max": int(neighbors["nbr_idx"].shape[1]) if neighbors else 0,
+            "files": files,
+        }
+        write_atomic(out_dir / "meta.json", json.dumps(meta, indent=2).encode("utf-8"))
+        # older versions are no longer referenced; workers that still map them
+        # keep their pages until they reload (unlinking does not invalidate a mmap)
+        keep = set(files.values())
+        for p in out_dir.glob("*.npy"):
+            if p.name not in keep:
+                try:
+                    p.unlink()
+                except OSError:
+                    pass
+    return out_dir
+
+def neighbor_rows(index, Xs: np.ndarray, assets: np.ndarray, rows: np.ndarray,
+                  K: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Neighbour-table entries (idx, dist, means) for the given rows: each row's
+    K nearest other rows (self removed the same way recommend() does) and the
+    running per-asset means over them, nbr_means[i, k-1, j] = NaN-skipping
+    mean of asset j over the first k neighbours (NaN if none are valid).
+    Means match a direct mean up to float rounding.
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    nbr_idx = np.empty((len(rows), K), dtype=np.int64)
+    nbr_dist = np.empty((len(rows), K), dtype=np.float64)
+    if K:
+        for start in range(0, len(rows), _NEIGHBOR_CHUNK):
+            r = rows[start:start + _NEIGHBOR_CHUNK]
+            dists, inds = index.kneighbors(Xs[r], n_neighbors=K + 1, return_distance=True)
+            keep = inds != r[:, None]
+            # rows whose own index was not returned (exact duplicates) drop the farthest instead
+            keep[keep.all(axis=1), -1] = False
+            nbr_idx[start:start + len(r)] = inds[keep].reshape(-1, K)
+            nbr_dist[start:start + len(r)] = dists[keep].reshape(-1, K)
+    vals = assets[nbr_idx]                                   # (rows, K, a)
+    valid = ~np.isnan(vals)
+    sums = np.cumsum(np.where(valid, vals, 0.0), axis=1)
+    counts = np.cumsum(valid, axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        nbr_means = np.where(counts > 0, sums / counts, np.nan)
+    return nbr_idx, nbr_dist, nbr_means
+
+def precompute_neighbors(Xs: np.ndarray, assets: np.ndarray, k_max: int = K_MAX,
+                         index: Optional[Dict[str, Any]] = None) -> Dict[str, np.ndarray]:
+    """
+    The full neighbour table: neighbor_rows() for every row with
+    K = min(k_max, n-1). With an approximate index the table is approximate too.
+    """
+    n = len(Xs)
+    K = max(min(k_max + 1, n) - 1, 0)
+    nn = build_from_spec(index or INDEX_SPEC, Xs) if K else None
+    nbr_idx, nbr_dist, nbr_means = neighbor_rows(nn, Xs, assets, np.arange(n), K)
+    return {"nbr_idx": nbr_idx, "nbr_dist": nbr_dist, "nbr_means": nbr_means}
+
+def artifact_from_frame(out_dir: Path, df, feature_cols: List[str], id_col: str, scaler=None,
+                        index: Optional[Dict[str, Any]] = None, k_max: int = K_MAX) -> Path:
+    """
+    Standardize df[feature_cols] (fitting a StandardScaler unless one is given)
+    and save. Other numeric columns become asset columns, text columns extras.
+    k_max > 0 also stores the precomputed neighbour table.
+    """
+    df = df.loc[:, ~df.columns.duplicated()]
+    X = df[feature_cols].to_numpy(dtype=float)
+    if scaler is None:
+        from sklearn.preprocessing import StandardScaler
+        scaler = StandardScaler().fit(X)
+    extra_cols = [c for c in df.columns if c != id_col and not np.issubdtype(df[c].dtype, np.number)]
+    asset_cols = [c for c in df.columns if c != id_col and c not in extra_cols]
+    Xs = scaler.transform(X)
+    assets = df[asset_cols].to_numpy(dtype=float)
+    neighbors = precompute_neighbors(Xs, assets, k_max, index) if k_max > 0 else None
+    return save_artifact(out_dir, df[id_col].tolist(), Xs, assets, asset_cols, feature_cols, id_col,
+                         scaler.mean_, scaler.scale_, extra={c: df[c].tolist() for c in extra_cols},
+                         index=index, neighbors=neighbors)
+
+class KNNArtifact:
+    def __init__(self, path: Path = ARTIFACT_DIR, mmap: bool = True):
+        t0 = time.perf_counter()
+        rss0 = rss_mb()
+        self.path = Path(path)
+        for attempt in range(_OPEN_ATTEMPTS):
+            try:
+                self._open(mmap)
+                break
+            except FileNotFoundError:
+                # a save published a newer version (and removed this one's arrays) while we
+                # were opening it: read meta.json again
+                if attempt == _OPEN_ATTEMPTS - 1:
+                    raise
+        self.version: str = self.meta["version"]
+        self.id_col: str = self.meta["id_col"]
+        self.feature_cols: List[str] = self.meta["feature_cols"]
+        self.asset_cols: List[str] = self.meta["asset_cols"]
+        self.asset_index = {c: j for j, c in enumerate(self.asset_cols)}
+        # company id -> row, so lookups never scan the id column (first row wins on duplicates)
+        n = len(self.ids)
+        self.row_index: Dict[str, int] = dict(zip(self.ids[::-1].tolist(), range(n - 1, -1, -1)))
+        self.mean = np.asarray(self.meta["scaler_mean"], dtype=np.float64)
+        self.scale = np.asarray(self.meta["scaler_scale"], dtype=np.float64)
+        self._index = None
+        self._index_lock = threading.Lock()
+        self.load_s = time.perf_counter() - t0
+        self.rss_delta_mb = (rss_mb() - rss0) if rss0 is not None else None
+        self.index_build_s: Optional[float] = None
+
+    def _open(self, mmap: bool):
+        self.meta: Dict[str, Any] = json.loads((self.path / "meta.json").read_text())
+        if self.meta.get("format_version") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported KNN artifact format {self.meta.get('format_version')} in {self.path}.")
+        mode = "r" if mmap else None
+        files = self.meta["files"]
+        self.Xs: np.ndarray = np.load(self.path / files["Xs"], mmap_mode=mode)
+        self.ids: np.ndarray = np.load(self.path / files["ids"], mmap_mode=mode)
+        self.assets: np.ndarray = np.load(self.path / files["assets"], mmap_mode=mode)
+        self.extra: Dict[str, np.ndarray] = {
+            c: np.load(self.path / files[f"extra.{c}"], mmap_mode=mode) for c in self.meta["extra_cols"]}
+        self.k_max: int = int(self.meta.get("k_max", 0))
+        self.nbr_idx = self.nbr_dist = self.nbr_means = None
+        if self.k_max:
+            self.nbr_idx = np.load(self.path / files["nbr_idx"], mmap_mode=mode)
+            self.nbr_dist = np.load(self.path / files["nbr_dist"], mmap_mode=mode)
+            self.nbr_means = np.load(self.path / files["nbr_means"], mmap_mode=mode)
+
+    @classmethod
+    def from_joblib(cls, joblib_path: Path = LEGACY_ARTIFACT_PATH, out_dir: Optional[Path] = None) -> "KNNArtifact":
+        """Convert a legacy train_knn_save.py joblib artifact (written next to it by default)."""
+        import joblib
+        legacy = joblib.load(joblib_path)
+        out_dir = Path(out_dir) if out_dir else Path(joblib_path).with_suffix("")
+        artifact_from_frame(out_dir, legacy["df"], legacy["feature_cols"], legacy["id_col"],
+                            scaler=legacy["scaler"], k_max=K_MAX)
+        return cls(out_dir)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def index_of(self, company_id) -> Optional[int]:
+        """Row position of a company id (compared as a string), or None."""
+        return self.row_index.get(str(company_id))
+
+    def vector(self, row: int) -> np.ndarray:
+        """Standardized feature vector of a row as a (1, f) query; no scaler call needed."""
+        return self.Xs[row:row + 1]
+
+    def covers(self, k: int) -> bool:
+        """True if the precomputed table answers a k-neighbour query."""
+        return self.k_max > 0 and k >= 1 and (k <= self.k_max or self.k_max == len(self) - 1)
+
+    def neighbor_mean(self, row: int, k: int, asset_col: str) -> float:
+        """Mean of asset_col over the k nearest other companies (needs covers(k))."""
+        kk = min(k, self.k_max)
+        return float(self.nbr_means[row, kk - 1, self.asset_index[asset_col]])
+
+    def transform(self, X: np.ndarray) -> np.ndarray:
+        """Raw feature rows -> standardized space (StandardScaler.transform)."""
+        return (np.asarray(X, dtype=np.float64) - self.mean) / self.scale
+
+    @property
+    def index(self):
+        """Neighbour index over Xs (kind from meta.json), built on first use per process."""
+        if self._index is None:
+            with self._index_lock:
+                if self._index is None:
+                    t0 = time.perf_counter()
+                    index = build_from_spec(self.meta.get("index"), self.Xs)
+                    self.index_build_s = time.perf_counter() - t0
+                    self._index = index
+        return self._index
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pid": os.getpid(),
+            "path": str(self.path),
+            "version": self.version,
+            "rows": len(self),
+            "mmap": isinstance(self.Xs, np.memmap),
+            "load_s": self.load_s,
+            "load_rss_delta_mb": self.rss_delta_mb,
+            "k_max": self.k_max,
+            "index": self.meta.get("index", INDEX_SPEC)["kind"],
+            "index_built": self._index is not None,
+            "index_build_s": self.index_build_s,
+            "rss_mb": rss_mb(),
+        }
+
+class ArtifactWatcher:
+    """
+    Holds the current artifact and swaps in a new one when train_knn_save.py
+    (or another worker's save) republishes meta.json. The swap is a single
+    reference assignment: requests that already fetched the old object finish
+    on it, new requests get the new one, none are dropped.
+    wrap: builds what get() hands out from a fresh KNNArtifact (e.g. knn_live.LiveKNN)
+    """
+
+    def __init__(self, artifact: KNNArtifact, check_every_s: float = RELOAD_CHECK_S,
+                 wrap: Optional[Callable[[KNNArtifact], Any]] = None):
+        self.wrap = wrap or (lambda a: a)
+        self.artifact = self.wrap(artifact)
+        self.check_every_s = float(check_every_s)
+        # held by reloads and by in-place updates, so neither runs during the other
+        self.lock = threading.Lock()
+        self._sig = self._stat()
+        self._next_check = time.monotonic() + self.check_every_s
+        self.reloads = 0
+        self.last_error: Optional[str] = None
+
+    def _stat(self):
+        try:
+            st = os.stat(self.artifact.path / "meta.json")
+            return st.st_mtime_ns, st.st_size
+        except OSError:
+            return None
+
+    def _check(self, force: bool = False) -> bool:
+        # caller holds self.lock
+        sig = self._stat()
+        if sig is None or (sig == self._sig and not force):
+            return False
+        try:
+            fresh = KNNArtifact(self.artifact.path)
+        except Exception as e:  # keep serving the old version
+            self.last_error = str(e)
+            return False
+        self._sig = sig
+        self.last_error = None
+        if fresh.version == self.artifact.version:
+            return False
+        self.artifact = self.wrap(fresh)
+        self.reloads += 1
+        return True
+
+    def get(self):
+        now = time.monotonic()
+        if now < self._next_check or not self.lock.acquire(blocking=False):
+            return self.artifact
+        try:
+            self._next_check = now + self.check_every_s
+            self._check()
+            return self.artifact
+        finally:
+            self.lock.release()
+
+    def reload(self) -> bool:
+        """Re-read meta.json now; True if a different version was swapped in."""
+        with self.lock:
+            return self._check(force=True)
+
+    def published(self):
+        """Our own save just rewrote meta.json; don't reload it as a new version (caller holds self.lock)."""
+        self._sig = self._stat()
+
+    def stats(self) -> Dict[str, Any]:
+        out = self.artifact.stats()
+        out.update({"reloads_total": self.reloads, "reload_error": self.last_error})
+        return out
+
+def load_artifact(path: Path = ARTIFACT_DIR) -> KNNArtifact:
+    """Open an artifact directory; never writes (legacy .joblib files need convert_legacy first)."""
+    path = Path(path)
+    if path.suffix == ".joblib" or not (path / "meta.json").exists():
+        raise FileNotFoundError(
+            f"No KNN artifact at {path}. Run train_knn_save.py, or convert a legacy file with "
+            f"'python knn_artifact.py convert {LEGACY_ARTIFACT_PATH} {ARTIFACT_DIR}'.")
+    return KNNArtifact(path)
+
+def convert_legacy(joblib_path: Path = LEGACY_ARTIFACT_PATH, out_dir: Optional[Path] = None) -> KNNArtifact:
+    """
+    Convert a legacy .joblib artifact into a directory (next to it by default).
+    Skipped when out_dir already holds a conversion newer than the file;
+    concurrent converters take turns on a lock file in out_dir.
+    """
+    joblib_path = Path(joblib_path)
+    if not joblib_path.exists():
+        raise FileNotFoundError(f"No legacy KNN artifact at {joblib_path}.")
+    out_dir = Path(out_dir) if out_dir else joblib_path.with_suffix("")
+    out_dir.mkdir(parents=True, exist_ok=True)
+    with file_lock(out_dir / LOCK_CONVERT_NAME):
+        meta = out_dir / "meta.json"
+        if meta.exists() and meta.stat().st_mtime >= joblib_path.stat().st_mtime:
+            return KNNArtifact(out_dir)
+        return KNNArtifact.from_joblib(joblib_path, out_dir)
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["convert"]:
+        art = convert_legacy(*map(Path, sys.argv[2:4]))
+        print(f"converted {len(art)} rows into {art.path} (version {art.version})")
+        sys.exit(0)
+    art = load_artifact(Path(sys.argv[1]) if len(sys.argv) > 1 else ARTIFACT_DIR)
+    s = art.stats()
+    print(f"pid {s['pid']}: loaded {s['rows']} rows from {s['path']} in {s['load_s'] * 1000:.1f} ms "
+          f"(mmap={s['mmap']}, rss {s['rss_mb']:.1f} MiB)")
+    art.index
+    print(f"index built in {art.index_build_s * 1000:.1f} ms, rss {rss_mb():.1f} MiB")
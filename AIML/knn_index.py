@@ -0,0 +1,224 @@
+# knn_index.py
+"""
+Pluggable nearest-neighbour indexes for the company recommender.
+Every index takes the standardized matrix at build time and answers
+kneighbors(Q, n_neighbors, return_distance=True) like sklearn's
+NearestNeighbors, with Euclidean distances and rows sorted by distance.
+  brute      exact; NumPy/BLAS ||q||^2 - 2 q.x + ||x||^2 over row chunks
+  kd_tree    exact; sklearn KDTree (good for the 4-feature space)
+  ball_tree  exact; sklearn BallTree
+  rp_forest  approximate; random-projection trees in pure NumPy, candidates
+             from every tree's leaf re-ranked exactly
+  hnsw       approximate; hnswlib graph, only if hnswlib is installed
+The kind and its parameters are chosen in train_knn_save.py and stored in
+the artifact's meta.json; workers rebuild the index lazily on first use.
+"""
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import hnswlib  # optional: pip install hnswlib
+except ImportError:
+    hnswlib = None
+
+INDEX_KINDS = ("brute", "kd_tree", "ball_tree", "rp_forest", "hnsw")
+DEFAULT_INDEX = "brute"
+_QUERY_CHUNK = 1024  # query rows per distance block (bounds memory at chunk x n)
+
+def _finish(d2: np.ndarray, idx: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Top-k of each row of squared distances d2 over candidate ids idx, ties by id."""
+    if d2.shape[1] > k:
+        part = np.argpartition(d2, k - 1, axis=1)[:, :k]
+        d2 = np.take_along_axis(d2, part, axis=1)
+        idx = np.take_along_axis(idx, part, axis=1)
+    order = np.lexsort((idx, d2), axis=1)
+    return (np.sqrt(np.maximum(np.take_along_axis(d2, order, axis=1), 0.0)),
+            np.take_along_axis(idx, order, axis=1))
+
+class BruteIndex:
+    kind = "brute"
+
+    def __init__(self, X: np.ndarray):
+        self.X = X
+        self.sq = np.einsum("ij,ij->i", X, X)
+
+    def __len__(self) -> int:
+        return len(self.X)
+
+    def kneighbors(self, Q: np.ndarray, n_neighbors: int, return_distance: bool = True):
+        Q = np.asarray(Q, dtype=np.float64)
+        k = int(n_neighbors)
+        if not 0 < k <= len(self.X):
+            raise ValueError(f"Expected 0 < n_neighbors <= {len(self.X)}, got {k}.")
+        dists = np.empty((len(Q), k))
+        inds = np.empty((len(Q), k), dtype=np.int64)
+        ids = np.arange(len(self.X))
+        for s in range(0, len(Q), _QUERY_CHUNK):
+            q = Q[s:s + _QUERY_CHUNK]
+            d2 = np.einsum("ij,ij->i", q, q)[:, None] - 2.0 * (q @ self.X.T) + self.sq[None, :]
+            dists[s:s + len(q)], inds[s:s + len(q)] = _finish(d2, np.broadcast_to(ids, d2.shape), k)
+        return (dists, inds) if return_distance else inds
+
+class SklearnTreeIndex:
+    """KDTree / BallTree through sklearn.neighbors.NearestNeighbors."""
+
+    def __init__(self, X: np.ndarray, kind: str = "kd_tree", leaf_size: int = 30):
+        from sklearn.neighbors import NearestNeighbors
+        self.kind = kind
+        self.nn = NearestNeighbors(algorithm=kind, leaf_size=leaf_size, metric="euclidean").fit(X)
+        self.n = len(X)
+
+    def __len__(self) -> int:
+        return self.n
+
+    def kneighbors(self, Q: np.ndarray, n_neighbors: int, return_distance: bool = True):
+        return self.nn.kneighbors(np.asarray(Q, dtype=np.float64), n_neighbors=n_neighbors,
+                                  return_distance=return_distance)
+
+class RPForestIndex:
+    """
+    Random-projection forest: each tree splits on a random direction at the
+    median projection until leaves hold <= leaf_size rows. A query walks every
+    tree to one leaf and the union of those leaves is searched exactly, so
+    recall grows with n_trees at the cost of more candidates per query.
+    """
+    kind = "rp_forest"
+
+    def __init__(self, X: np.ndarray, n_trees: int = 10, leaf_size: int = 64, seed: int = 42):
+        self.X = X
+        self.sq = np.einsum("ij,ij->i", X, X)
+        self.leaf_size = max(2, int(leaf_size))
+        rng = np.random.default_rng(seed)
+        self.trees = [self._build(rng) for _ in range(int(n_trees))]
+
+    def __len__(self) -> int:
+        return len(self.X)
+
+    def _build(self, rng) -> Dict[str, np.ndarray]:
+        n, d = self.X.shape
+        normals: List[np.ndarray] = []
+        offsets: List[float] = []
+        children: List[List[int]] = []      # [left, right], -1/-1 for a leaf
+        leaf_of: List[Tuple[int, int]] = []  # (start, stop) into `items` for leaves
+        items = np.arange(n)
+        stack = [(0, n, self._new_node(normals, offsets, children, leaf_of, d))]
+        while stack:
+            start, stop, node = stack.pop()
+            rows = items[start:stop]
+            if stop - start > self.leaf_size:
+                w = rng.standard_normal(d)
+                proj = self.X[rows] @ w
+                cut = float(np.median(proj))
+                left = proj <= cut
+                if left.all():
+                    left = proj < cut  # median value repeated: split just below it
+                n_left = int(left.sum())
+                if 0 < n_left < stop - start:
+                    items[start:stop] = np.concatenate([rows[left], rows[~left]])
+                    normals[node], offsets[node] = w, cut
+                    lo = self._new_node(normals, offsets, children, leaf_of, d)
+                    hi = self._new_node(normals, offsets, children, leaf_of, d)
+                    children[node] = [lo, hi]
+                    stack.append((start, start + n_left, lo))
+                    stack.append((start + n_left, stop, hi))
+                    continue
+            leaf_of[node] = (start, stop)      # small enough, or all projections equal
+        return {
+            "normal": np.array(normals), "offset": np.array(offsets),
+            "children": np.array(children, dtype=np.int64),
+            "leaf": np.array(leaf_of, dtype=np.int64), "items": items,
+        }
+
+    @staticmethod
+    def _new_node(normals, offsets, children, leaf_of, d) -> int:
+        normals.append(np.zeros(d))
+        offsets.append(0.0)
+        children.append([-1, -1])
+        leaf_of.append((0, 0))
+        return len(children) - 1
+
+    def _leaves(self, tree, Q: np.ndarray) -> np.ndarray:
+        """Leaf node reached by each query row (all rows descend together, level by level)."""
+        children, normal, offset = tree["children"], tree["normal"], tree["offset"]
+        if len(Q) == 1:  # single request: a plain walk beats the vectorized bookkeeping
+            q, n = Q[0], 0
+            while children[n, 0] >= 0:
+                n = children[n, 1] if normal[n] @ q > offset[n] else children[n, 0]
+            return np.array([n])
+        node = np.zeros(len(Q), dtype=np.int64)
+        active = children[node, 0] >= 0
+        while active.any():
+            a = np.flatnonzero(active)
+            go_right = np.einsum("ij,ij->i", Q[a], normal[node[a]]) > offset[node[a]]
+            node[a] = children[node[a], go_right.astype(np.int64)]
+            active[a] = children[node[a], 0] >= 0
+        return node
+
+    def kneighbors(self, Q: np.ndarray, n_neighbors: int, return_distance: bool = True):
+        Q = np.asarray(Q, dtype=np.float64)
+        k = int(n_neighbors)
+        if not 0 < k <= len(self.X):
+            raise ValueError(f"Expected 0 < n_neighbors <= {len(self.X)}, got {k}.")
+        leaves = [self._leaves(t, Q) for t in self.trees]
+        dists = np.empty((len(Q), k))
+        inds = np.empty((len(Q), k), dtype=np.int64)
+        for i in range(len(Q)):
+            cand = np.unique(np.concatenate([
+                t["items"][slice(*t["leaf"][leaf[i]])] for t, leaf in zip(self.trees, leaves)]))
+            if len(cand) < k:
+                cand = np.arange(len(self.X))  # leaves too small for this k: search exactly
+            q = Q[i]
+            d2 = (q @ q - 2.0 * (self.X[cand] @ q) + self.sq[cand])[None, :]
+            dists[i], inds[i] = (a[0] for a in _finish(d2, cand[None, :], k))
+        return (dists, inds) if return_distance else inds
+
+class HNSWIndex:
+    kind = "hnsw"
+
+    def __init__(self, X: np.ndarray, M: int = 16, ef_construction: int = 200, ef: int = 64, seed: int = 42):
+        if hnswlib is None:
+            raise ImportError("index 'hnsw' needs `pip install hnswlib`.")
+        self.n = len(X)
+        self.ef = int(ef)
+        self.index = hnswlib.Index(space="l2", dim=X.shape[1])
+        self.index.init_index(max_elements=max(1, self.n), ef_construction=ef_construction, M=M, random_seed=seed)
+        self.index.add_items(np.asarray(X, dtype=np.float32), np.arange(self.n))
+
+    def __len__(self) -> int:
+        return self.n
+
+    def kneighbors(self, Q: np.ndarray, n_neighbors: int, return_distance: bool = True):
+        k = int(n_neighbors)
+        if not 0 < k <= self.n:
+            raise ValueError(f"Expected 0 < n_neighbors <= {self.n}, got {k}.")
+        self.index.set_ef(max(self.ef, k))
+        labels, d2 = self.index.knn_query(np.asarray(Q, dtype=np.float32), k=k)
+        inds = labels.astype(np.int64)
+        dists = np.sqrt(np.maximum(d2.astype(np.float64), 0.0))  # hnswlib returns squared L2
+        return (dists, inds) if return_distance else inds
+
+def available_indexes() -> List[str]:
+    return [k for k in INDEX_KINDS if k != "hnsw" or hnswlib is not None]
+
+def build_index(kind: str, X: np.ndarray, **params):
+    """Build the index named `kind` over X; params go to its constructor."""
+    if kind == "brute":
+        return BruteIndex(X, **params)
+    if kind in ("kd_tree", "ball_tree"):
+        return SklearnTreeIndex(X, kind=kind, **params)
+    if kind == "rp_forest":
+        return RPForestIndex(X, **params)
+    if kind == "hnsw":
+        return HNSWIndex(X, **params)
+    raise ValueError(f"Unknown index '{kind}'. Use one of {', '.join(INDEX_KINDS)}.")
+
+def index_spec(kind: str = DEFAULT_INDEX, **params) -> Dict[str, Any]:
+    """What the artifact stores in meta.json to rebuild the index later."""
+    if kind not in INDEX_KINDS:
+        raise ValueError(f"Unknown index '{kind}'. Use one of {', '.join(INDEX_KINDS)}.")
+    return {"kind": kind, "params": params}
+
+def build_from_spec(spec: Optional[Dict[str, Any]], X: np.ndarray):
+    spec = spec or index_spec()
+    return build_index(spec["kind"], X, **spec.get("params", {}))
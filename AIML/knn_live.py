@@ -0,0 +1,400 @@
+# knn_live.py
+"""
+In-place updates for the company KNN recommender, without retraining.
+LiveKNN wraps a read-only KNNArtifact and exposes the same lookup API that
+flask_knn_api.py uses (index_of, vector, covers, neighbor_mean, index,
+assets, ...) plus upsert()/delete() of company rows:
+- rows are append-only: an upsert tombstones the company's old row and
+  appends a new one, so row numbers held by in-flight requests stay valid
+- the neighbour index is the artifact's index over the original rows plus a
+  brute-force search of appended rows, with tombstones filtered out; once
+  appended + tombstoned rows pass COMPACT_ROWS / COMPACT_FRACTION the rows
+  are renumbered and the index rebuilt over live rows only
+- scaler statistics follow every change (Welford); vectors stay in the
+  standardized space they were trained in until the running std drifts
+  more than SCALE_DRIFT from it, then all rows are re-standardized in memory
+- only companies whose precomputed neighbour list can change (it contains
+  the changed row, or the new vector falls inside their K_max radius) get
+  their table entries recomputed
+Arrays stay memory-mapped until the first update copies them into the
+process. save() publishes the current state as a new artifact version,
+which other workers pick up through ArtifactWatcher. Unsaved updates exist
+only in the process that made them, and save() writes that process's view
+over the artifact, so exactly one process should take updates
+(flask_knn_api.py enforces this with a lock file).
+"""
+import json
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from concurrency import RWLock
+from knn_artifact import KNNArtifact, neighbor_rows, save_artifact, INDEX_SPEC
+from knn_index import build_from_spec
+
+COMPACT_ROWS = 1000       # appended + tombstoned rows tolerated before compaction...
+COMPACT_FRACTION = 0.05   # ...or this fraction of the indexed rows, whichever is larger
+SCALE_DRIFT = 0.05        # relative std change that triggers re-standardizing
+
+class _LiveIndex:
+    """Base index over rows [0, n_base) + brute force over appended rows, minus tombstones."""
+
+    def __init__(self, live: "LiveKNN", base):
+        self.live = live
+        self.base = base
+        self.n_base = live.n_base
+
+    def kneighbors(self, Q: np.ndarray, n_neighbors: int, return_distance: bool = True):
+        live = self.live
+        k = int(n_neighbors)
+        if not 0 < k <= len(live):
+            raise ValueError(f"Expected 0 < n_neighbors <= {len(live)}, got {k}.")
+        delta = np.flatnonzero(live.alive[self.n_base:live.n_rows]) + self.n_base
+        if not live.n_dead_base and not len(delta):
+            return self.base.kneighbors(Q, k, return_distance=return_distance)
+        Q = np.asarray(Q, dtype=np.float64)
+        cand_d, cand_i = [], []
+        kb = min(k + live.n_dead_base, self.n_base)  # over-fetch enough to skip every tombstone
+        if kb > 0:
+            d, i = self.base.kneighbors(Q, kb, return_distance=True)
+            cand_d.append(np.where(live.alive[i], d, np.inf))
+            cand_i.append(i)
+        if len(delta):
+            X = live.Xs[delta]
+            d2 = np.einsum("ij,ij->i", Q, Q)[:, None] - 2.0 * (Q @ X.T) + np.einsum("ij,ij->i", X, X)[None, :]
+            cand_d.append(np.sqrt(np.maximum(d2, 0.0)))
+            cand_i.append(np.broadcast_to(delta, d2.shape))
+        D = np.concatenate(cand_d, axis=1)
+        I = np.concatenate(cand_i, axis=1)
+        order = np.lexsort((I, D), axis=1)[:, :k]
+        inds = np.take_along_axis(I, order, axis=1)
+        return (np.take_along_axis(D, order, axis=1), inds) if return_distance else inds
+
+class LiveKNN:
+    def __init__(self, artifact: KNNArtifact):
+        self.artifact = artifact
+        self.path = artifact.path
+        self.version = artifact.version
+        self.id_col = artifact.id_col
+        self.feature_cols = artifact.feature_cols
+        self.asset_cols = artifact.asset_cols
+        self.asset_index = artifact.asset_index
+        self.extra_cols: List[str] = list(artifact.meta["extra_cols"])
+        self.index_spec = artifact.meta.get("index", INDEX_SPEC)
+        self.mean = artifact.mean.copy()
+        self.scale = artifact.scale.copy()
+        self.lock = RWLock()            # read: recommend, write: upsert/delete
+
+        # until the first update these are the artifact's (mmapped) arrays
+        self._Xs = artifact.Xs
+        self._assets = artifact.assets
+        self._nbr_idx, self._nbr_dist, self._nbr_means = artifact.nbr_idx, artifact.nbr_dist, artifact.nbr_means
+        self.k_max = artifact.k_max
+        self.row_index = artifact.row_index
+        self.n_rows = self.n_base = len(artifact)
+        self.n_dead_base = 0
+        self.n_alive = self.n_rows
+        self.alive = np.ones(self.n_rows, dtype=bool)
+        self._own = False
+        self._rebuilt = False           # base index must be rebuilt from our own rows
+        self._index = None
+
+        # running scaler statistics over live rows (population variance, like StandardScaler)
+        self.count = self.n_rows
+        self.s_mean = self.mean.copy()
+        self.s_m2 = self.scale ** 2 * self.n_rows
+
+        self.upserts = 0
+        self.deletes = 0
+        self.invalidated = 0
+        self.compactions = 0
+        self.restandardizations = 0
+        self.dirty = 0                  # updates since the last save/load
+
+    # ---- read API (same as KNNArtifact) ----
+
+    @property
+    def Xs(self) -> np.ndarray:
+        return self._Xs[:self.n_rows]
+
+    @property
+    def assets(self) -> np.ndarray:
+        return self._assets[:self.n_rows]
+
+    @property
+    def nbr_means(self) -> Optional[np.ndarray]:
+        return None if self._nbr_means is None else self._nbr_means[:self.n_rows]
+
+    def __len__(self) -> int:
+        return self.n_alive
+
+    def index_of(self, company_id) -> Optional[int]:
+        return self.row_index.get(str(company_id))
+
+    def vector(self, row: int) -> np.ndarray:
+        return self._Xs[row:row + 1]
+
+    def transform(self, X: np.ndarray) -> np.ndarray:
+        return (np.asarray(X, dtype=np.float64) - self.mean) / self.scale
+
+    def covers(self, k: int) -> bool:
+        return self.k_max > 0 and k >= 1 and (k <= self.k_max or self.k_max == len(self) - 1)
+
+    def neighbor_mean(self, row: int, k: int, asset_col: str) -> float:
+        kk = min(k, self.k_max)
+        return float(self._nbr_means[row, kk - 1, self.asset_index[asset_col]])
+
+    @property
+    def index(self):
+        if self._index is None:
+            base = build_from_spec(self.index_spec, self._Xs[:self.n_base]) if self._rebuilt else self.artifact.index
+            self._index = _LiveIndex(self, base)
+        return self._index
+
+    # ---- updates ----
+
+    def _materialize(self):
+        """Copy the mmapped arrays into growable in-process arrays (first update only)."""
+        if self._own:
+            return
+        art, n = self.artifact, self.n_rows
+        cap = max(16, int(n * 1.25) + 1)
+        self._Xs = _grown(np.asarray(art.Xs), cap)
+        self._raw = _grown(np.asarray(art.Xs) * self.scale + self.mean, cap)
+        self._assets = _grown(np.asarray(art.assets), cap)
+        self.alive = _grown(self.alive, cap)
+        if self.k_max:
+            self._nbr_idx = _grown(np.asarray(art.nbr_idx), cap)
+            self._nbr_dist = _grown(np.asarray(art.nbr_dist), cap)
+            self._nbr_means = _grown(np.asarray(art.nbr_means), cap)
+        self.ids: List[str] = art.ids.tolist()
+        self.extra: Dict[str, List[str]] = {c: art.extra[c].tolist() for c in self.extra_cols}
+        self.row_index = dict(art.row_index)
+        self._own = True
+
+    def _reserve(self, n_more: int):
+        cap = len(self._Xs)
+        if self.n_rows + n_more <= cap:
+            return
+        cap = max(cap * 2, self.n_rows + n_more)
+        self._Xs, self._raw, self._assets = _grown(self._Xs, cap), _grown(self._raw, cap), _grown(self._assets, cap)
+        self.alive = _grown(self.alive, cap)
+        if self.k_max:
+            self._nbr_idx = _grown(self._nbr_idx, cap)
+            self._nbr_dist = _grown(self._nbr_dist, cap)
+            self._nbr_means = _grown(self._nbr_means, cap)
+
+    def _stats_add(self, x: np.ndarray, sign: int):
+        """Welford add (sign=1) or remove (sign=-1) of one raw feature vector."""
+        if sign > 0:
+            self.count += 1
+            d = x - self.s_mean
+            self.s_mean = self.s_mean + d / self.count
+            self.s_m2 = self.s_m2 + d * (x - self.s_mean)
+        elif self.count <= 1:
+            self.count, self.s_mean, self.s_m2 = 0, np.zeros_like(self.s_mean), np.zeros_like(self.s_m2)
+        else:
+            old_mean = self.s_mean
+            self.count -= 1
+            self.s_mean = (old_mean * (self.count + 1) - x) / self.count
+            self.s_m2 = np.maximum(self.s_m2 - (x - self.s_mean) * (x - old_mean), 0.0)
+
+    def _running_scale(self) -> np.ndarray:
+        scale = np.sqrt(self.s_m2 / max(self.count, 1))
+        scale[scale == 0.0] = 1.0
+        return scale
+
+    def _kill(self, row: int):
+        self.alive[row] = False
+        self.n_alive -= 1
+        if row < self.n_base:
+            self.n_dead_base += 1
+        self._stats_add(self._raw[row], -1)
+
+    def _parse(self, record: Dict[str, Any], old: Optional[int]):
+        missing = [c for c in self.feature_cols if record.get(c) is None]
+        if missing:
+            raise ValueError(f"Missing feature(s) for upsert: {missing}")
+        x = np.array([float(record[c]) for c in self.feature_cols])
+        if not np.all(np.isfinite(x)):
+            raise ValueError("Features must be finite numbers.")
+        # assets not given keep their previous value (NaN for a new company)
+        a = self._assets[old].copy() if old is not None else np.full(len(self.asset_cols), np.nan)
+        for c, j in self.asset_index.items():
+            if record.get(c) is not None:
+                a[j] = float(record[c])
+        extra = {c: ("" if record.get(c) is None else str(record[c])) if c in record
+                 else (self.extra[c][old] if old is not None else "") for c in self.extra_cols}
+        return x, a, extra
+
+    def _refresh(self, rows: np.ndarray):
+        """Recompute neighbour-table entries for `rows` against the live index."""
+        if not self.k_max or not len(rows):
+            return
+        if self.k_max > len(self) - 1:
+            self.k_max = 0          # too few companies left for the table; answer live
+            return
+        idx, dist, means = neighbor_rows(self.index, self._Xs, self._assets, rows, self.k_max)
+        self._nbr_idx[rows], self._nbr_dist[rows], self._nbr_means[rows] = idx, dist, means
+        self.invalidated += len(rows)
+
+    def _affected(self, old: Optional[int], new: Optional[int]) -> np.ndarray:
+        """Live rows whose neighbour list lists `old` or would admit `new`."""
+        if not self.k_max:
+            return np.empty(0, dtype=np.int64)
+        n = self.n_rows
+        hit = np.zeros(n, dtype=bool)
+        if old is not None:
+            hit |= (self._nbr_idx[:n] == old).any(axis=1)
+        if new is not None:
+            d = np.sqrt(((self._Xs[:n] - self._Xs[new]) ** 2).sum(axis=1))
+            hit |= d <= self._nbr_dist[:n, self.k_max - 1]
+            hit[new] = True
+        hit &= self.alive[:n]
+        return np.flatnonzero(hit)
+
+    def upsert(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Insert or replace one company. record holds company_id, every feature
+        column, and optionally asset / extra columns (unset assets are kept).
+        """
+        if record.get(self.id_col) is None:
+            raise ValueError(f"Missing required field: '{self.id_col}'")
+        cid = str(record[self.id_col])
+        with self.lock.write:
+            self._materialize()
+            old = self.row_index.get(cid)
+            x, a, extra = self._parse(record, old)
+            if old is not None:
+                self._kill(old)
+            self._reserve(1)
+            new = self.n_rows
+            self._raw[new] = x
+            self._Xs[new] = (x - self.mean) / self.scale
+            self._assets[new] = a
+            self.alive[new] = True
+            self.n_alive += 1
+            self.ids.append(cid)
+            for c in self.extra_cols:
+                self.extra[c].append(extra[c])
+            self.n_rows += 1
+            self.row_index[cid] = new
+            self._stats_add(x, 1)
+            before = self.invalidated
+            if not self._maybe_restandardize():
+                self._refresh(self._affected(old, new))
+                self._maybe_compact()
+            self.upserts += 1
+            self.dirty += 1
+            return {"company_id": cid, "inserted": old is None,
+                    "invalidated": self.invalidated - before, "rows": len(self)}
+
+    def delete(self, company_id) -> Dict[str, Any]:
+        cid = str(company_id)
+        with self.lock.write:
+            if cid not in self.row_index:
+                raise ValueError(f"{self.id_col} {company_id} not found.")
+            self._materialize()
+            old = self.row_index.pop(cid)
+            self._kill(old)
+            before = self.invalidated
+            if not self._maybe_restandardize():
+                self._refresh(self._affected(old, None))
+                self._maybe_compact()
+            self.deletes += 1
+            self.dirty += 1
+            return {"company_id": cid, "invalidated": self.invalidated - before, "rows": len(self)}
+
+    def _maybe_restandardize(self) -> bool:
+        scale = self._running_scale()
+        if np.max(np.abs(scale / self.scale - 1.0)) <= SCALE_DRIFT:
+            return False
+        self._compact()
+        self.mean, self.scale = self.s_mean.copy(), scale
+        n = self.n_rows
+        self._Xs[:n] = (self._raw[:n] - self.mean) / self.scale
+        self._index = None
+        self._refresh(np.arange(n))
+        self.restandardizations += 1
+        return True
+
+    def _maybe_compact(self):
+        waste = (self.n_rows - self.n_base) + self.n_dead_base
+        if waste > max(COMPACT_ROWS, COMPACT_FRACTION * self.n_base):
+            self._compact()
+
+    def _compact(self):
+        """Drop tombstones, renumber rows, and rebuild the base index over all live rows."""
+        n = self.n_rows
+        keep = np.flatnonzero(self.alive[:n])
+        remap = np.full(n, -1, dtype=np.int64)
+        remap[keep] = np.arange(len(keep))
+        cap = max(16, int(len(keep) * 1.25) + 1)
+        self._Xs, self._raw, self._assets = (_grown(self._Xs[keep], cap), _grown(self._raw[keep], cap),
+                                             _grown(self._assets[keep], cap))
+        if self.k_max:
+            # table entries of live rows only ever point at live rows
+            self._nbr_idx = _grown(remap[self._nbr_idx[keep]], cap)
+            self._nbr_dist = _grown(self._nbr_dist[keep], cap)
+            self._nbr_means = _grown(self._nbr_means[keep], cap)
+        self.ids = [self.ids[i] for i in keep]
+        self.extra = {c: [v[i] for i in keep] for c, v in self.extra.items()}
+        self.row_index = {cid: int(remap[r]) for cid, r in self.row_index.items()}
+        self.alive = np.zeros(cap, dtype=bool)
+        self.alive[:len(keep)] = True
+        self.n_rows = self.n_base = self.n_alive = len(keep)
+        self.n_dead_base = 0
+        self._rebuilt = True
+        self._index = None
+        self.compactions += 1
+
+    def save(self, out_dir: Optional[Path] = None) -> str:
+        """Publish the live rows as a new artifact version; returns that version."""
+        out_dir = Path(out_dir) if out_dir else self.path
+        with self.lock.read:
+            n = self.n_rows
+            keep = np.flatnonzero(self.alive[:n])
+            remap = np.full(n, -1, dtype=np.int64)
+            remap[keep] = np.arange(len(keep))
+            neighbors = None
+            if self.k_max:
+                neighbors = {"nbr_idx": remap[self._nbr_idx[keep]], "nbr_dist": self._nbr_dist[keep],
+                             "nbr_means": self._nbr_means[keep]}
+            ids = [self.ids[i] for i in keep] if self._own else self.artifact.ids.tolist()
+            extra = {c: [v[i] for i in keep] for c, v in self.extra.items()} if self._own else \
+                {c: self.artifact.extra[c].tolist() for c in self.extra_cols}
+            save_artifact(out_dir, ids, self._Xs[keep], self._assets[keep], self.asset_cols, self.feature_cols,
+                          self.id_col, self.mean, self.scale, extra=extra, index=self.index_spec,
+                          neighbors=neighbors)
+            saved = self.dirty
+        version = json.loads((out_dir / "meta.json").read_text())["version"]
+        with self.lock.write:
+            if out_dir == self.path:
+                self.version = version
+            self.dirty -= saved
+        return version
+
+    def stats(self) -> Dict[str, Any]:
+        out = self.artifact.stats()
+        out.update({
+            "version": self.version,
+            "rows": len(self),
+            "k_max": self.k_max,
+            "mmap": not self._own,
+            "appended_rows": self.n_rows - self.n_base,
+            "tombstones": self.n_dead_base,
+            "upserts_total": self.upserts,
+            "deletes_total": self.deletes,
+            "table_rows_recomputed_total": self.invalidated,
+            "compactions_total": self.compactions,
+            "restandardizations_total": self.restandardizations,
+            "unsaved_updates": self.dirty,
+        })
+        return out
+
+def _grown(arr: np.ndarray, cap: int) -> np.ndarray:
+    """Copy of arr with its first axis padded to `cap` rows."""
+    out = np.zeros((cap,) + arr.shape[1:], dtype=arr.dtype)
+    out[:len(arr)] = arr
+    return out
@@ -0,0 +1,350 @@
+# loadtest.py
+"""
+Load generator for the HTTP APIs: replays sensor events against /predict and
+company lookups against /recommend at a target rate, over keep-alive
+connections (a small asyncio HTTP/1.1 client, no extra packages).
+- --source csv: MachineSensorData_anomalies.csv rows in file order
+  --source sim: a synthetic fleet drawn like server/simulation.js does
+- --qps N: open loop, request i is due at start + i/N whatever the server
+  does; latency is measured from that due time, so a server that falls
+  behind shows up in the percentiles instead of slowing the generator down
+  --qps 0: closed loop, every connection sends as soon as its last reply came
+- --concurrency: connections (= requests in flight) per target
+Reports achieved throughput, latency percentiles, status codes and errors per
+target, optionally as JSON (--out). Start the services locally first, e.g.
+    uvicorn api:app --port 8000                                  # /predict (FastAPI)
+    flask --app flask_knn_api run --port 8001 --no-reload        # /recommend (Flask)
+
+    python loadtest.py --qps 500 --duration 30 --concurrency 32 --mix predict=4 recommend=1
+"""
+import argparse
+import asyncio
+import csv
+import json
+import random
+import socket
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import numpy as np
+
+from features import NUMERIC_COLS
+
+HERE = Path(__file__).resolve().parent
+SENSOR_CSV = HERE / "MachineSensorData_anomalies.csv"
+COMPANY_CSV = HERE / "company_cluster_features.csv"
+PREDICT_URL = "http://127.0.0.1:8000"
+RECOMMEND_URL = "http://127.0.0.1:8001"
+QPS = 200.0             # 0 = closed loop, as fast as the connections allow
+CONCURRENCY = 16        # connections per target
+DURATION_S = 10.0
+WARMUP_S = 1.0          # requests due in the first WARMUP_S are sent but not counted
+TIMEOUT_S = 10.0
+SIM_MACHINES = 200
+SEED = 0
+PERCENTILES = (50, 90, 99, 99.9)
+
+# ---------- request bodies ----------
+
+def csv_events(path: Path = SENSOR_CSV) -> List[Dict[str, Any]]:
+    """Sensor rows as typed events (the fields /predict reads), in file order."""
+    events = []
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            e: Dict[str, Any] = {"machine_id": int(row["machine_id"])}
+            for c in NUMERIC_COLS:
+                if row.get(c) not in (None, ""):
+                    e[c] = float(row[c])
+            events.append(e)
+    return events
+
+def sim_events(machines: int = SIM_MACHINES, cycles: int = 20, seed: int = SEED) -> List[Dict[str, Any]]:
+    """Readings for `machines` rented machines over `cycles` rounds, drawn like generateSensorData in simulation.js."""
+    rng = random.Random(seed)
+    events = []
+    for _ in range(cycles):
+        for m in range(1, machines + 1):
+            events.append({
+                "machine_id": m,
+                "avg_fuel_consumption_rate": round(rng.random() * 5 + 18, 2),
+                "idle_fuel_consumption_pct": round(rng.random() * 10 + 20, 2),
+                "rpm_variance": round(rng.random() * 100 + 150, 2),
+                "coolant_temp_anomalies": int(rng.random() > 0.95),
+                "productive_time_mins": rng.randrange(8) + 1,
+                "idle_time_mins": rng.randrange(2),
+                "vibration_anomalies": int(rng.random() > 0.9),
+                "over_speed_events": int(rng.random() > 0.98),
+                "tire_pressure_deviations": 0,
+                "error_code_frequency": int(rng.random() > 0.97),
+                "battery_low_voltage_events": int(rng.random() > 0.96),
+            })
+    return events
+
+def recommend_requests(path: Path = COMPANY_CSV, n: int = 1000, k: int = 5, seed: int = SEED) -> List[Dict[str, Any]]:
+    """/recommend bodies for the companies and asset columns in the company CSV."""
+    with open(path, newline="", encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    assets = [c[len("avg_"):] for c in rows[0] if c.startswith("avg_") and c != "avg_util"]
+    rng = random.Random(seed)
+    return [{"company_id": rng.choice(rows)["company_id"], "asset": rng.choice(assets),
+             "current_rented": rng.randrange(4), "k": k} for _ in range(n)]
+
+# ---------- keep-alive HTTP/1.1 client ----------
+
+class HTTPConnection:
+    """One persistent connection; reconnects when the server closes it."""
+
+    def __init__(self, url: str, timeout: float = TIMEOUT_S):
+        u = urlsplit(url)
+        if u.scheme != "http":
+            raise ValueError(f"Only http:// URLs are supported, got {url!r}.")
+        self.host = u.hostname or "127.0.0.1"
+        self.port = u.port or 80
+        self.base = u.path.rstrip("/")
+        self.timeout = timeout
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.connects = 0
+
+    async def _connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        sock = self.writer.get_extra_info("socket")
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.connects += 1
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+    async def post(self, path: str, body: bytes) -> Tuple[int, bytes]:
+        head = (f"POST {self.base}{path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n"
+                f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n").encode("latin-1")
+        reused = self.writer is not None
+        try:
+            return await asyncio.wait_for(self._roundtrip(head + body), self.timeout)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            self.close()
+            if not reused:
+                raise
+            # the server dropped an idle keep-alive connection: retry once on a fresh one
+            return await asyncio.wait_for(self._roundtrip(head + body), self.timeout)
+        except BaseException:
+            self.close()
+            raise
+
+    async def _roundtrip(self, data: bytes) -> Tuple[int, bytes]:
+        if self.writer is None:
+            await self._connect()
+        self.writer.write(data)
+        await self.writer.drain()
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionResetError("Connection closed by server.")
+        version, status = status_line.split(None, 2)[:2]
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            body = b""
+            while True:
+                size = int((await self.reader.readline()).split(b";")[0], 16)
+                chunk = await self.reader.readexactly(size + 2)
+                if not size:
+                    break
+                body += chunk[:-2]
+        elif "content-length" in headers:
+            body = await self.reader.readexactly(int(headers["content-length"]))
+        else:
+            body = await self.reader.read()
+            headers["connection"] = "close"
+        if headers.get("connection", "").lower() == "close" or version == b"HTTP/1.0":
+            self.close()
+        return int(status), body
+
+# ---------- load generation ----------
+
+class TargetStats:
+    def __init__(self, name: str):
+        self.name = name
+        self.latency: List[float] = []   # from the due time (includes waiting for a connection)
+        self.service: List[float] = []   # from the actual send
+        self.status: Counter = Counter()
+        self.errors: Counter = Counter()
+        self.sent = 0
+
+    def summary(self, seconds: float) -> Dict[str, Any]:
+        ok = sum(n for s, n in self.status.items() if 200 <= s < 300)
+        failed = self.sent - ok
+        out: Dict[str, Any] = {"sent": self.sent, "ok": ok, "error_rate": failed / self.sent if self.sent else 0.0,
+                               "achieved_qps": ok / seconds if seconds else 0.0,
+                               "status": {str(s): n for s, n in sorted(self.status.items())},
+                               "errors": dict(self.errors)}
+        for key, values in (("latency_ms", self.latency), ("service_ms", self.service)):
+            if values:
+                a = np.asarray(values) * 1000.0
+                out[key] = {**{f"p{p:g}": float(np.percentile(a, p)) for p in PERCENTILES},
+                            "mean": float(a.mean()), "max": float(a.max())}
+        return out
+
+class Target:
+    def __init__(self, name: str, url: str, path: str, bodies: List[bytes], concurrency: int, timeout: float):
+        self.name = name
+        self.path = path
+        self.bodies = bodies
+        self.conns = [HTTPConnection(url, timeout) for _ in range(concurrency)]
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.stats = TargetStats(name)
+        self.next = 0
+
+    def body(self) -> bytes:
+        b = self.bodies[self.next % len(self.bodies)]
+        self.next += 1
+        return b
+
+async def _send(target: Target, conn: HTTPConnection, body: bytes, due: float, measure: bool):
+    t0 = time.perf_counter()
+    try:
+        status, _ = await conn.post(target.path, body)
+    except asyncio.TimeoutError:
+        status = None
+        err = "timeout"
+    except Exception as e:
+        status = None
+        err = type(e).__name__
+    t1 = time.perf_counter()
+    if not measure:
+        return
+    s = target.stats
+    s.sent += 1
+    if status is None:
+        s.errors[err] += 1
+    else:
+        s.status[status] += 1
+        s.latency.append(t1 - due)
+        s.service.append(t1 - t0)
+
+async def _open_worker(target: Target, conn: HTTPConnection, warm_until: float):
+    while True:
+        item = await target.queue.get()
+        if item is None:
+            return
+        due, body = item
+        await _send(target, conn, body, due, due >= warm_until)
+
+async def _closed_worker(target: Target, conn: HTTPConnection, warm_until: float, end: float):
+    while True:
+        due = time.perf_counter()
+        if due >= end:
+            return
+        await _send(target, conn, target.body(), due, due >= warm_until)
+
+async def run_load(targets: List[Target], weights: List[float], qps: float, duration_s: float,
+                   warmup_s: float = WARMUP_S, seed: int = SEED) -> Dict[str, Any]:
+    """Drive the targets for warmup_s + duration_s; returns the per-target summary."""
+    start = time.perf_counter()
+    warm_until = start + warmup_s
+    end = warm_until + duration_s
+    late = 0
+    if qps > 0:
+        workers = [asyncio.create_task(_open_worker(t, c, warm_until)) for t in targets for c in t.conns]
+        rng = random.Random(seed)
+        i = 0
+        while True:
+            due = start + i / qps
+            if due >= end:
+                break
+            delay = due - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            elif delay < -0.001:
+                late += 1   # the generator itself fell behind (CPU bound client)
+            t = rng.choices(targets, weights)[0] if len(targets) > 1 else targets[0]
+            t.queue.put_nowait((due, t.body()))
+            i += 1
+        for t in targets:
+            for _ in t.conns:
+                t.queue.put_nowait(None)
+    else:
+        workers = [asyncio.create_task(_closed_worker(t, c, warm_until, end)) for t in targets for c in t.conns]
+    await asyncio.gather(*workers)
+    elapsed = time.perf_counter() - warm_until   # includes draining what was due before `end`
+    for t in targets:
+        for c in t.conns:
+            c.close()
+    return {"offered_qps": qps, "seconds": elapsed, "late_sends": late,
+            "connections": sum(c.connects for t in targets for c in t.conns),
+            "targets": {t.name: t.stats.summary(elapsed) for t in targets}}
+
+def print_report(report: Dict[str, Any]):
+    offered = f"{report['offered_qps']:g}/s" if report["offered_qps"] else "closed loop"
+    print(f"offered {offered} | {report['seconds']:.1f} s measured | {report['connections']} connections opened | "
+          f"{report['late_sends']} late sends")
+    print(f"{'target':<10} {'sent':>8} {'ok/s':>9} {'err%':>6} " +
+          " ".join(f"{'p%g' % p:>8}" for p in PERCENTILES) + f" {'max':>8}  (ms from due time)")
+    for name, s in report["targets"].items():
+        lat = s.get("latency_ms", {})
+        cols = " ".join(f"{lat.get('p%g' % p, float('nan')):>8.2f}" for p in PERCENTILES)
+        print(f"{name:<10} {s['sent']:>8,} {s['achieved_qps']:>9,.1f} {s['error_rate'] * 100:>6.2f} {cols} "
+              f"{lat.get('max', float('nan')):>8.2f}")
+        bad = {k: v for k, v in s["status"].items() if not k.startswith("2")}
+        if bad or s["errors"]:
+            print(f"{'':<10} non-2xx {bad or '{}'} errors {s['errors'] or '{}'}")
+
+def parse_mix(items: List[str]) -> Dict[str, float]:
+    mix = {}
+    for item in items:
+        name, _, w = item.partition("=")
+        if name not in ("predict", "recommend"):
+            raise ValueError(f"Unknown target {name!r} (predict or recommend).")
+        mix[name] = float(w or 1)
+    return {n: w for n, w in mix.items() if w > 0}
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--mix", nargs="+", default=["predict=1"], help="targets and weights, e.g. predict=4 recommend=1")
+    ap.add_argument("--qps", type=float, default=QPS, help="total offered requests/s (0 = closed loop)")
+    ap.add_argument("--concurrency", type=int, default=CONCURRENCY, help="connections per target")
+    ap.add_argument("--duration", type=float, default=DURATION_S, help="measured seconds")
+    ap.add_argument("--warmup", type=float, default=WARMUP_S, help="seconds sent first and not counted")
+    ap.add_argument("--timeout", type=float, default=TIMEOUT_S, help="per-request timeout")
+    ap.add_argument("--predict-url", default=PREDICT_URL)
+    ap.add_argument("--recommend-url", default=RECOMMEND_URL)
+    ap.add_argument("--source", choices=["csv", "sim"], default="csv", help="sensor events: CSV replay or simulated fleet")
+    ap.add_argument("--csv", default=str(SENSOR_CSV), help="sensor CSV for --source csv")
+    ap.add_argument("--machines", type=int, default=SIM_MACHINES, help="fleet size for --source sim")
+    ap.add_argument("--learn", action="store_true", help="send /predict?learn=true")
+    ap.add_argument("--k", type=int, default=5, help="neighbours per /recommend")
+    ap.add_argument("--out", help="write the report as JSON")
+    args = ap.parse_args()
+
+    mix = parse_mix(args.mix)
+    if not mix:
+        ap.error("--mix needs at least one target with a positive weight.")
+    targets = []
+    if "predict" in mix:
+        events = csv_events(Path(args.csv)) if args.source == "csv" else sim_events(args.machines)
+        targets.append(Target("predict", args.predict_url, f"/predict?learn={'true' if args.learn else 'false'}",
+                              [json.dumps(e).encode() for e in events], args.concurrency, args.timeout))
+    if "recommend" in mix:
+        targets.append(Target("recommend", args.recommend_url, "/recommend",
+                              [json.dumps(r).encode() for r in recommend_requests(k=args.k)],
+                              args.concurrency, args.timeout))
+
+    report = asyncio.run(run_load(targets, [mix[t.name] for t in targets], args.qps, args.duration, args.warmup))
+    report["args"] = vars(args)
+    print_report(report)
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, indent=2))
+        print(f"Wrote {Path(args.out).resolve()}")
+
+if __name__ == "__main__":
+    main()
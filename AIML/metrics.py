@@ -0,0 +1,272 @@
+# metrics.py
+"""
+In-process metrics for the Python services, rendered in the Prometheus text
+format (version 0.0.4) on GET /metrics, with no client library needed.
+- Counter / Histogram / Gauge live in one Registry (REGISTRY); gauges can
+  be backed by a callable that is read at scrape time (queue depth, rows...)
+- phase(hist, *labels) times a block into a histogram
+- instrument_flask / instrument_fastapi count requests and their latency
+  per route and status
+With ENABLED = False (or METRICS_ENABLED=0 in the environment) phase()
+hands back a shared no-op context and observe/inc return at once, so the
+instrumented hot paths cost one attribute check. Each process (gunicorn
+worker) keeps its own numbers; scrape every worker or run one.
+"""
+import bisect
+import os
+import threading
+import time
+from contextlib import nullcontext
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+ENABLED = os.environ.get("METRICS_ENABLED", "1") != "0"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# seconds; fine at the low end, where single-event scoring and lookups sit
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+ANOMALY_RATE_WINDOW = 1000   # recent predictions the anomaly-rate gauge covers
+
+_NULL = nullcontext()
+
+def _escape(v: Any) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: Sequence[str], values: Sequence[Any], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _num(v: float) -> str:
+    if v != v:
+        return "NaN"
+    if v in (float("inf"), float("-inf")):
+        return "+Inf" if v > 0 else "-Inf"
+    return repr(float(v))
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, *labels, n: float = 1.0):
+        if not ENABLED:
+            return
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + n
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self._header() + [f"{self.name}{_labels(self.labelnames, k)} {_num(v)}" for k, v in items]
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple, List] = {}   # labels -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, *labels):
+        if not ENABLED:
+            return
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(labels)
+            if s is None:
+                s = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            s[i] += 1
+            s[-2] += value
+            s[-1] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._series.items())
+        out = self._header()
+        for k, s in items:
+            acc = 0
+            for b, c in zip(self.buckets + (float("inf"),), s):
+                acc += c
+                le = 'le="%s"' % _num(b)
+                out.append(f"{self.name}_bucket{_labels(self.labelnames, k, le)} {acc}")
+            out.append(f"{self.name}_sum{_labels(self.labelnames, k)} {_num(s[-2])}")
+            out.append(f"{self.name}_count{_labels(self.labelnames, k)} {s[-1]}")
+        return out
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple, float] = {}
+        self._fns: Dict[Tuple, Callable[[], Optional[float]]] = {}
+
+    def set(self, value: float, *labels):
+        if not ENABLED:
+            return
+        with self._lock:
+            self._values[labels] = float(value)
+
+    def set_function(self, fn: Callable[[], Optional[float]], *labels):
+        """Read fn() at scrape time (None = no sample); replaces an earlier function for these labels."""
+        with self._lock:
+            self._fns[labels] = fn
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = dict(self._values)
+            fns = dict(self._fns)
+        for k, fn in fns.items():
+            try:
+                v = fn()
+            except Exception:
+                v = None
+            if v is not None:
+                values[k] = float(v)
+        return self._header() + [f"{self.name}{_labels(self.labelnames, k)} {_num(v)}"
+                                 for k, v in sorted(values.items())]
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, *args, **kwargs):
+        with self._lock:
+            m = self._metrics.get(name)
+            if m is None:
+                m = self._metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(m, cls):
+                raise ValueError(f"Metric '{name}' is already registered as a {m.kind}.")
+            return m
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._get(Counter, name, help, labelnames)
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, help, labelnames, buckets)
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._get(Gauge, name, help, labelnames)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = [self._metrics[n] for n in sorted(self._metrics)]
+        lines: List[str] = []
+        for m in metrics:
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+class _Timer:
+    __slots__ = ("hist", "labels", "t0")
+
+    def __init__(self, hist: Histogram, labels: Tuple):
+        self.hist = hist
+        self.labels = labels
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe(time.perf_counter() - self.t0, *self.labels)
+        return False
+
+def phase(hist: Histogram, *labels):
+    """`with phase(H, "score"):` records the block's wall time under those labels."""
+    return _Timer(hist, labels) if ENABLED else _NULL
+
+class RateWindow:
+    """Share of 1s among the last `size` recorded 0/1 outcomes (e.g. is_anomaly)."""
+
+    def __init__(self, size: int = ANOMALY_RATE_WINDOW):
+        self.size = int(size)
+        self._ring = bytearray(self.size)
+        self._i = 0
+        self._n = 0
+        self._ones = 0
+        self._lock = threading.Lock()
+
+    def add_many(self, flags: Sequence[int]):
+        if not ENABLED:
+            return
+        with self._lock:
+            for f in flags:
+                f = 1 if f else 0
+                self._ones += f - self._ring[self._i]
+                self._ring[self._i] = f
+                self._i = (self._i + 1) % self.size
+                self._n = min(self._n + 1, self.size)
+
+    def rate(self) -> Optional[float]:
+        with self._lock:
+            return self._ones / self._n if self._n else None
+
+# ---- HTTP instrumentation ----
+
+def _http_metrics(app_name: str):
+    requests = REGISTRY.counter("http_requests_total", "HTTP requests handled.", ("app", "route", "method", "status"))
+    latency = REGISTRY.histogram("http_request_duration_seconds", "HTTP request latency.", ("app", "route", "method"))
+    return requests, latency
+
+def instrument_flask(app, app_name: str):
+    """Count and time every request of a Flask app, labelled by URL rule (not raw path)."""
+    from flask import g, request
+    requests, latency = _http_metrics(app_name)
+
+    @app.before_request
+    def _start_timer():
+        g._metrics_t0 = time.perf_counter()
+
+    @app.after_request
+    def _record(response):
+        t0 = g.pop("_metrics_t0", None)
+        if t0 is not None and ENABLED:
+            route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+            latency.observe(time.perf_counter() - t0, app_name, route, request.method)
+            requests.inc(app_name, route, request.method, str(response.status_code))
+        return response
+
+    return app
+
+def instrument_fastapi(app, app_name: str):
+    """Same for a FastAPI/Starlette app, labelled by the matched route's path template."""
+    requests, latency = _http_metrics(app_name)
+
+    @app.middleware("http")
+    async def _record(request, call_next):
+        if not ENABLED:
+            return await call_next(request)
+        t0 = time.perf_counter()
+        status = "500"
+        try:
+            response = await call_next(request)
+            status = str(response.status_code)
+            return response
+        finally:
+            route = getattr(request.scope.get("route"), "path", "unmatched")
+            latency.observe(time.perf_counter() - t0, app_name, route, request.method)
+            requests.inc(app_name, route, request.method, status)
+
+    return app
+
+def render() -> str:
+    return REGISTRY.render()
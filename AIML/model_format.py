@@ -0,0 +1,287 @@
+# model_format.py
+"""
+Flat binary format for the `MinMaxScaler | QuantileFilter(HalfSpaceTrees)`
+anomaly pipeline, instead of a cloudpickle of River objects.
+Layout: 8-byte magic, uint32 header length, a JSON header (format version,
+hyper-parameters, counters, and the dtype/shape/offset of every array), then
+the raw arrays, each 64-byte aligned:
+  mins, maxs              MinMaxScaler state per feature (inf/-inf = unseen)
+  feature, threshold      HST splits, heap-ordered as in hst_numpy.NumpyHST
+  l_mass, r_mass          HST mass counters
+  limits                  per-feature split ranges (NaN = default)
+  rng_state               the HST's Mersenne Twister state (new trees after a reset)
+  quantile_*              the P-square markers of the running threshold quantile
+                          (River's private layout: the header records the River
+                          version, and loading refuses any other version)
+load_arrays() maps the file and hands back views into it, so gunicorn/uvicorn
+workers that open the same file share the pages; load() rebuilds the River
+pipeline the services run. inference.load_model/save_model use this format
+for paths ending in SUFFIX and sniff MAGIC on load.
+
+    python model_format.py export hst_quantile_model.pkl hst_quantile_model.hstm
+    python model_format.py check  hst_quantile_model.pkl [MachineSensorData_anomalies.csv]
+"""
+import json
+import mmap
+import random
+import struct
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple, Union
+
+import numpy as np
+
+from hst_numpy import NumpyHSTPipeline
+
+MAGIC = b"HSTMODL\x00"
+FORMAT_VERSION = 2    # 2: the quantile state records the River version it came from
+SUFFIX = ".hstm"
+_ALIGN = 64
+_LEN = struct.Struct("<I")
+
+def is_binary(path: Path) -> bool:
+    """True if the file starts with MAGIC (so pickles keep loading as before)."""
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+def wants_binary(path: Path) -> bool:
+    return Path(path).suffix == SUFFIX
+
+# ---- River's P-square quantile (stats.Quantile) state ----
+# RsQuantile pickles as: q (f64), then four Vec<f64> (u64 length + values):
+# desired-position increments, desired positions, positions, heights,
+# and a trailing u8 flag
+
+_QUANTILE_VECS = ("dn", "desired", "positions", "heights")
+
+def _river_version() -> str:
+    import river
+    return river.__version__
+
+def _quantile_arrays(quantile) -> Tuple[Dict[str, Any], Dict[str, np.ndarray]]:
+    # River exposes no public state for its (Rust) quantile, so this reads the private
+    # byte layout; the header records the River version it was read from
+    blob = quantile._quantile.__getstate__()
+    (q,) = struct.unpack_from("<d", blob, 0)
+    off = 8
+    arrays = {}
+    for name in _QUANTILE_VECS:
+        (n,) = struct.unpack_from("<Q", blob, off)
+        arrays[f"quantile_{name}"] = np.frombuffer(blob, dtype="<f8", count=n, offset=off + 8).copy()
+        off += 8 + 8 * n
+    if off + 1 != len(blob):
+        raise ValueError("Unsupported River quantile state layout; keep this model as a pickle.")
+    return {"q": q, "flag": blob[off], "is_updated": bool(quantile._is_updated),
+            "river_version": _river_version()}, arrays
+
+def _quantile_from_arrays(meta: Dict[str, Any], arrays: Dict[str, np.ndarray]):
+    from river import stats
+    if meta["river_version"] != _river_version():
+        raise ValueError(f"Binary model was written with River {meta['river_version']}, but River "
+                         f"{_river_version()} is installed; its quantile state layout is private and may "
+                         "differ. Re-export the model from its pickle with this River version "
+                         "(python model_format.py export MODEL.pkl MODEL.hstm).")
+    quantile = stats.Quantile(q=meta["q"])
+    parts = [struct.pack("<d", meta["q"])]
+    for name in _QUANTILE_VECS:
+        a = np.asarray(arrays[f"quantile_{name}"], dtype="<f8")
+        parts += [struct.pack("<Q", len(a)), a.tobytes()]
+    parts.append(bytes([meta["flag"]]))
+    quantile._quantile.__setstate__(b"".join(parts))
+    quantile._is_updated = meta["is_updated"]
+    return quantile
+
+# ---- write ----
+
+def _to_numpy(model) -> NumpyHSTPipeline:
+    if isinstance(model, NumpyHSTPipeline):
+        return model
+    return NumpyHSTPipeline.from_river(model)
+
+def dumps(model) -> bytes:
+    """Serialize a River pipeline (or a NumpyHSTPipeline) to the binary format."""
+    m = _to_numpy(model)
+    h = m.hst
+    limits = np.full((len(m.feature_names), 2), np.nan)
+    for i, (lo, hi) in h.limits.items():
+        limits[i] = (lo, hi)
+    version, mt, gauss = h.rng.getstate()
+    arrays: Dict[str, np.ndarray] = {
+        "mins": m.mins, "maxs": m.maxs,
+        "feature": h.feature, "threshold": h.threshold, "l_mass": h.l_mass, "r_mass": h.r_mass,
+        "limits": limits, "rng_state": np.asarray(mt, dtype=np.uint32),
+    }
+    quantile = None
+    if m.quantile is not None:
+        quantile, q_arrays = _quantile_arrays(m.quantile)
+        arrays.update(q_arrays)
+
+    header: Dict[str, Any] = {
+        "format_version": FORMAT_VERSION,
+        "feature_names": m.feature_names,
+        "n_trees": h.n_trees, "height": h.height, "window_size": h.window_size, "seed": h.seed,
+        "counter": int(h.counter), "first_window": bool(h.first_window), "built": bool(h.built),
+        "q": m.q, "quantile": quantile, "rng": {"version": version, "gauss_next": gauss},
+        "arrays": {},
+    }
+    # offsets depend on the header length, which depends on the offsets: lay out
+    # the arrays relative to the data start, then pad the header to a fixed size
+    rel = 0
+    for name, a in arrays.items():
+        a = np.ascontiguousarray(a)
+        arrays[name] = a
+        header["arrays"][name] = {"dtype": a.dtype.str, "shape": list(a.shape), "offset": rel}
+        rel += -(-a.nbytes // _ALIGN) * _ALIGN
+    text = json.dumps(header).encode("utf-8")
+    data_start = -(-(len(MAGIC) + _LEN.size + len(text) + 32) // _ALIGN) * _ALIGN
+    header["data_start"] = data_start
+    text = json.dumps(header).encode("utf-8")
+    assert len(MAGIC) + _LEN.size + len(text) <= data_start
+    text += b" " * (data_start - len(MAGIC) - _LEN.size - len(text))
+
+    out = bytearray(data_start + rel)
+    out[:len(MAGIC)] = MAGIC
+    _LEN.pack_into(out, len(MAGIC), len(text))
+    out[len(MAGIC) + _LEN.size:data_start] = text
+    for name, a in arrays.items():
+        off = data_start + header["arrays"][name]["offset"]
+        out[off:off + a.nbytes] = a.tobytes()
+    return bytes(out)
+
+def save(model, path: Path):
+    from fileutil import write_atomic
+    write_atomic(Path(path), dumps(model))
+
+# ---- read ----
+
+def _header(buf) -> Dict[str, Any]:
+    if bytes(buf[:len(MAGIC)]) != MAGIC:
+        raise ValueError("Not a binary anomaly model (bad magic).")
+    (n,) = _LEN.unpack_from(buf, len(MAGIC))
+    header = json.loads(bytes(buf[len(MAGIC) + _LEN.size:len(MAGIC) + _LEN.size + n]))
+    if header.get("format_version") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported binary model format {header.get('format_version')} "
+                         f"(expected {FORMAT_VERSION}); re-export it from the pickle.")
+    return header
+
+def load_arrays(path: Path, mode: str = "r") -> Tuple[Dict[str, Any], Dict[str, np.ndarray]]:
+    """
+    Header and zero-copy array views of a binary model.
+    mode: "r" read-only shared pages, "c" copy-on-write (pages are copied
+          only when written, e.g. by learning), None reads into memory
+    """
+    if mode is None:
+        buf: Union[bytes, mmap.mmap] = Path(path).read_bytes()
+    else:
+        with open(path, "rb") as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ if mode == "r" else mmap.ACCESS_COPY)
+    header = _header(buf)
+    arrays = {}
+    for name, spec in header["arrays"].items():
+        dtype = np.dtype(spec["dtype"])
+        count = int(np.prod(spec["shape"]))
+        a = np.frombuffer(buf, dtype=dtype, count=count, offset=header["data_start"] + spec["offset"])
+        arrays[name] = a.reshape(spec["shape"])
+    return header, arrays
+
+def load_numpy(path: Path, mode: Optional[str] = "c") -> NumpyHSTPipeline:
+    """The model as a NumpyHSTPipeline whose tree arrays live in the mapped file."""
+    header, arrays = load_arrays(path, mode)
+    m = NumpyHSTPipeline(header["feature_names"], n_trees=header["n_trees"], height=header["height"],
+                         window_size=header["window_size"], seed=header["seed"], q=header["q"],
+                         quantile=(_quantile_from_arrays(header["quantile"], arrays)
+                                   if header["quantile"] is not None else None))
+    m.mins, m.maxs = np.array(arrays["mins"]), np.array(arrays["maxs"])
+    h = m.hst
+    h.feature, h.threshold = arrays["feature"], arrays["threshold"]
+    h.l_mass, h.r_mass = arrays["l_mass"], arrays["r_mass"]
+    h.limits = {i: (float(lo), float(hi)) for i, (lo, hi) in enumerate(arrays["limits"].tolist()) if lo == lo}
+    h.rng = random.Random()
+    h.rng.setstate((header["rng"]["version"], tuple(arrays["rng_state"].tolist()), header["rng"]["gauss_next"]))
+    h.counter = header["counter"]
+    h.first_window = header["first_window"]
+    h.built = header["built"]
+    return m
+
+def load(path: Path):
+    """The River pipeline stored in a binary model file."""
+    return load_numpy(path, mode="r").to_river()
+
+# ---- CLI ----
+
+def _check(pkl_path: Path, csv_path: Optional[str]) -> Dict[str, Any]:
+    """Round-trip a pickled model; compare sizes, load/save times and replayed scores."""
+    import tempfile
+    import cloudpickle as pickle
+    from inference import load_model, score_x
+    from ingest import iter_feature_dicts
+    from features import NUMERIC_COLS
+    from window_features import for_model, iter_enriched_dicts
+
+    def best_of(fn, n=5):
+        times = []
+        for _ in range(n):
+            t0 = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - t0)
+        return min(times)
+
+    model = load_model(pkl_path)
+    with tempfile.TemporaryDirectory() as d:
+        bin_path = Path(d) / f"model{SUFFIX}"
+        save(model, bin_path)
+        res = {
+            "pickle_bytes": Path(pkl_path).stat().st_size,
+            "binary_bytes": bin_path.stat().st_size,
+            "pickle_load_s": best_of(lambda: load_model(pkl_path)),
+            "binary_load_s": best_of(lambda: load(bin_path)),
+            "binary_map_s": best_of(lambda: load_arrays(bin_path)),
+            "pickle_save_s": best_of(lambda: pickle.dumps(model)),
+            "binary_save_s": best_of(lambda: dumps(model)),
+        }
+        restored = load(bin_path)
+        res["state_equal"] = dumps(restored) == dumps(model)
+        if csv_path:
+            diff = mism = rows = 0
+            window = for_model(model)   # models trained on rolling features replay with them
+            xs = iter_enriched_dicts(csv_path, window) if window else iter_feature_dicts(csv_path, NUMERIC_COLS)
+            for _, x in xs:
+                a, a_anom = score_x(x, model)
+                b, b_anom = score_x(x, restored)
+                model.learn_one(x)
+                restored.learn_one(x)
+                diff = max(diff, abs(a - b))
+                mism += a_anom != b_anom
+                rows += 1
+            res.update({"rows": rows, "max_abs_score_diff": diff, "is_anomaly_mismatches": mism})
+    return res
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) >= 3 and argv[0] == "export":
+        from inference import load_model
+        save(load_model(Path(argv[1])), Path(argv[2]))
+        print(f"Wrote {Path(argv[2]).resolve()} ({Path(argv[2]).stat().st_size:,} bytes)")
+    elif len(argv) >= 2 and argv[0] == "check":
+        res = _check(Path(argv[1]), argv[2] if len(argv) > 2 else None)
+        print(f"size {res['pickle_bytes']:,} -> {res['binary_bytes']:,} bytes | "
+              f"load {res['pickle_load_s'] * 1000:.2f} -> {res['binary_load_s'] * 1000:.2f} ms "
+              f"(map only {res['binary_map_s'] * 1000:.3f} ms) | "
+              f"save {res['pickle_save_s'] * 1000:.2f} -> {res['binary_save_s'] * 1000:.2f} ms | "
+              f"state equal {res['state_equal']}")
+        if "rows" in res:
+            print(f"{res['rows']} rows replayed with learning | max |score diff| = {res['max_abs_score_diff']:.3g} | "
+                  f"is_anomaly mismatches = {res['is_anomaly_mismatches']}")
+        if not res["state_equal"] or res.get("max_abs_score_diff") or res.get("is_anomaly_mismatches"):
+            sys.exit(1)
+    else:
+        print(__doc__.strip().splitlines()[-2].strip())
+        print(__doc__.strip().splitlines()[-1].strip())
+        sys.exit(2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+# quantiles.py
+"""
+Incremental quantile trackers for anomaly-score thresholds.
+- WindowedQuantile: exact quantile of the last `window` values, O(log w)
+  per update (two heaps with lazy deletion). Returns exactly what
+  np.quantile(last_window, q) would, without re-sorting every row.
+- P2Quantile: constant-memory P² sketch over the whole stream.
+Both expose update(x) / get() like river.stats.Quantile, so either can
+stand in for QuantileFilter's threshold in inference.predict_one.
+"""
+import heapq
+import math
+from collections import deque
+from typing import Optional
+
+class WindowedQuantile:
+    def __init__(self, q: float, window: int = 1000, min_count: int = 0):
+        """
+        min_count: get() returns None until more than this many values are in
+                   the window (streaming_hst_template waits for > 100)
+        """
+        if not 0 <= q <= 1:
+            raise ValueError("q must be in [0, 1]")
+        self.q = q
+        self.window = int(window)
+        self.min_count = int(min_count)
+        self._fifo: deque = deque()   # (value, seq) in arrival order
+        self._low: list = []          # max-heap via (-value, seq): the k+1 smallest
+        self._high: list = []         # min-heap (value, seq): the rest
+        self._side: dict = {}         # seq -> "l" | "h" for live entries
+        self._n_low = 0
+        self._n_high = 0
+        self._seq = 0
+
+    def __len__(self) -> int:
+        return len(self._fifo)
+
+    def _k(self, n: int) -> int:
+        return min(int(math.floor((n - 1) * self.q)), n - 1)
+
+    def _prune(self, heap: list):
+        while heap and heap[0][1] not in self._side:
+            heapq.heappop(heap)
+        if heap is self._low and len(heap) > 2 * self._n_low + 64:
+            self._low = [e for e in heap if e[1] in self._side]
+            heapq.heapify(self._low)
+        elif heap is self._high and len(heap) > 2 * self._n_high + 64:
+            self._high = [e for e in heap if e[1] in self._side]
+            heapq.heapify(self._high)
+
+    def _low_top(self):
+        self._prune(self._low)
+        v, s = self._low[0]
+        return -v, s
+
+    def _high_top(self):
+        self._prune(self._high)
+        return self._high[0]
+
+    def _rebalance(self):
+        n = len(self._fifo)
+        want_low = self._k(n) + 1 if n else 0
+        while self._n_low > want_low:
+            v, s = self._low_top()
+            heapq.heappop(self._low)
+            heapq.heappush(self._high, (v, s))
+            self._side[s] = "h"
+            self._n_low -= 1
+            self._n_high += 1
+        while self._n_low < want_low:
+            v, s = self._high_top()
+            heapq.heappop(self._high)
+            heapq.heappush(self._low, (-v, s))
+            self._side[s] = "l"
+            self._n_low += 1
+            self._n_high -= 1
+        # keep every low value <= every high value
+        while self._n_low and self._n_high:
+            lv, ls = self._low_top()
+            hv, hs = self._high_top()
+            if lv <= hv:
+                break
+            heapq.heappop(self._low)
+            heapq.heappop(self._high)
+            heapq.heappush(self._low, (-hv, hs))
+            heapq.heappush(self._high, (lv, ls))
+            self._side[hs] = "l"
+            self._side[ls] = "h"
+
+    def update(self, x: float):
+        x = float(x)
+        s = self._seq
+        self._seq += 1
+        self._fifo.append((x, s))
+        if self._n_low and x <= self._low_top()[0]:
+            heapq.heappush(self._low, (-x, s))
+            self._side[s] = "l"
+            self._n_low += 1
+        else:
+            heapq.heappush(self._high, (x, s))
+            self._side[s] = "h"
+            self._n_high += 1
+        if len(self._fifo) > self.window:
+            _, old = self._fifo.popleft()
+            if self._side.pop(old) == "l":
+                self._n_low -= 1
+            else:
+                self._n_high -= 1
+        self._rebalance()
+
+    def get(self) -> Optional[float]:
+        n = len(self._fifo)
+        if n == 0 or n <= self.min_count:
+            return None
+        vi = (n - 1) * self.q
+        a = self._low_top()[0]
+        if vi >= n - 1 or not self._n_high:
+            return a
+        b = self._high_top()[0]
+        # same linear interpolation as numpy's "linear" method
+        gamma = vi - math.floor(vi)
+        diff = b - a
+        return b - diff * (1 - gamma) if gamma >= 0.5 else a + diff * gamma
+
+class P2Quantile:
+    """P² streaming quantile (Jain & Chlamtac, 1985): five markers, O(1) per update."""
+
+    def __init__(self, q: float, min_count: int = 0):
+        if not 0 < q < 1:
+            raise ValueError("q must be in (0, 1)")
+        self.q = q
+        self.min_count = int(min_count)
+        self.n = 0
+        self._h: list = []                               # marker heights
+        self._pos = [1, 2, 3, 4, 5]                      # marker positions
+        self._want = [1, 1 + 2 * q, 1 + 4 * q, 3 + 2 * q, 5]
+        self._dwant = [0, q / 2, q, (1 + q) / 2, 1]
+
+    def __len__(self) -> int:
+        return self.n
+
+    def update(self, x: float):
+        x = float(x)
+        self.n += 1
+        h = self._h
+        if self.n <= 5:
+            h.append(x)
+            h.sort()
+            return
+        if x < h[0]:
+            h[0] = x
+            k = 0
+        elif x >= h[4]:
+            h[4] = x
+            k = 3
+        else:
+            k = 0
+            while k < 3 and x >= h[k + 1]:
+                k += 1
+        pos = self._pos
+        for i in range(k + 1, 5):
+            pos[i] += 1
+        for i in range(5):
+            self._want[i] += self._dwant[i]
+        for i in (1, 2, 3):
+            d = self._want[i] - pos[i]
+            if (d >= 1 and pos[i + 1] - pos[i] > 1) or (d <= -1 and pos[i - 1] - pos[i] < -1):
+                d = 1 if d > 0 else -1
+                hp = self._parabolic(i, d)
+                if not h[i - 1] < hp < h[i + 1]:
+                    hp = h[i] + d * (h[i + d] - h[i]) / (pos[i + d] - pos[i])
+                h[i] = hp
+                pos[i] += d
+
+    def _parabolic(self, i: int, d: int) -> float:
+        h, n = self._h, self._pos
+        return h[i] + d / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + d) * (h[i + 1] - h[i]) / (n[i + 1] - n[i])
+            + (n[i + 1] - n[i] - d) * (h[i] - h[i - 1]) / (n[i] - n[i - 1])
+        )
+
+    def get(self) -> Optional[float]:
+        if self.n == 0 or self.n <= self.min_count:
+            return None
+        if self.n <= 5:
+            # too few values for the markers: interpolate the sorted values like np.quantile
+            vals = self._h
+            vi = (len(vals) - 1) * self.q
+            lo = int(math.floor(vi))
+            if lo >= len(vals) - 1:
+                return vals[-1]
+            a, b = vals[lo], vals[lo + 1]
+            gamma = vi - lo
+            return b - (b - a) * (1 - gamma) if gamma >= 0.5 else a + (b - a) * gamma
+        return self._h[2]
+
+def make_threshold(kind: str, q: float, window: int = 1000, min_count: int = 100):
+    """
+    kind: "window" (exact sliding-window quantile) or "p2" (streaming sketch).
+    "river" returns None, meaning: use the model's own QuantileFilter.
+    """
+    if kind == "river":
+        return None
+    if kind == "window":
+        return WindowedQuantile(q, window=window, min_count=min_count)
+    if kind == "p2":
+        return P2Quantile(q, min_count=min_count)
+    raise ValueError(f"Unknown threshold kind '{kind}'. Use 'river', 'window' or 'p2'.")
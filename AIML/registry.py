@@ -0,0 +1,195 @@
+# registry.py
+"""
+Per-machine (or per-machine-type) model shards with bounded memory.
+Shards are created lazily on first use, kept in an LRU of at most
+`max_resident` models, and spilled to `shard_dir` when evicted; the next
+request for an evicted key reloads it from disk. Loading or creating a
+shard happens outside the registry lock (other keys stay available;
+concurrent requests for the same key wait for the one load), and spills
+are written by a background thread rather than the request that evicted.
+"""
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import cloudpickle as pickle
+
+from fileutil import write_atomic
+from inference import load_model
+from concurrency import RWLock
+
+SHARD_DIR = Path("shards")
+MAX_RESIDENT_SHARDS = 256
+DEFAULT_SHARD_KEY = "__default__"   # events without the shard field land here
+
+class Shard:
+    __slots__ = ("key", "model", "threshold", "lock", "save_lock", "dirty", "evicted")
+
+    def __init__(self, key: str, model, threshold=None):
+        self.key = key
+        self.model = model
+        self.threshold = threshold          # optional quantile tracker (not persisted)
+        self.lock = RWLock()                # read: score/serialize, write: learn
+        self.save_lock = threading.Lock()   # orders concurrent writes of this shard's file
+        self.dirty = 0                      # events learned since last saved to disk
+        self.evicted = False                # set once spilled; holders must re-fetch
+
+def shard_key(event: Dict[str, Any], field: str) -> str:
+    v = event.get(field)
+    if v in (None, ""):
+        return DEFAULT_SHARD_KEY
+    return str(v)
+
+class ShardRegistry:
+    def __init__(self, factory: Optional[Callable[[], Any]] = None, seed_model=None,
+                 shard_dir: Path = SHARD_DIR, max_resident: int = MAX_RESIDENT_SHARDS,
+                 threshold_factory: Optional[Callable[[], Any]] = None):
+        """
+        factory: builds a fresh model for a key seen for the first time
+        seed_model: alternatively, new shards start as a deep copy of this model
+                    (e.g. the global pipeline), so they are warm from the first event
+        threshold_factory: per-shard quantile tracker (quantiles.make_threshold);
+                           trackers live in memory only and re-warm after a reload
+        """
+        self.threshold_factory = threshold_factory
+        if factory is None and seed_model is None:
+            from train_save_river import build_model
+            factory = build_model
+        if seed_model is not None:
+            seed_bytes = pickle.dumps(seed_model)
+            factory = lambda: pickle.loads(seed_bytes)
+        self.factory = factory
+        self.shard_dir = Path(shard_dir)
+        self.shard_dir.mkdir(parents=True, exist_ok=True)
+        self.max_resident = max(1, int(max_resident))
+        self._shards: "OrderedDict[str, Shard]" = OrderedDict()
+        self._spilling: Dict[str, threading.Event] = {}  # evicted, file not yet written
+        self._loading: Dict[str, threading.Event] = {}   # being loaded/created by another thread
+        self._lock = threading.Lock()
+        self._spiller = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shard-spill")
+        self.hits = 0
+        self.created = 0
+        self.loaded = 0
+        self.evictions = 0
+
+    def path_for(self, key: str) -> Path:
+        # keep filenames readable but collision-free for arbitrary keys
+        safe = re.sub(r"[^A-Za-z0-9_.-]", "_", key)[:64]
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:10]
+        return self.shard_dir / f"{safe}-{digest}.pkl"
+
+    def get(self, key: str) -> Shard:
+        while True:
+            with self._lock:
+                shard = self._shards.get(key)
+                if shard is not None:
+                    self._shards.move_to_end(key)
+                    self.hits += 1
+                    return shard
+                # evicted a moment ago and still being written, or another thread is loading it
+                busy = self._spilling.get(key) or self._loading.get(key)
+                if busy is None:
+                    loading = self._loading[key] = threading.Event()
+                    break
+            busy.wait()
+        try:
+            shard = self._load(key)
+        finally:
+            with self._lock:
+                del self._loading[key]
+                if shard is not None:
+                    self._shards[key] = shard
+                    while len(self._shards) > self.max_resident:
+                        victim_key, victim = self._shards.popitem(last=False)
+                        done = self._spilling[victim_key] = threading.Event()
+                        self._spiller.submit(self._spill, victim, done)
+            loading.set()
+        return shard
+
+    def _load(self, key: str) -> Shard:
+        # outside self._lock: unpickling or building a model must not stall other keys
+        path = self.path_for(key)
+        threshold = self.threshold_factory() if self.threshold_factory else None
+        if path.exists():
+            model = load_model(path)
+            with self._lock:
+                self.loaded += 1
+        else:
+            model = self.factory()
+            with self._lock:
+                self.created += 1
+        return Shard(key, model, threshold)
+
+    def _spill(self, shard: Shard, done: threading.Event):
+        # on the spill thread, so other shards stay available while this one is pickled and written
+        try:
+            with shard.save_lock:
+                with shard.lock.write:  # waits out in-flight scoring/learning; later holders see evicted
+                    shard.evicted = True
+                    dirty, shard.dirty = shard.dirty, 0
+                if dirty:
+                    write_atomic(self.path_for(shard.key), pickle.dumps(shard.model))
+            with self._lock:
+                self.evictions += 1
+        finally:
+            with self._lock:
+                del self._spilling[shard.key]
+            done.set()
+
+    def learn(self, key: str, xs: List[Dict[str, float]], scores: Optional[List[float]] = None):
+        """
+        Apply learn_one for each x to the shard for `key` (single-writer thread
+        only); `scores` feed the shard's threshold tracker, if it has one.
+        """
+        while True:
+            shard = self.get(key)
+            with shard.lock.write:
+                if shard.evicted:
+                    continue  # spilled between get() and lock; reload the saved copy
+                for x in xs:
+                    shard.model.learn_one(x)
+                if shard.threshold is not None and scores:
+                    for s in scores:
+                        shard.threshold.update(s)
+                shard.dirty += len(xs)
+                return
+
+    def flush(self) -> int:
+        """Finish pending spills, then write every dirty resident shard to disk. Returns bytes written."""
+        with self._lock:
+            spilling = list(self._spilling.values())
+        for done in spilling:
+            done.wait()
+        with self._lock:
+            shards = list(self._shards.values())
+        written = 0
+        for shard in shards:
+            with shard.save_lock:
+                with shard.lock.read:
+                    if shard.evicted or not shard.dirty:
+                        continue
+                    data = pickle.dumps(shard.model)
+                    taken = shard.dirty
+                write_atomic(self.path_for(shard.key), data)
+                with shard.lock.write:
+                    shard.dirty -= taken
+                written += len(data)
+        return written
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "resident": len(self._shards),
+                "max_resident": self.max_resident,
+                "hits_total": self.hits,
+                "created_total": self.created,
+                "loaded_total": self.loaded,
+                "evictions_total": self.evictions,
+                "spilling": len(self._spilling),
+                "loading": len(self._loading),
+                "shard_dir": str(self.shard_dir),
+            }
@@ -0,0 +1,114 @@
+# result_cache.py
+"""
+Bounded LRU + TTL cache for repeated read-only queries: the same reading
+sent to /predict?learn=false by dashboard polling, or the same
+(company_id, asset, current_rented, k) sent to /recommend by
+server/simulation.js.
+Entries are tagged with the cache's generation. invalidate() (called when
+the model learns, or the KNN data changes in place) bumps it in O(1);
+entries from older generations read as misses and age out of the LRU.
+Passing `source` (the model or artifact object a result was computed
+from) invalidates by itself when that object is swapped for a new one.
+A result whose computation overlapped an invalidate() is not stored.
+Set RESULT_CACHE_SIZE=0 in the environment to turn caching off.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from metrics import REGISTRY
+
+CACHE_SIZE = int(os.environ.get("RESULT_CACHE_SIZE", "10000"))   # entries per cache; 0 = off
+CACHE_TTL_S = float(os.environ.get("RESULT_CACHE_TTL_S", "60"))  # max age of a cached result
+
+CACHE_REQUESTS = REGISTRY.counter("result_cache_requests_total", "Result cache lookups, by outcome.",
+                                  ("cache", "result"))
+_ENTRIES = REGISTRY.gauge("result_cache_entries", "Results held by the cache (stale ones included).", ("cache",))
+
+class ResultCache:
+    def __init__(self, name: str, maxsize: int = CACHE_SIZE, ttl_s: float = CACHE_TTL_S):
+        self.name = name
+        self.maxsize = int(maxsize)
+        self.ttl_s = float(ttl_s)
+        self._data: "OrderedDict[Hashable, Tuple[float, int, Any]]" = OrderedDict()  # key -> (expires, gen, value)
+        self._lock = threading.Lock()
+        self._gen = 0
+        self._source_id: Optional[int] = None
+        self._source = None          # held so its id() cannot be reused while we compare against it
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.invalidations = 0
+        _ENTRIES.set_function(lambda: len(self._data), name)
+
+    @property
+    def enabled(self) -> bool:
+        return self.maxsize > 0
+
+    def invalidate(self):
+        """Drop every cached result (lazily)."""
+        with self._lock:
+            self._gen += 1
+            self.invalidations += 1
+
+    def _check_source(self, source):
+        # caller holds self._lock
+        if source is not None and id(source) != self._source_id:
+            if self._source_id is not None:
+                self._gen += 1
+                self.invalidations += 1
+            self._source_id, self._source = id(source), source
+
+    def lookup(self, key: Hashable, source=None) -> Tuple[bool, Any, int]:
+        """(hit, value, token); pass the token to store() with the freshly computed value on a miss."""
+        if not self.enabled:
+            return False, None, -1
+        now = time.monotonic()
+        with self._lock:
+            self._check_source(source)
+            entry = self._data.get(key)
+            if entry is not None:
+                expires, gen, value = entry
+                if gen == self._gen and expires > now:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    CACHE_REQUESTS.inc(self.name, "hit")
+                    return True, value, gen
+                del self._data[key]
+                if gen == self._gen:
+                    self.expired += 1
+            self.misses += 1
+            token = self._gen
+        CACHE_REQUESTS.inc(self.name, "miss")
+        return False, None, token
+
+    def store(self, key: Hashable, value: Any, token: int):
+        if not self.enabled:
+            return
+        with self._lock:
+            if token != self._gen:
+                return    # invalidated while it was being computed
+            self._data[key] = (time.monotonic() + self.ttl_s, token, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any], source=None) -> Any:
+        """Cached value for `key`, else compute() (exceptions are not cached)."""
+        hit, value, token = self.lookup(key, source)
+        if hit:
+            return value
+        value = compute()
+        self.store(key, value, token)
+        return value
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {"enabled": self.enabled, "entries": len(self._data), "maxsize": self.maxsize, "ttl_s": self.ttl_s,
+                "hits_total": self.hits, "misses_total": self.misses,
+                "hit_ratio": self.hits / total if total else None, "expired_total": self.expired,
+                "evictions_total": self.evictions, "invalidations_total": self.invalidations}
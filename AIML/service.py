@@ -0,0 +1,261 @@
+# service.py
+"""
+Thread-safe anomaly scoring service shared by api.py and flask_api.py.
+Scoring runs concurrently under the read side of an RWLock; learn updates
+are queued and applied by a single writer thread under the write side, so
+HST mass counts are never updated while another thread walks the trees.
+With `shard_by` set, events are routed to per-machine (or per-type) models
+held in a ShardRegistry instead of the single global pipeline. Models
+trained on rolling per-machine features get them added to every event
+by a WindowFeatures stage (window_features.py) before scoring; only
+events queued for learning are appended to that history.
+learn=false results are kept in a ResultCache (result_cache.py) keyed on
+the parsed features, and dropped whenever the model learns or is swapped.
+"""
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from inference import MODEL_PATH, PHASE_SECONDS, event_to_x, record_outcomes, score_x
+from metrics import REGISTRY, phase
+from checkpoint import Checkpointer, CHECKPOINT_EVERY_N, CHECKPOINT_EVERY_S
+from concurrency import RWLock, LearnQueue, LearnQueueFull
+from registry import ShardRegistry, shard_key, SHARD_DIR, MAX_RESIDENT_SHARDS
+from quantiles import make_threshold
+from result_cache import ResultCache, CACHE_SIZE
+from window_features import WindowFeatures, for_model
+
+LEARN_QUEUE_SIZE = 10000      # pending learn events before back-pressure kicks in
+LEARN_BACKPRESSURE = "block"  # "block" | "drop" | "reject"
+LEARN_BLOCK_TIMEOUT_S = 1.0   # how long "block" waits for room before giving up
+SHARD_BY: Optional[str] = None  # e.g. "machine_id" or "machine_type" to enable per-key models
+THRESHOLD = "river"           # "river" (QuantileFilter) | "window" | "p2", see quantiles.py
+THRESHOLD_WINDOW = 1000       # scores kept by the "window" threshold
+
+class AnomalyService:
+    def __init__(self, model, model_path: Path = MODEL_PATH,
+                 queue_size: int = LEARN_QUEUE_SIZE, backpressure: str = LEARN_BACKPRESSURE,
+                 block_timeout: float = LEARN_BLOCK_TIMEOUT_S,
+                 shard_by: Optional[str] = SHARD_BY, shard_dir: Path = SHARD_DIR,
+                 max_resident: int = MAX_RESIDENT_SHARDS,
+                 threshold: str = THRESHOLD, threshold_window: int = THRESHOLD_WINDOW,
+                 checkpoint_every_n: int = CHECKPOINT_EVERY_N, checkpoint_every_s: float = CHECKPOINT_EVERY_S,
+                 learner=None, window: Optional[WindowFeatures] = None, cache_size: int = CACHE_SIZE):
+        """
+        shard_by: event field to route on; each distinct value gets its own
+                  model, seeded from `model`, kept in an LRU ShardRegistry
+        threshold: "river" classifies with the pipeline's QuantileFilter;
+                   "window"/"p2" use an incremental tracker fed with the
+                   scores of learned events (one per shard when sharded)
+        learner: replaces the in-process LearnQueue (same put/put_many/
+                 check_room/depth/stats interface), e.g. shared_model.LearnSpool, which hands
+                 learn events to another process
+        window: rolling-feature stage applied to each event before scoring;
+                defaults to the one the model was trained with, if any
+        cache_size: learn=false results kept for repeated identical events
+                    (0 = off); not used with a window stage, whose
+                    features change with every learned event
+        """
+        self.model = model
+        self.window = window if window is not None else for_model(model)
+        self.cache: Optional[ResultCache] = None
+        if cache_size > 0 and self.window is None:
+            self.cache = ResultCache("predict", maxsize=cache_size)
+        self.lock = RWLock()
+        self.shard_by = shard_by
+        q = model["filter"].q
+        new_threshold = lambda: make_threshold(threshold, q, window=threshold_window)
+        self.threshold = new_threshold()
+        self.registry: Optional[ShardRegistry] = None
+        if shard_by:
+            self.registry = ShardRegistry(seed_model=model, shard_dir=shard_dir, max_resident=max_resident,
+                                          threshold_factory=new_threshold if self.threshold is not None else None)
+            self.checkpointer = Checkpointer(model, model_path, every_n=checkpoint_every_n,
+                                             every_s=checkpoint_every_s, saver=self.registry.flush)
+        else:
+            # serializing is read-only, so snapshots only need the read side
+            self.checkpointer = Checkpointer(model, model_path, every_n=checkpoint_every_n,
+                                             every_s=checkpoint_every_s, lock=self.lock.read)
+        self.learner = learner if learner is not None else LearnQueue(
+            self._apply_learn, maxsize=queue_size, policy=backpressure, block_timeout=block_timeout)
+        self._register_gauges(model_path)
+
+    def _register_gauges(self, model_path: Path):
+        # read at scrape time; a newer service in the same process takes them over
+        REGISTRY.gauge("learn_queue_depth", "Learn events waiting for the writer thread.").set_function(self.learner.depth)
+        REGISTRY.gauge("checkpoint_pending_events", "Learned events not yet in a snapshot.").set_function(
+            lambda: self.checkpointer.pending)
+        model_size = REGISTRY.gauge("model_size_bytes", "Serialized size of the served model.", ("model",))
+        model_size.set_function(lambda: self.checkpointer.last_bytes or
+                                (os.path.getsize(model_path) if os.path.exists(model_path) else None), "hst")
+        if self.window is not None:
+            REGISTRY.gauge("window_machines", "Machines with rolling-feature state in memory.").set_function(
+                lambda: len(self.window._slots))
+        if self.registry is not None:
+            REGISTRY.gauge("shards_resident", "Per-key models currently in memory.").set_function(
+                lambda: self.registry.stats().get("resident"))
+
+    def _key(self, event: Dict[str, Any]) -> Optional[str]:
+        return shard_key(event, self.shard_by) if self.registry is not None else None
+
+    def _features(self, event: Dict[str, Any]) -> Dict[str, float]:
+        x = event_to_x(event)
+        if self.window is not None:
+            x = self.window.peek(self.window.key_of(event), x)   # read-only; see _remember
+        return x
+
+    def _remember(self, events: List[Dict[str, Any]], xs: List[Dict[str, float]]):
+        """Append events that were queued for learning to the rolling-feature history."""
+        if self.window is not None:
+            for event, x in zip(events, xs):
+                self.window.append(self.window.key_of(event), x)
+
+    def _cache_lookup(self, key: Optional[str], x: Dict[str, float]):
+        """(cache key, hit, (score, is_anom), token); a swapped-in model (multi-worker reload) invalidates."""
+        ck = (key, tuple(x.items()))
+        hit, value, token = self.cache.lookup(ck, source=self.model if self.registry is None else None)
+        return ck, hit, value, token
+
+    def _resolve(self, key: Optional[str]):
+        """(lock, model, threshold) to score against for a routing key."""
+        if self.registry is None:
+            return self.lock, self.model, self.threshold
+        shard = self.registry.get(key)
+        return shard.lock, shard.model, shard.threshold
+
+    def _apply_learn(self, items: List[Tuple[Optional[str], Dict[str, float], float]]):
+        with phase(PHASE_SECONDS, "learn", "batch"):
+            self._learn(items)
+        if self.cache is not None:
+            self.cache.invalidate()
+        self.checkpointer.note_learn(len(items))
+
+    def _learn(self, items: List[Tuple[Optional[str], Dict[str, float], float]]):
+        if self.registry is None:
+            with self.lock.write:
+                for _, x, score in items:
+                    self.model.learn_one(x)  # updates scaler, HST, and the quantile threshold
+                    if self.threshold is not None:
+                        self.threshold.update(score)
+        else:
+            # shards are independent; only per-key order matters
+            by_key: Dict[str, Tuple[List[Dict[str, float]], List[float]]] = {}
+            for key, x, score in items:
+                xs, scores = by_key.setdefault(key, ([], []))
+                xs.append(x)
+                scores.append(score)
+            for key, (xs, scores) in by_key.items():
+                self.registry.learn(key, xs, scores)
+
+    def start(self):
+        self.learner.start()
+        self.checkpointer.start()
+        return self
+
+    def stop(self):
+        # drain pending learns first so the final checkpoint includes them
+        self.learner.stop()
+        self.checkpointer.stop(flush=True)
+
+    def predict(self, event: Dict[str, Any], learn: bool = False) -> Dict[str, Any]:
+        """
+        Score one event against the current model (or its shard); with
+        learn=True the event is queued for the writer after scoring
+        (score-then-learn), so the response never waits on learn_one.
+        """
+        with phase(PHASE_SECONDS, "parse", "one"):
+            x = self._features(event)
+            key = self._key(event)
+        cached = not learn and self.cache is not None
+        if cached:
+            ck, hit, value, token = self._cache_lookup(key, x)
+            if hit:
+                record_outcomes([value[1]])
+                return {"score": value[0], "is_anomaly": value[1]}
+        lock, model, threshold = self._resolve(key)
+        with phase(PHASE_SECONDS, "score", "one"), lock.read:
+            score, is_anom = score_x(x, model, threshold)
+        if cached:
+            self.cache.store(ck, (score, is_anom), token)
+        record_outcomes([is_anom])
+        if learn and self.learner.put((key, x, score)):
+            self._remember([event], [x])
+        return {"score": score, "is_anomaly": is_anom}
+
+    def predict_batch(self, events: List[Any], learn: bool = False) -> List[Dict[str, Any]]:
+        """
+        Like inference.predict_batch, but events are scored with one read lock
+        acquisition per model (shard) and learned afterwards, in order, by the
+        writer thread. Raises LearnQueueFull (before scoring anything) if the
+        "reject" policy cannot take the whole batch, or (after scoring) if
+        "block" timed out waiting for room for all of it; either way none of
+        the batch is queued for learning.
+        """
+        parsed: List[Any] = []
+        with phase(PHASE_SECONDS, "parse", "batch"):
+            for event in events:
+                if isinstance(event, Exception):
+                    parsed.append(event)
+                elif not isinstance(event, dict):
+                    parsed.append(ValueError("Event must be a JSON object."))
+                else:
+                    try:
+                        parsed.append((self._key(event), event_to_x(event)))
+                    except ValueError as e:
+                        parsed.append(e)
+            ok = [i for i, p in enumerate(parsed) if isinstance(p, tuple)]
+            if self.window is not None and ok:
+                # each machine's later events see its earlier ones, as if learned in order
+                xs = self.window.peek_many([self.window.key_of(events[i]) for i in ok], [parsed[i][1] for i in ok])
+                for i, x in zip(ok, xs):
+                    parsed[i] = (parsed[i][0], x)
+
+        if learn:
+            self.learner.check_room(len(ok))  # "reject": refuse the batch before scoring any of it
+
+        results: List[Dict[str, Any]] = [None] * len(parsed)  # type: ignore[list-item]
+        groups: Dict[Optional[str], List[int]] = {}
+        cached = not learn and self.cache is not None
+        misses: Dict[int, Tuple[Any, int]] = {}
+        for i, p in enumerate(parsed):
+            if isinstance(p, Exception):
+                results[i] = {"error": str(p)}
+                continue
+            if cached:
+                ck, hit, value, token = self._cache_lookup(p[0], p[1])
+                if hit:
+                    results[i] = {"score": value[0], "is_anomaly": value[1]}
+                    continue
+                misses[i] = (ck, token)
+            groups.setdefault(p[0], []).append(i)
+        with phase(PHASE_SECONDS, "score", "batch"):
+            for key, idxs in groups.items():
+                lock, model, threshold = self._resolve(key)
+                with lock.read:
+                    for i in idxs:
+                        try:
+                            score, is_anom = score_x(parsed[i][1], model, threshold)
+                            results[i] = {"score": score, "is_anomaly": is_anom}
+                            if i in misses:
+                                ck, token = misses[i]
+                                self.cache.store(ck, (score, is_anom), token)
+                        except Exception as e:
+                            results[i] = {"error": f"Internal error: {e}"}
+        record_outcomes([r["is_anomaly"] for r in results if "is_anomaly" in r])
+        if learn:
+            # learn in request order, each with the score it was given
+            learned = [i for i in ok if "score" in results[i]]
+            items = [(parsed[i][0], parsed[i][1], results[i]["score"]) for i in learned]
+            if items and self.learner.put_many(items):
+                self._remember([events[i] for i in learned], [parsed[i][1] for i in learned])
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        out = {"checkpoint": self.checkpointer.stats(), "learn_queue": self.learner.stats()}
+        if self.registry is not None:
+            out["shards"] = self.registry.stats()
+        if self.window is not None:
+            out["window"] = self.window.stats()
+        if self.cache is not None:
+            out["cache"] = self.cache.stats()
+        return out
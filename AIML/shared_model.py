@@ -0,0 +1,371 @@
+# shared_model.py
+"""
+Multi-process serving of one anomaly model (gunicorn -w N / uvicorn --workers N).
+Every worker scores; exactly one of them, the owner, learns:
+- the owner holds an exclusive lock on `<snapshot>.owner` and runs the
+  normal AnomalyService on the River pipeline. Its checkpointer writes the
+  model in the binary format (model_format.py) next to the model file
+  (hst_quantile_model.pkl -> hst_quantile_model.hstm) every
+  SNAPSHOT_EVERY_N learned events / SNAPSHOT_EVERY_S seconds
+- the other workers score against that snapshot through SnapshotModel:
+  the tree and mass arrays stay in the memory-mapped file, so all workers
+  share one copy of the pages. They stat the file every SNAPSHOT_CHECK_S
+  and swap in a new version when it changes
+- learn=true on a non-owner scores as usual and appends (features, score)
+  to a spool segment in `<snapshot>.spool/`; the owner replays finished
+  segments, oldest first, through its learn queue and deletes them
+- if the owner dies its lock is released and the next worker to retry
+  (every OWNER_RETRY_S) takes over from the latest snapshot
+- the snapshot, not the model file, holds the learned state while workers
+  run (an owner always starts from it when it exists); the owner writes
+  the model file too when it stops cleanly, so single-process tools that
+  read hst_quantile_model.pkl see what was learned. After a crash the .pkl
+  lags the snapshot until the next clean stop
+- a role change swaps the worker's AnomalyService only once no request is
+  inside the old one, so nothing is put into a stopped queue or spool
+Enable with ANOMALY_MULTI_WORKER=1 for flask_api.py and api.py. Create the
+service in each worker (no gunicorn --preload), so every process opens
+its own lock file. Sharding (SHARD_BY) and the "window"/"p2" thresholds
+are single-process only.
+"""
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+import model_format
+from concurrency import RWLock
+from fileutil import OwnerLock
+from inference import MODEL_PATH, load_model, save_model
+from service import AnomalyService, LearnQueueFull, THRESHOLD
+
+MULTI_WORKER = os.environ.get("ANOMALY_MULTI_WORKER", "0") == "1"
+SNAPSHOT_EVERY_N = 200      # learned events between snapshots the other workers can load
+SNAPSHOT_EVERY_S = 5.0      # max seconds a learned event waits to be published
+SNAPSHOT_CHECK_S = 1.0      # how often non-owners stat the snapshot
+SNAPSHOT_WAIT_S = 60.0      # how long a starting non-owner waits for the first snapshot
+OWNER_RETRY_S = 2.0         # how often non-owners try to take over the owner lock
+SPOOL_FLUSH_S = 0.2         # max seconds a learn event stays buffered in a non-owner
+SPOOL_MAX_EVENTS = 1000     # events per spool segment
+
+# ---- read-only scoring on the mapped snapshot ----
+
+class _SnapshotFilter:
+    def __init__(self, q: float, quantile):
+        self.q = q
+        self.quantile = quantile
+
+    def classify(self, score: float) -> bool:
+        # same rule as river's QuantileFilter.classify
+        return score >= self.quantile.get()
+
+class SnapshotModel:
+    """
+    The parts of the River pipeline that scoring uses (score_one and
+    ["filter"].classify), computed by hst_numpy over a read-only mapping of a
+    binary snapshot. Scores equal the pipeline's; learning is not possible.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.version = _file_version(self.path)
+        self.pipeline = model_format.load_numpy(self.path, mode="r")
+        self.names = self.pipeline.feature_names
+        self._filter = _SnapshotFilter(self.pipeline.q, self.pipeline.quantile)
+
+    def score_one(self, x: Dict[str, float]) -> float:
+        nan = float("nan")
+        row = np.array([[x.get(c, nan) for c in self.names]])
+        return float(self.pipeline.score(row)[0])
+
+    def __getitem__(self, step: str):
+        if step != "filter":
+            raise KeyError(step)
+        return self._filter
+
+    def learn_one(self, x: Dict[str, float]):
+        raise RuntimeError("SnapshotModel is read-only; learning happens in the owner process.")
+
+def _file_version(path: Path) -> Optional[Tuple[int, int, int]]:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+# ---- learn spool ----
+
+class LearnSpool:
+    """
+    Stands in for the LearnQueue of a non-owner: learn items are buffered and
+    written as NDJSON segments (temp file + rename, so the owner only ever
+    sees whole segments) named so that sorting them gives write order.
+    """
+
+    policy = "block"   # never refuses: the spool is on disk
+
+    def __init__(self, spool_dir: Path, flush_s: float = SPOOL_FLUSH_S, max_events: int = SPOOL_MAX_EVENTS):
+        self.dir = Path(spool_dir)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.flush_s = float(flush_s)
+        self.maxsize = self.max_events = int(max_events)
+        self._buf: List[Tuple[Dict[str, float], float]] = []
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.enqueued = 0
+        self.segments = 0
+        self.failed = 0
+        self.last_error: Optional[str] = None
+
+    def put(self, item) -> bool:
+        _, x, score = item
+        with self._lock:
+            self._buf.append((x, score))
+            self.enqueued += 1
+            full = len(self._buf) >= self.max_events
+        if full:
+            self.flush()
+        return True
+
+    def put_many(self, items: List[Any]) -> int:
+        for item in items:
+            self.put(item)
+        return len(items)
+
+    def check_room(self, n: int):
+        pass
+
+    def depth(self) -> int:
+        return len(self._buf)
+
+    def flush(self):
+        with self._lock:
+            buf, self._buf = self._buf, []
+            self._seq += 1
+            seq = self._seq
+        if not buf:
+            return
+        name = f"{time.time_ns():020d}-{os.getpid()}-{seq:06d}.ndjson"
+        tmp = self.dir / f".{name}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                for x, score in buf:
+                    f.write(json.dumps({"x": x, "score": score}) + "\n")
+            os.replace(tmp, self.dir / name)
+            self.segments += 1
+        except OSError as e:
+            self.failed += len(buf)
+            self.last_error = str(e)
+
+    def _run(self):
+        while not self._stop.wait(self.flush_s):
+            self.flush()
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="learn-spool", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 30.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+        self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"depth": self.depth(), "policy": "spool", "enqueued_total": self.enqueued,
+                "segments_total": self.segments, "failed_total": self.failed, "last_error": self.last_error}
+
+def replay_spool(spool_dir: Path, service: AnomalyService, max_segments: int = 100) -> int:
+    """
+    Owner side: feed finished segments, oldest first, into the learn queue;
+    returns events queued. Each segment goes in as whole queue-sized groups
+    (put_many is all-or-nothing); if the queue refuses one, the events not
+    yet queued are written back over the segment and replay stops there, so
+    a retry neither loses nor re-learns anything.
+    """
+    learner = service.learner
+    step = learner.maxsize if learner.maxsize > 0 else None
+    n = 0
+    for seg in sorted(p for p in Path(spool_dir).glob("*.ndjson"))[:max_segments]:
+        try:
+            with open(seg, encoding="utf-8") as f:
+                lines = [line for line in f if line.strip()]
+            items = [(None, e["x"], e["score"]) for e in map(json.loads, lines)]
+        except (OSError, ValueError, KeyError):
+            seg.rename(seg.with_suffix(".bad"))   # keep it for inspection, never retry forever
+            continue
+        done = 0
+        while done < len(items):
+            group = items[done:done + step] if step else items[done:]
+            try:
+                queued = learner.put_many(group)
+            except LearnQueueFull:
+                queued = 0
+            if queued < len(group):   # refused ("reject"/"block" timeout) or dropped: keep the rest
+                tmp = seg.with_name(f".{seg.name}.tmp")
+                with open(tmp, "w", encoding="utf-8") as f:
+                    f.writelines(lines[done:])
+                os.replace(tmp, seg)
+                return n
+            done += queued
+            n += queued
+        seg.unlink()
+    return n
+
+# ---- the per-worker service ----
+
+class SharedModelService:
+    """
+    Drop-in for AnomalyService (predict / predict_batch / stats / checkpointer)
+    that plays owner or non-owner as described above and can change role
+    while running.
+    """
+
+    def __init__(self, model_path: Path = MODEL_PATH, snapshot_path: Optional[Path] = None,
+                 threshold: str = THRESHOLD):
+        if threshold != "river":
+            raise ValueError("Multi-worker mode supports the 'river' threshold only.")
+        self.model_path = Path(model_path)
+        self.snapshot_path = Path(snapshot_path or self.model_path.with_suffix(model_format.SUFFIX))
+        if not model_format.wants_binary(self.snapshot_path):
+            raise ValueError(f"Snapshot path must end in {model_format.SUFFIX}.")
+        self.spool_dir = self.snapshot_path.with_name(self.snapshot_path.name + ".spool")
+        self.owner_lock = OwnerLock(self.snapshot_path.with_name(self.snapshot_path.name + ".owner"))
+        self.service: Optional[AnomalyService] = None
+        self.role = "starting"
+        self.reloads = 0
+        self.promotions = 0
+        self.replayed = 0
+        self.last_error: Optional[str] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._role_lock = threading.Lock()
+        self._serving = RWLock()      # read: requests inside self.service, write: _swap
+
+    # -- roles --
+    def _become_owner(self):
+        # the latest snapshot holds everything learned so far; the original
+        # model file only seeds the very first one
+        if self.snapshot_path.exists():
+            model = model_format.load(self.snapshot_path)
+        else:
+            model = load_model(self.model_path)
+        service = AnomalyService(model, self.snapshot_path, checkpoint_every_n=SNAPSHOT_EVERY_N,
+                                 checkpoint_every_s=SNAPSHOT_EVERY_S, window=self._window())
+        if not self.snapshot_path.exists():
+            model_format.save(model, self.snapshot_path)
+        self._swap(service.start(), "owner")
+
+    def _become_follower(self):
+        deadline = time.time() + SNAPSHOT_WAIT_S
+        while not self.snapshot_path.exists():
+            if time.time() > deadline:
+                raise RuntimeError(f"No model snapshot at {self.snapshot_path} after {SNAPSHOT_WAIT_S:.0f}s; "
+                                   "is an owner worker running?")
+            if self.owner_lock.try_acquire():   # the owner went away before publishing
+                return self._become_owner()
+            time.sleep(0.1)
+        service = AnomalyService(SnapshotModel(self.snapshot_path), self.snapshot_path,
+                                 learner=LearnSpool(self.spool_dir), window=self._window())
+        self._swap(service.start(), "follower")
+
+    def _window(self):
+        # per-machine history (window_features.py) survives a role change
+        return self.service.window if self.service is not None else None
+
+    def _swap(self, service: AnomalyService, role: str):
+        # waits out requests still inside the old service; later ones see the new one
+        with self._serving.write:
+            old, self.service, self.role = self.service, service, role
+        if old is not None:
+            old.stop()   # a follower flushes its last spool segment for the new owner to replay
+
+    def _reload(self):
+        svc = self.service
+        if svc is None or not isinstance(svc.model, SnapshotModel):
+            return
+        if _file_version(self.snapshot_path) == svc.model.version:
+            return
+        fresh = SnapshotModel(self.snapshot_path)
+        with svc.lock.write:
+            svc.model = fresh
+        self.reloads += 1
+
+    def _run(self):
+        last_retry = time.time()
+        while not self._stop.wait(SNAPSHOT_CHECK_S if self.role == "follower" else 0.2):
+            try:
+                with self._role_lock:
+                    if self.role == "owner":
+                        self.replayed += replay_spool(self.spool_dir, self.service)
+                        continue
+                    self._reload()
+                    if time.time() - last_retry >= OWNER_RETRY_S:
+                        last_retry = time.time()
+                        if self.owner_lock.try_acquire():
+                            self._become_owner()
+                            self.promotions += 1
+            except Exception as e:
+                self.last_error = str(e)
+
+    def start(self):
+        with self._role_lock:
+            if self.owner_lock.try_acquire():
+                self._become_owner()
+            else:
+                self._become_follower()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="shared-model", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=30)
+            self._thread = None
+        with self._role_lock:
+            if self.role == "owner":
+                self.replayed += replay_spool(self.spool_dir, self.service, max_segments=10 ** 9)
+            if self.service is not None:
+                self.service.stop()   # owner: drain and write the final snapshot
+            if self.role == "owner" and self.model_path != self.snapshot_path:
+                save_model(self.service.model, self.model_path)
+            self.owner_lock.release()
+            self.role = "stopped"
+
+    # -- AnomalyService API --
+    @property
+    def checkpointer(self):
+        return self.service.checkpointer
+
+    def predict(self, event: Dict[str, Any], learn: bool = False) -> Dict[str, Any]:
+        with self._serving.read:
+            return self.service.predict(event, learn=learn)
+
+    def predict_batch(self, events: List[Any], learn: bool = False) -> List[Dict[str, Any]]:
+        with self._serving.read:
+            return self.service.predict_batch(events, learn=learn)
+
+    def stats(self) -> Dict[str, Any]:
+        svc = self.service
+        model = svc.model if svc is not None else None
+        return {**(svc.stats() if svc is not None else {}),
+                "worker": {"pid": os.getpid(), "role": self.role, "owner_pid": self.owner_lock.holder(),
+                           "snapshot": str(self.snapshot_path),
+                           "snapshot_version": list(model.version) if isinstance(model, SnapshotModel) else None,
+                           "reloads_total": self.reloads, "promotions_total": self.promotions,
+                           "spool_replayed_total": self.replayed,
+                           "spool_segments_waiting": sum(1 for _ in self.spool_dir.glob("*.ndjson"))
+                           if self.spool_dir.exists() else 0,
+                           "last_error": self.last_error}}
@@ -1,83 +1,255 @@
 """
-Streaming anomaly detection with River's Half-Space Trees (online, unsupervised).
+Streaming anomaly detection with River's Half-Space Trees (online, unsupervised),
+replayed over a historical sensor CSV.
 - pip install -U river
+
+    python streaming_hst_template.py [--csv FILE] [--out stream_scores.csv] [--engine river|numpy]
+                                     [--partition-by machine_id] [--workers N] [--window]
+
+By default one model sees every row in file order, as a live stream would.
+With --partition-by, each machine gets its own model and threshold: rows
+are grouped by that column (file order kept within a machine), the
+partitions are scored across a process pool, and the results are merged
+back by timestamp. Output is written in blocks of --block-rows; progress
+and throughput go to stderr.
 """
 
+import argparse
 import csv
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
-from collections import deque
-from typing import Dict, Any
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
 import numpy as np
+import pandas as pd
 
 from river import anomaly, preprocessing
 
-# Windows-safe path; adjust if needed
-CSV_PATH = r"AIML\MachineSensorData_anomalies.csv"
+from quantiles import WindowedQuantile
+from features import NUMERIC_COLS
+from ingest import iter_blocks
+from window_features import WINDOW_FEATURES, WindowFeatures, event_time
+
+CSV_PATH = Path(__file__).with_name("MachineSensorData_anomalies.csv")
+OUT_PATH = Path("stream_scores.csv")
+# "river" scores row by row; "numpy" precomputes identical scores with the
+# vectorized Half-Space Trees in hst_numpy.py (much faster on long histories)
+ENGINE = "river"
 TIME_COL = "timestamp"
 ID_COL = "machine_id"
+# e.g. Path(".ingest_cache") to keep a parsed copy of the CSV so reruns skip parsing
+CACHE_DIR = None
+# score each reading together with its machine's rolling EWMA/mean/std/delta
+# (window_features.py), so spikes and slow drifts look different
+WINDOW = WINDOW_FEATURES
+Q = 0.995                    # 99.5th percentile threshold
+THRESHOLD_WINDOW = 1000      # recent scores the threshold is taken over
+THRESHOLD_MIN_COUNT = 100    # no anomalies until more scores than this were seen
+PARTITION_BY: Optional[str] = None  # e.g. "machine_id": one model per machine, run in parallel
+WORKERS = os.cpu_count() or 1       # processes for partitioned runs
+TASK_ROWS = 20_000           # small partitions are packed into tasks of at most about this many rows
+BLOCK_ROWS = 10_000          # output rows per write
+PROGRESS_EVERY_S = 1.0
+
+# ---- input ----
+
+def load_stream(csv_path, partition_by: Optional[str] = None,
+                cache_dir: Optional[Path] = None) -> Tuple[Dict[str, np.ndarray], np.ndarray]:
+    """(meta columns, X) of every row with at least one feature, in file order."""
+    meta = list(dict.fromkeys([TIME_COL, ID_COL] + ([partition_by] if partition_by else [])))
+    metas: Dict[str, List[np.ndarray]] = {c: [] for c in meta}
+    blocks = []
+    for m, X in iter_blocks(csv_path, NUMERIC_COLS, meta, cache_dir=cache_dir):
+        keep = ~np.isnan(X).all(axis=1)   # rows without any numeric feature are skipped
+        for c in meta:
+            metas[c].append(np.asarray(m[c])[keep])
+        blocks.append(X[keep])
+    if not blocks:
+        return {c: np.empty(0, dtype=object) for c in meta}, np.empty((0, len(NUMERIC_COLS)))
+    return {c: np.concatenate(v) for c, v in metas.items()}, np.concatenate(blocks)
 
-NUMERIC_COLS = [
-    "avg_fuel_consumption_rate",
-    "idle_fuel_consumption_pct",
-    "rpm_variance",
-    "coolant_temp_anomalies",
-    "productive_time_mins",
-    "idle_time_mins",
-    "vibration_anomalies",
-    "over_speed_events",
-    "tire_pressure_deviations",
-    "error_code_frequency",
-    "battery_low_voltage_events",
-]
-
-def main():
-    # Build components (no pipeline, no operator overloading)
-    mm = preprocessing.MinMaxScaler()
-    hst = anomaly.HalfSpaceTrees(n_trees=25, height=8, window_size=250, seed=42)
-
-    # Sanity checks
-    assert hasattr(mm, "transform_one") and hasattr(mm, "learn_one")
-    assert hasattr(hst, "score_one") and hasattr(hst, "learn_one")
-
-    buffer = deque(maxlen=1000)
-    q = 0.995  # 99.5th percentile threshold
-
-    out_path = Path("stream_scores.csv")
-    with open(CSV_PATH, "r", newline="", encoding="utf-8") as f_in, open(out_path, "w", newline="", encoding="utf-8") as f_out:
-        reader = csv.DictReader(f_in)
-        writer = csv.DictWriter(f_out, fieldnames=["timestamp", "machine_id", "score", "is_anomaly"])
-        writer.writeheader()
-
-        for row in reader:
-            # Build numeric feature dict
-            x: Dict[str, Any] = {}
-            for c in NUMERIC_COLS:
-                v = row.get(c)
-                if v is None or v == "":
-                    continue
-                try:    
-                    x[c] = float(v)
-                except Exception:
-                    pass
-            if not x:
-                continue
+# ---- scoring ----
 
+def score_stream(X: np.ndarray, ids: np.ndarray, ts: np.ndarray, engine: str = ENGINE,
+                 window: bool = WINDOW) -> Tuple[np.ndarray, np.ndarray]:
+    """One fresh model over the rows in order, score then learn; returns (scores, is_anomaly)."""
+    names: Sequence[str] = NUMERIC_COLS
+    if window:
+        wf = WindowFeatures(key=ID_COL)
+        X = wf.transform(ids, X, np.array([event_time(t) for t in ts.tolist()]))
+        names = wf.output_columns
+
+    if engine == "numpy":
+        from hst_numpy import NumpyHSTPipeline
+        np_model = NumpyHSTPipeline(names, n_trees=25, height=8, window_size=250, seed=42, q=None)
+        scores, _ = np_model.score_learn(X, learn_scaled="pre")
+    else:
+        # Build components (no pipeline, no operator overloading)
+        mm = preprocessing.MinMaxScaler()
+        hst = anomaly.HalfSpaceTrees(n_trees=25, height=8, window_size=250, seed=42)
+        scores = np.empty(len(X))
+        for i, row in enumerate(X.tolist()):
+            x = {c: v for c, v in zip(names, row) if v == v}   # v == v drops NaN
             # ---- SCORE then LEARN (no reassignments) ----
             xs = mm.transform_one(x)            # scale using current stats
-            score = hst.score_one(xs)           # higher = more anomalous
-            buffer.append(score)
-
+            scores[i] = hst.score_one(xs)       # higher = more anomalous
             mm.learn_one(x)                     # mutate in place; do NOT reassign
             hst.learn_one(xs)                   # mutate in place; do NOT reassign
 
-            thr = float(np.quantile(buffer, q)) if len(buffer) > 100 else float("inf")
-            is_anom = int(score >= thr)
+    # exact quantile of the last THRESHOLD_WINDOW scores, O(log w) per row instead of re-sorting
+    buffer = WindowedQuantile(Q, window=THRESHOLD_WINDOW, min_count=THRESHOLD_MIN_COUNT)
+    is_anom = np.zeros(len(scores), dtype=np.int64)
+    for i, score in enumerate(scores.tolist()):
+        buffer.update(score)
+        thr = buffer.get()
+        is_anom[i] = thr is not None and score >= thr
+    return scores, is_anom
+
+Part = Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]   # (row index, X, ids, timestamps)
+
+def _score_parts(parts: List[Part], engine: str, window: bool) -> List[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """Pool task: score each partition with its own model; (row index, scores, is_anomaly) per partition."""
+    out = []
+    for idx, X, ids, ts in parts:
+        scores, is_anom = score_stream(X, ids, ts, engine, window)
+        out.append((idx, scores, is_anom))
+    return out
+
+def partition(keys: np.ndarray) -> List[np.ndarray]:
+    """Row indices per distinct key, each in file order."""
+    _, inverse, counts = np.unique(keys.astype(str), return_inverse=True, return_counts=True)
+    order = np.argsort(inverse, kind="stable")
+    return np.split(order, np.cumsum(counts)[:-1])
+
+def pack(parts: List[np.ndarray], task_rows: int = TASK_ROWS) -> List[List[np.ndarray]]:
+    """Group partitions into pool tasks, biggest first so the long ones start early."""
+    tasks: List[List[np.ndarray]] = []
+    rows = task_rows
+    for p in sorted(parts, key=len, reverse=True):
+        if rows + len(p) > task_rows:
+            tasks.append([])
+            rows = 0
+        tasks[-1].append(p)
+        rows += len(p)
+    return tasks
+
+class Progress:
+    def __init__(self, total_rows: int, total_parts: int, every_s: float = PROGRESS_EVERY_S, enabled: bool = True):
+        self.total_rows, self.total_parts = total_rows, total_parts
+        self.rows = self.parts = 0
+        self.every_s, self.enabled = every_s, enabled
+        self.t0 = self._last = time.perf_counter()
+
+    def add(self, rows: int, parts: int):
+        self.rows += rows
+        self.parts += parts
+        now = time.perf_counter()
+        if self.enabled and (now - self._last >= self.every_s or self.parts == self.total_parts):
+            self._last = now
+            rate = self.rows / max(now - self.t0, 1e-9)
+            print(f"\r  {self.parts}/{self.total_parts} partitions | {self.rows:,}/{self.total_rows:,} rows "
+                  f"| {rate:,.0f} rows/s", end="", file=sys.stderr, flush=True)
+
+    def close(self):
+        if self.enabled:
+            print(file=sys.stderr)
+
+# ---- output ----
+
+def merge_order(ts: np.ndarray) -> np.ndarray:
+    """Row order by timestamp; ties and unparsable timestamps keep file order (the latter go last)."""
+    t = pd.to_datetime(pd.Series(ts), utc=True, errors="coerce")
+    key = t.to_numpy(dtype="datetime64[ns]").view(np.int64).copy()
+    key[t.isna().to_numpy()] = np.iinfo(np.int64).max
+    return np.argsort(key, kind="stable")
+
+def write_scores(out_path: Path, ts: np.ndarray, ids: np.ndarray, scores: np.ndarray, is_anom: np.ndarray,
+                 order: Optional[np.ndarray] = None, block_rows: int = BLOCK_ROWS) -> int:
+    order = np.arange(len(scores)) if order is None else order
+    with open(out_path, "w", newline="", encoding="utf-8") as f_out:
+        writer = csv.writer(f_out)
+        writer.writerow(["timestamp", "machine_id", "score", "is_anomaly"])
+        for start in range(0, len(order), block_rows):
+            sel = order[start:start + block_rows]
+            writer.writerows(zip(ts[sel].tolist(), ids[sel].tolist(), scores[sel].tolist(), is_anom[sel].tolist()))
+    return len(order)
+
+# ---- driver ----
+
+def run(csv_path=CSV_PATH, out_path: Path = OUT_PATH, engine: str = ENGINE,
+        partition_by: Optional[str] = PARTITION_BY, workers: int = WORKERS, window: bool = WINDOW,
+        cache_dir: Optional[Path] = CACHE_DIR, task_rows: int = TASK_ROWS, block_rows: int = BLOCK_ROWS,
+        progress: bool = True) -> Dict[str, Any]:
+    """Score the whole CSV and write `out_path`; returns row counts and per-stage seconds."""
+    t0 = time.perf_counter()
+    meta, X = load_stream(csv_path, partition_by, cache_dir)
+    ts, ids = meta[TIME_COL], meta[ID_COL]
+    t_load = time.perf_counter() - t0
+
+    t1 = time.perf_counter()
+    if not partition_by:
+        scores, is_anom = score_stream(X, ids, ts, engine, window)
+        order, n_parts, n_workers = None, 1, 1
+    else:
+        parts = partition(meta[partition_by])
+        # about four tasks per worker, so one slow task does not leave the others idle
+        tasks = pack(parts, min(task_rows, max(1, -(-len(X) // (4 * max(1, workers))))))
+        n_parts, n_workers = len(parts), max(1, min(workers, len(tasks)))
+        scores, is_anom = np.empty(len(X)), np.zeros(len(X), dtype=np.int64)
+        bar = Progress(len(X), n_parts, enabled=progress)
+
+        def collect(results):
+            for idx, s, a in results:
+                scores[idx], is_anom[idx] = s, a
+                bar.add(len(idx), 1)
+
+        payload = lambda task: [(idx, X[idx], ids[idx], ts[idx]) for idx in task]
+        if n_workers == 1:
+            for task in tasks:
+                collect(_score_parts(payload(task), engine, window))
+        else:
+            with ProcessPoolExecutor(max_workers=n_workers) as pool:
+                futures = [pool.submit(_score_parts, payload(task), engine, window) for task in tasks]
+                for fut in as_completed(futures):
+                    collect(fut.result())
+        bar.close()
+        order = merge_order(ts)
+    t_score = time.perf_counter() - t1
+
+    t2 = time.perf_counter()
+    rows = write_scores(Path(out_path), ts, ids, scores, is_anom, order, block_rows)
+    t_write = time.perf_counter() - t2
+    total = time.perf_counter() - t0
+    return {"rows": rows, "anomalies": int(is_anom.sum()), "partitions": n_parts, "workers": n_workers,
+            "load_s": t_load, "score_s": t_score, "write_s": t_write, "total_s": total,
+            "rows_per_s": rows / total if total > 0 else None}
 
-            t = row.get(TIME_COL, "") or ""
-            m = row.get(ID_COL, "") or ""
-            writer.writerow({"timestamp": t, "machine_id": m, "score": score, "is_anomaly": is_anom})
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--csv", default=str(CSV_PATH), help="sensor CSV to replay")
+    ap.add_argument("--out", default=str(OUT_PATH), help="scores CSV to write")
+    ap.add_argument("--engine", choices=["river", "numpy"], default=ENGINE)
+    ap.add_argument("--partition-by", default=PARTITION_BY,
+                    help="column to split on, one model per value (e.g. machine_id); default: one model")
+    ap.add_argument("--workers", type=int, default=WORKERS, help="processes for partitioned runs")
+    ap.add_argument("--window", action=argparse.BooleanOptionalAction, default=WINDOW,
+                    help="add per-machine rolling features (--no-window to turn them off)")
+    ap.add_argument("--cache-dir", type=Path, default=CACHE_DIR, help="parsed-CSV cache (see ingest.py)")
+    ap.add_argument("--task-rows", type=int, default=TASK_ROWS, help="rows per pool task when packing partitions")
+    ap.add_argument("--block-rows", type=int, default=BLOCK_ROWS, help="output rows per write")
+    ap.add_argument("--quiet", action="store_true", help="no progress line")
+    args = ap.parse_args(argv)
 
-    print(f"Wrote streaming scores to {out_path.resolve()}")
+    res = run(args.csv, Path(args.out), engine=args.engine, partition_by=args.partition_by, workers=args.workers,
+              window=args.window, cache_dir=args.cache_dir, task_rows=args.task_rows, block_rows=args.block_rows,
+              progress=not args.quiet)
+    print(f"Wrote streaming scores to {Path(args.out).resolve()}")
+    print(f"  {res['rows']:,} rows, {res['anomalies']:,} anomalies, {res['partitions']} partition(s) "
+          f"on {res['workers']} worker(s) | load {res['load_s']:.2f}s, score {res['score_s']:.2f}s, "
+          f"write {res['write_s']:.2f}s | {res['rows_per_s']:,.0f} rows/s")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,11 @@
+# conftest.py
+"""The AIML modules are flat scripts; put their directory on sys.path for the tests."""
+import sys
+from pathlib import Path
+
+AIML_DIR = Path(__file__).resolve().parent.parent
+if str(AIML_DIR) not in sys.path:
+    sys.path.insert(0, str(AIML_DIR))
+
+SENSOR_CSV = AIML_DIR / "MachineSensorData_anomalies.csv"
+COMPANY_CSV = AIML_DIR / "company_cluster_features.csv"
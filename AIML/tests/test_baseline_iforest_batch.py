@@ -0,0 +1,96 @@
+# test_baseline_iforest_batch.py
+"""Rolling (incremental) mode of the IsolationForest batch baseline."""
+import joblib
+import pandas as pd
+import pytest
+
+import baseline_iforest_batch as bif
+from conftest import SENSOR_CSV
+
+@pytest.fixture
+def sensor():
+    return pd.read_csv(SENSOR_CSV).sort_values(bif.TIME_COL, kind="stable").reset_index(drop=True)
+
+def _run(tmp_path, **kwargs):
+    bif.rolling(tmp_path / "in.csv", tmp_path / "state.joblib", tmp_path / "out.csv",
+                chunk_rows=10_000, workers=1, **kwargs)
+
+def _append(tmp_path, rows: pd.DataFrame):
+    with open(tmp_path / "in.csv", "a", newline="") as f:
+        rows.to_csv(f, header=False, index=False)
+
+def _scored(tmp_path) -> pd.DataFrame:
+    return pd.read_csv(tmp_path / "out.csv")
+
+def test_first_run_is_a_batch_run(tmp_path, sensor):
+    sensor.iloc[:1000].to_csv(tmp_path / "in.csv", index=False)
+    _run(tmp_path)
+    state = joblib.load(tmp_path / "state.joblib")
+    assert len(_scored(tmp_path)) == 1000 - int(bif.TRAIN_FRACTION * 1000)
+    assert state["watermark"] == pd.to_datetime(sensor[bif.TIME_COL].iloc[:1000]).max()
+    assert len(state["clf"].estimators_) == bif.N_TREES
+
+def test_appended_rows_are_scored_once(tmp_path, sensor):
+    sensor.iloc[:1000].to_csv(tmp_path / "in.csv", index=False)
+    _run(tmp_path)
+    n0 = len(_scored(tmp_path))
+
+    _append(tmp_path, sensor.iloc[1000:1200])
+    _run(tmp_path)
+    out = _scored(tmp_path)
+    assert len(out) == n0 + 200
+    assert set(out["reading_id"].iloc[n0:]) == set(sensor["reading_id"].iloc[1000:1200])
+
+    _run(tmp_path)   # nothing new
+    assert len(_scored(tmp_path)) == n0 + 200
+
+def test_appended_row_at_the_watermark_is_scored(tmp_path, sensor):
+    sensor.iloc[:1000].to_csv(tmp_path / "in.csv", index=False)
+    _run(tmp_path)
+    n0 = len(_scored(tmp_path))
+    late = sensor.iloc[[999]].assign(reading_id="late-1")   # same timestamp as the watermark
+    _append(tmp_path, late)
+    _run(tmp_path)
+    out = _scored(tmp_path)
+    assert len(out) == n0 + 1
+    assert out["reading_id"].iloc[-1] == "late-1"
+
+def test_rewritten_input_is_filtered_by_watermark(tmp_path, sensor):
+    sensor.iloc[:1000].to_csv(tmp_path / "in.csv", index=False)
+    _run(tmp_path)
+    n0 = len(_scored(tmp_path))
+    watermark = joblib.load(tmp_path / "state.joblib")["watermark"]
+    sensor.iloc[1199::-1].to_csv(tmp_path / "in.csv", index=False)   # rewritten (reordered), not appended to
+    _run(tmp_path)
+    newer = (pd.to_datetime(sensor[bif.TIME_COL].iloc[:1200]) > watermark).sum()
+    assert len(_scored(tmp_path)) == n0 + newer
+
+def test_refresh_replaces_the_oldest_trees(tmp_path, sensor):
+    sensor.iloc[:1000].to_csv(tmp_path / "in.csv", index=False)
+    _run(tmp_path)
+    before = joblib.load(tmp_path / "state.joblib")["clf"]
+    _append(tmp_path, sensor.iloc[1000:1100])
+    _run(tmp_path, refresh_fraction=0.1)
+    after = joblib.load(tmp_path / "state.joblib")["clf"]
+    n_new = int(round(0.1 * bif.N_TREES))
+    kept = [t.tree_.threshold.tolist() for t in after.estimators_[:-n_new]]
+    assert kept == [t.tree_.threshold.tolist() for t in before.estimators_[n_new:]]
+    assert len(after.estimators_) == bif.N_TREES
+    assert not after.warm_start
+
+def test_half_written_last_row_waits_for_the_next_run(tmp_path, sensor):
+    sensor.iloc[:1000].to_csv(tmp_path / "in.csv", index=False)
+    _run(tmp_path)
+    n0 = len(_scored(tmp_path))
+    tail = sensor.iloc[1000:1450].to_csv(header=False, index=False)
+    cut = tail.rindex("\n", 0, len(tail) - 1) + 12   # mid-way through the 450th row
+    with open(tmp_path / "in.csv", "a", newline="") as f:
+        f.write(tail[:cut])
+    _run(tmp_path)
+    assert len(_scored(tmp_path)) == n0 + 449
+    with open(tmp_path / "in.csv", "a", newline="") as f:
+        f.write(tail[cut:])
+    _run(tmp_path)
+    out = _scored(tmp_path)
+    assert len(out) == n0 + 450
+    assert not out["reading_id"].duplicated().any()
@@ -0,0 +1,87 @@
+# test_checkpoint.py
+"""Background checkpoints: every N events or T seconds, written atomically, flushed on stop."""
+import itertools
+import time
+
+import pytest
+
+import fileutil
+import model_format
+from checkpoint import Checkpointer
+from conftest import SENSOR_CSV
+from features import NUMERIC_COLS
+from inference import load_model, save_model
+from ingest import iter_feature_dicts
+from train_save_river import build_model
+
+@pytest.fixture(scope="module")
+def rows():
+    return [x for _, x in itertools.islice(iter_feature_dicts(SENSOR_CSV, NUMERIC_COLS), 300)]
+
+@pytest.fixture
+def model(rows):
+    m = build_model()
+    for x in rows[:260]:
+        m.learn_one(x)
+    return m
+
+def _wait(cond, timeout=5.0):
+    deadline = time.time() + timeout
+    while not cond():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.01)
+
+def _same(path, model) -> bool:
+    return model_format.dumps(load_model(path)) == model_format.dumps(model)
+
+def test_snapshot_after_every_n_events(tmp_path, model, rows):
+    path = tmp_path / "model.pkl"
+    cp = Checkpointer(model, path, every_n=5, every_s=3600).start()
+    try:
+        cp.note_learn(4)
+        time.sleep(0.2)
+        assert not path.exists() and cp.pending == 4
+        model.learn_one(rows[260])
+        cp.note_learn(1)
+        _wait(lambda: cp.checkpoints == 1)
+        assert cp.pending == 0 and _same(path, model)
+    finally:
+        cp.stop()
+
+def test_snapshot_after_every_s_seconds(tmp_path, model):
+    path = tmp_path / "model.pkl"
+    cp = Checkpointer(model, path, every_n=10 ** 6, every_s=0.1).start()
+    try:
+        cp.note_learn(1)
+        _wait(lambda: cp.checkpoints == 1)
+        assert _same(path, model) and cp.stats()["staleness_s"] == 0.0
+    finally:
+        cp.stop()
+
+def test_stop_flushes_what_is_pending(tmp_path, model, rows):
+    path = tmp_path / "model.pkl"
+    cp = Checkpointer(model, path, every_n=10 ** 6, every_s=3600).start()
+    model.learn_one(rows[260])
+    cp.note_learn(1)
+    cp.stop()
+    assert cp.checkpoints == 1 and _same(path, model)
+    assert not cp.flush()                   # nothing new since
+
+def test_failed_write_keeps_the_previous_file(tmp_path, model, rows, monkeypatch):
+    path = tmp_path / "model.pkl"
+    save_model(model, path)
+    before = path.read_bytes()
+    model.learn_one(rows[260])
+    cp = Checkpointer(model, path, every_n=10 ** 6, every_s=3600)
+    cp.note_learn(1)
+
+    def full_disk(fd):
+        raise OSError("No space left on device")
+
+    monkeypatch.setattr(fileutil.os, "fsync", full_disk)
+    assert not cp.flush()
+    assert path.read_bytes() == before
+    assert [p.name for p in tmp_path.iterdir()] == ["model.pkl"]   # temp file cleaned up
+    assert cp.pending == 1 and cp.failures == 1 and "No space" in cp.last_error
+    monkeypatch.undo()
+    assert cp.flush() and _same(path, model) and cp.last_error is None
@@ -0,0 +1,208 @@
+# test_concurrency.py
+"""LearnQueue back-pressure policies, the RWLock and the MicroBatcher."""
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from concurrency import LearnQueue, LearnQueueFull, MicroBatcher, RWLock
+
+def _held_queue(policy: str, maxsize: int = 4, block_timeout: float = 0.1):
+    """A started queue whose writer is stuck in apply() until the returned event is set."""
+    applied, gate, busy = [], threading.Event(), threading.Event()
+
+    def apply(batch):
+        busy.set()
+        gate.wait(5)
+        applied.extend(batch)
+
+    q = LearnQueue(apply, maxsize=maxsize, policy=policy, block_timeout=block_timeout, max_batch=1).start()
+    q.put("first")
+    assert busy.wait(5)   # the writer holds "first"; the queue itself is empty again
+    return q, applied, gate
+
+def test_items_are_applied_in_order_in_batches():
+    batches = []
+    q = LearnQueue(batches.append, maxsize=100, max_batch=3)
+    assert q.put_many(list(range(7))) == 7
+    q.start()
+    assert q.wait_idle()
+    q.stop()
+    assert [x for b in batches for x in b] == list(range(7))
+    assert max(len(b) for b in batches) <= 3
+    assert q.stats()["learned_total"] == 7
+
+def test_reject_refuses_the_whole_group():
+    q, applied, gate = _held_queue("reject")
+    q.put_many([1, 2, 3])
+    with pytest.raises(LearnQueueFull):
+        q.put_many([4, 5])
+    with pytest.raises(LearnQueueFull):
+        q.check_room(2)
+    q.check_room(1)
+    assert q.depth() == 3
+    assert q.stats()["rejected_total"] == 4
+    gate.set()
+    assert q.wait_idle()
+    q.stop()
+    assert applied == ["first", 1, 2, 3]
+
+def test_drop_discards_the_whole_group():
+    q, applied, gate = _held_queue("drop")
+    q.put_many([1, 2, 3])
+    assert q.put_many([4, 5]) == 0
+    assert q.put(6) is True
+    assert q.put(7) is False
+    gate.set()
+    assert q.wait_idle()
+    q.stop()
+    assert applied == ["first", 1, 2, 3, 6]
+    assert q.stats()["dropped_total"] == 3
+
+def test_block_times_out_without_queueing_part_of_the_group():
+    q, applied, gate = _held_queue("block", block_timeout=0.05)
+    q.put_many([1, 2, 3])
+    t0 = time.monotonic()
+    with pytest.raises(LearnQueueFull):
+        q.put_many([4, 5])
+    assert time.monotonic() - t0 >= 0.04
+    assert q.depth() == 3
+    gate.set()
+    assert q.wait_idle()
+    q.stop()
+    assert applied == ["first", 1, 2, 3]
+
+def test_block_waits_for_room_for_the_whole_group():
+    q, applied, gate = _held_queue("block", block_timeout=5.0)
+    q.put_many([1, 2, 3])
+    threading.Timer(0.05, gate.set).start()
+    assert q.put_many([4, 5]) == 2
+    assert q.wait_idle()
+    q.stop()
+    assert applied == ["first", 1, 2, 3, 4, 5]
+
+def test_group_larger_than_the_queue_never_fits():
+    q = LearnQueue(lambda batch: None, maxsize=2, policy="block", block_timeout=5.0)
+    t0 = time.monotonic()
+    with pytest.raises(LearnQueueFull):
+        q.put_many([1, 2, 3])
+    assert time.monotonic() - t0 < 1.0
+    assert q.depth() == 0
+
+def test_stop_applies_what_is_queued():
+    applied = []
+    q = LearnQueue(applied.extend, maxsize=10)
+    q.put_many([1, 2])
+    q.start()
+    q.stop()
+    assert applied == [1, 2]
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        LearnQueue(lambda batch: None, policy="spill")
+
+def test_rwlock_readers_share():
+    lock = RWLock()
+    inside = threading.Barrier(3, timeout=5)
+
+    def reader():
+        with lock.read:
+            inside.wait()   # all three must be inside at once
+
+    threads = [threading.Thread(target=reader) for _ in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(5)
+    assert not inside.broken
+
+def test_rwlock_writer_excludes_readers():
+    lock = RWLock()
+    events = []
+    lock.acquire_write()
+
+    def reader():
+        with lock.read:
+            events.append("read")
+
+    t = threading.Thread(target=reader)
+    t.start()
+    time.sleep(0.05)
+    events.append("write done")
+    lock.release_write()
+    t.join(5)
+    assert events == ["write done", "read"]
+
+def test_rwlock_waiting_writer_blocks_new_readers():
+    lock = RWLock()
+    events = []
+    lock.acquire_read()
+
+    def writer():
+        with lock.write:
+            events.append("write")
+
+    def late_reader():
+        with lock.read:
+            events.append("late read")
+
+    w = threading.Thread(target=writer)
+    w.start()
+    time.sleep(0.05)   # writer is now waiting on our read lock
+    r = threading.Thread(target=late_reader)
+    r.start()
+    time.sleep(0.05)
+    assert events == []
+    lock.release_read()
+    w.join(5)
+    r.join(5)
+    assert events == ["write", "late read"]
+
+def _batched(fn, items, **kwargs):
+    """Submit every item concurrently; returns (results or exceptions, batcher stats, batch sizes)."""
+    sizes = []
+
+    def call(batch):
+        sizes.append(len(batch))
+        return fn(batch)
+
+    async def main():
+        with ThreadPoolExecutor(2) as pool:
+            mb = MicroBatcher(call, pool, **kwargs).start()
+            out = await asyncio.gather(*(mb.submit(x) for x in items), return_exceptions=True)
+            await mb.stop()
+            return out, mb.stats()
+
+    out, stats = asyncio.run(main())
+    return out, stats, sizes
+
+def test_micro_batches_keep_request_order():
+    out, stats, sizes = _batched(lambda xs: [x * 2 for x in xs], list(range(50)), max_batch=8, max_wait_s=0.05)
+    assert out == [x * 2 for x in range(50)]
+    assert sum(sizes) == 50 and max(sizes) <= 8 and len(sizes) < 50
+    assert stats["submitted_total"] == 50 and stats["batches_total"] == len(sizes)
+
+def test_a_failing_batch_fails_each_of_its_requests():
+    def fn(xs):
+        if any(x < 0 for x in xs):
+            raise ValueError("negative")
+        return xs
+
+    out, stats, sizes = _batched(fn, [1, -1, 2], max_batch=3, max_wait_s=0.5)
+    assert sizes == [3]
+    assert all(isinstance(r, ValueError) and str(r) == "negative" for r in out)
+    assert stats["failed_batches_total"] == 1 and stats["batches_total"] == 0
+
+    out, _, sizes = _batched(fn, [1, -1, 2, 3], max_batch=2, max_wait_s=0.5)
+    assert isinstance(out[0], ValueError) and isinstance(out[1], ValueError)
+    assert out[2:] == [2, 3]                    # the other batch is unaffected
+
+def test_submit_needs_a_started_batcher():
+    async def main():
+        with ThreadPoolExecutor(1) as pool:
+            await MicroBatcher(lambda xs: xs, pool).submit(1)
+
+    with pytest.raises(RuntimeError, match="not started"):
+        asyncio.run(main())
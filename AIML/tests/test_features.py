@@ -0,0 +1,60 @@
+# test_features.py
+"""The generated FeatureSchema converters against the plain per-field rules."""
+import itertools
+import random
+
+import numpy as np
+import pytest
+
+from features import NUMERIC_COLS, SCHEMA, FeatureSchema, _slow_to_x
+
+COLS = ["a", "b", "c"]
+# typed JSON, CSV strings, and everything the slow path has to handle
+VALUES = [1, 2.5, -0.0, True, "3.25", " 4 ", "1e3", None, "", "abc", [1], {"x": 1}, "MISSING"]
+
+def _event(vals):
+    return {c: v for c, v in zip(COLS, vals) if v != "MISSING"}
+
+def _slow_array(event, columns):
+    x = _slow_to_x(event, columns)
+    return np.array([x.get(c, np.nan) for c in columns])
+
+@pytest.fixture(scope="module")
+def events():
+    return [_event(vals) for vals in itertools.product(VALUES, repeat=len(COLS))]
+
+def test_to_x_matches_the_slow_path(events):
+    schema = FeatureSchema(COLS)
+    for e in events:
+        assert schema.to_x(e) == _slow_to_x(e, COLS), e
+
+def test_to_array_and_to_matrix_match_the_slow_path(events):
+    schema = FeatureSchema(COLS)
+    want = np.array([_slow_array(e, COLS) for e in events])
+    got = np.array([schema.to_array(e) for e in events])
+    np.testing.assert_array_equal(got, want)
+    np.testing.assert_array_equal(schema.to_matrix(events), want)
+    numeric = [e for e in events if len(_slow_to_x(e, COLS)) == len(COLS)]
+    np.testing.assert_array_equal(schema.to_matrix(numeric), np.array([_slow_array(e, COLS) for e in numeric]))
+
+def test_to_array_fills_the_given_buffer():
+    schema = FeatureSchema(COLS)
+    out = np.zeros(3)
+    assert schema.to_array({"a": "1", "b": None, "c": "x"}, out=out) is out
+    np.testing.assert_array_equal(out, [1.0, np.nan, np.nan])
+    assert schema.from_array(out) == {"a": 1.0}
+
+def test_sensor_events_round_trip():
+    rng = random.Random(0)
+    for _ in range(200):
+        e = {c: rng.choice([rng.uniform(0, 100), str(rng.randint(0, 9)), None]) for c in NUMERIC_COLS}
+        x = SCHEMA.to_x(e)
+        assert x == _slow_to_x(e, NUMERIC_COLS)
+        assert SCHEMA.from_array(SCHEMA.to_array(e)) == x
+
+def test_one_column_and_duplicate_columns():
+    one = FeatureSchema(["a"])
+    assert one.to_x({"a": "2"}) == {"a": 2.0} and one.to_x({"a": "?"}) == {}
+    np.testing.assert_array_equal(one.to_matrix([{"a": 1}, {}]), [[1.0], [np.nan]])
+    with pytest.raises(ValueError):
+        FeatureSchema(["a", "a"])
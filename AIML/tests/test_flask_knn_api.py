@@ -0,0 +1,89 @@
+# test_flask_knn_api.py
+"""Recommendations from flask_knn_api.py against a direct pandas computation."""
+import importlib
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import COMPANY_CSV
+from knn_artifact import artifact_from_frame
+from train_knn_save import FEATURE_COLS, ID_COL
+
+ASSETS = ["avg_cranes", "avg_bulldozers", "avg_excavators", "avg_loaders"]
+
+@pytest.fixture(scope="module")
+def companies():
+    return pd.read_csv(COMPANY_CSV)
+
+@pytest.fixture(scope="module")
+def api(tmp_path_factory, companies):
+    path = artifact_from_frame(tmp_path_factory.mktemp("knn") / "art", companies, FEATURE_COLS, ID_COL)
+    os.environ["KNN_ARTIFACT_DIR"] = str(path)
+    try:
+        import flask_knn_api
+        return importlib.reload(flask_knn_api)
+    finally:
+        del os.environ["KNN_ARTIFACT_DIR"]
+
+def _reference(companies, company_id, asset, current, k):
+    X = companies[FEATURE_COLS].to_numpy(dtype=float)
+    Xs = (X - X.mean(axis=0)) / X.std(axis=0)
+    row = int(np.flatnonzero(companies[ID_COL].astype(str) == str(company_id))[0])
+    d = np.sqrt(((Xs - Xs[row]) ** 2).sum(axis=1))
+    d[row] = np.inf
+    mean = companies[asset].iloc[np.argsort(d, kind="stable")[:k]].mean()
+    diff = mean - current
+    return max(int(np.floor(diff + 0.5)), 0) if diff > 0 else 0
+
+def test_company_ids_are_looked_up_by_hash(api, companies):
+    art = api.watcher.get()
+    for row, cid in enumerate(companies[ID_COL]):
+        assert art.index_of(cid) == row and art.index_of(str(cid)) == row
+    assert art.index_of("no-such-company") is None
+    row = art.index_of(companies[ID_COL].iloc[3])
+    raw = companies[FEATURE_COLS].to_numpy(dtype=float)[3:4]
+    np.testing.assert_allclose(art.vector(row), art.transform(raw))   # cached standardized vector
+
+@pytest.mark.parametrize("k", [1, 5, 20, 22])   # 22 > K_max: a live kneighbors query
+def test_recommend_matches_a_direct_computation(api, companies, k):
+    api.recommend_cache.invalidate()
+    for cid in companies[ID_COL].iloc[::5]:
+        for asset in ASSETS:
+            assert api.recommend(cid, asset, 0.5, k=k) == _reference(companies, cid, asset, 0.5, k)
+
+def test_unknown_company_is_an_error(api):
+    with pytest.raises(ValueError, match="not found"):
+        api.recommend("no-such-company", "cranes", 0, k=5)
+    resp = api.app.test_client().post("/recommend", json={"company_id": "no-such-company", "asset": "cranes",
+                                                         "current_rented": 0})
+    assert resp.status_code == 400 and "not found" in resp.get_json()["error"]
+
+def test_batch_matches_single_calls(api, companies):
+    items = [{"company_id": cid, "asset": asset, "current_rented": cur, "k": k}
+             for cid in companies[ID_COL].iloc[::3]
+             for asset in ["cranes", "avg_loaders", "excavator"]
+             for cur, k in [(0, 3), (1.5, 20), (0.2, 22)]]
+    got = api.recommend_batch(items)
+    assert len(got) == len(items)
+    for item, res in zip(items, got):
+        assert res == {"recommendation": api.recommend(item["company_id"], item["asset"], item["current_rented"],
+                                                       k=item["k"])}
+
+def test_batch_reports_errors_per_item_in_order(api, companies):
+    cid = int(companies[ID_COL].iloc[0])
+    items = [{"company_id": cid, "asset": "cranes", "current_rented": 0},
+             {"company_id": "no-such-company", "asset": "cranes", "current_rented": 0},
+             {"company_id": cid, "asset": "spaceships", "current_rented": 0},
+             {"company_id": cid, "current_rented": 0},
+             "not an object",
+             {"company_id": cid, "asset": "cranes", "current_rented": 0, "k": -1}]
+    got = api.recommend_batch(items)
+    assert got[0] == {"recommendation": api.recommend(cid, "cranes", 0)}
+    assert "not found" in got[1]["error"] and "spaceships" in got[2]["error"]
+    assert "Missing required field" in got[3]["error"] and "JSON object" in got[4]["error"]
+    assert "k must be" in got[5]["error"]
+    client = api.app.test_client()
+    assert client.post("/recommend_batch", json={"requests": items}).get_json() == got
+    assert client.post("/recommend_batch", json={"oops": 1}).status_code == 400
@@ -0,0 +1,20 @@
+# test_hst_numpy.py
+"""NumpyHSTPipeline against the River pipeline it mirrors."""
+import numpy as np
+
+from conftest import SENSOR_CSV
+from hst_numpy import NumpyHSTPipeline, load_matrix, parity_check
+from train_save_river import build_model
+
+def test_scores_match_river_on_bundled_csv():
+    res = parity_check(SENSOR_CSV)
+    assert res["rows"] > 1000
+    assert res["max_abs_score_diff"] < 1e-9
+    assert res["is_anomaly_mismatches"] == 0
+
+def test_to_river_round_trip_scores_the_same():
+    X = load_matrix(SENSOR_CSV)[:600]
+    m = NumpyHSTPipeline.from_river(build_model(q=0.995))
+    m.score_learn(X[:500])
+    back = NumpyHSTPipeline.from_river(m.to_river())
+    np.testing.assert_array_equal(back.score(X[500:]), m.score(X[500:]))
@@ -0,0 +1,98 @@
+# test_knn_artifact.py
+"""The memory-mapped KNN artifact, explicit legacy conversion, and duplicate-column handling."""
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.neighbors import NearestNeighbors
+from sklearn.preprocessing import StandardScaler
+
+import knn_artifact
+from conftest import COMPANY_CSV
+from knn_artifact import ArtifactWatcher, KNNArtifact, artifact_from_frame, convert_legacy, load_artifact
+from train_knn_save import FEATURE_COLS, ID_COL
+
+@pytest.fixture(scope="module")
+def companies():
+    df = pd.read_csv(COMPANY_CSV).dropna(subset=FEATURE_COLS).reset_index(drop=True)
+    # same selection as train_knn_save.py: avg_util is both a feature and an "avg_" asset column
+    cols = [ID_COL, *FEATURE_COLS, "industry", "state"] + [c for c in df.columns if c.startswith("avg_")]
+    return df[cols]
+
+def _X(df) -> np.ndarray:
+    return df.loc[:, ~df.columns.duplicated()][FEATURE_COLS].to_numpy(dtype=float)
+
+@pytest.fixture(scope="module")
+def scaler(companies):
+    return StandardScaler().fit(_X(companies))
+
+def test_arrays_are_memory_mapped_and_round_trip(tmp_path, companies, scaler):
+    art = KNNArtifact(artifact_from_frame(tmp_path / "art", companies, FEATURE_COLS, ID_COL, scaler=scaler,
+                                          k_max=5))
+    assert isinstance(art.Xs, np.memmap) and isinstance(art.nbr_means, np.memmap)
+    assert not art.Xs.flags.writeable
+    assert len(art) == len(companies) and art.k_max == 5
+    np.testing.assert_allclose(art.Xs, scaler.transform(_X(companies)))
+    np.testing.assert_allclose(art.transform(_X(companies)), art.Xs)
+    row = art.index_of(companies[ID_COL].iloc[7])
+    assert row == 7 and art.extra["industry"][row] == companies["industry"].iloc[7]
+    assert KNNArtifact(tmp_path / "art", mmap=False).version == art.version
+
+def test_duplicate_avg_util_is_kept_once(tmp_path, companies, scaler):
+    assert list(companies.columns).count("avg_util") == 2
+    art = KNNArtifact(artifact_from_frame(tmp_path / "art", companies, FEATURE_COLS, ID_COL, scaler=scaler))
+    assert art.asset_cols.count("avg_util") == 1
+    assert len(art.asset_cols) == len(set(art.asset_cols))
+    np.testing.assert_array_equal(art.assets[:, art.asset_index["avg_util"]], companies["avg_util"].iloc[:, 0])
+
+def test_neighbour_table_matches_brute_force(tmp_path, companies, scaler):
+    art = KNNArtifact(artifact_from_frame(tmp_path / "art", companies, FEATURE_COLS, ID_COL, scaler=scaler,
+                                          k_max=8))
+    Xs = np.asarray(art.Xs)
+    for row in range(len(art)):
+        d = np.sqrt(((Xs - Xs[row]) ** 2).sum(axis=1))
+        d[row] = np.inf
+        order = np.argsort(d, kind="stable")[:8]
+        np.testing.assert_array_equal(art.nbr_idx[row], order)
+        np.testing.assert_allclose(art.nbr_dist[row], d[order])
+        for k in (1, 4, 8):
+            np.testing.assert_allclose(art.nbr_means[row, k - 1], np.asarray(art.assets)[order[:k]].mean(axis=0))
+    assert art.covers(8) and not art.covers(9) and not art.covers(0)
+
+def test_watcher_swaps_in_a_republished_version(tmp_path, companies, scaler):
+    path = artifact_from_frame(tmp_path / "art", companies, FEATURE_COLS, ID_COL, scaler=scaler)
+    watcher = ArtifactWatcher(KNNArtifact(path), check_every_s=0.0)
+    old = watcher.get()
+    assert not watcher.reload()                         # nothing new
+    artifact_from_frame(path, companies.iloc[:-1], FEATURE_COLS, ID_COL, scaler=scaler)
+    new = watcher.get()
+    assert new is not old and new.version != old.version and len(new) == len(old) - 1
+    assert watcher.reloads == 1
+    assert old.index_of(companies[ID_COL].iloc[-1]) is not None   # in-flight holders keep their version
+    (path / "meta.json").write_text("{broken")
+    assert not watcher.reload()
+    assert watcher.get() is new and watcher.last_error
+
+def _legacy(tmp_path, companies, scaler):
+    path = tmp_path / "knn_recommender.joblib"
+    nn = NearestNeighbors().fit(scaler.transform(_X(companies)))
+    joblib.dump({"scaler": scaler, "nn": nn, "feature_cols": FEATURE_COLS, "id_col": ID_COL, "df": companies}, path)
+    return path
+
+def test_loading_never_converts(tmp_path, companies, scaler):
+    path = _legacy(tmp_path, companies, scaler)
+    for target in (path, tmp_path / "knn_recommender"):
+        with pytest.raises(FileNotFoundError, match="convert"):
+            load_artifact(target)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["knn_recommender.joblib"]
+
+def test_legacy_conversion_is_explicit_and_done_once(tmp_path, companies, scaler):
+    path = _legacy(tmp_path, companies, scaler)
+    art = convert_legacy(path, tmp_path / "converted")
+    assert art.path == tmp_path / "converted" and len(art) == len(companies)
+    np.testing.assert_allclose(art.mean, scaler.mean_)
+    assert art.asset_cols.count("avg_util") == 1 and art.k_max == knn_artifact.K_MAX
+    assert convert_legacy(path, tmp_path / "converted").version == art.version   # up to date: not redone
+    assert load_artifact(tmp_path / "converted").version == art.version
+    with pytest.raises(FileNotFoundError):
+        convert_legacy(tmp_path / "missing.joblib")
@@ -0,0 +1,60 @@
+# test_knn_index.py
+"""Every neighbour index against an exact brute-force search."""
+import numpy as np
+import pytest
+
+from knn_index import INDEX_KINDS, available_indexes, build_from_spec, build_index, hnswlib, index_spec
+
+@pytest.fixture(scope="module")
+def data():
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(2000, 4))
+    Q = np.vstack([X[:50], rng.normal(size=(50, 4))])   # rows of the index and fresh points
+    return X, Q
+
+def _exact(X, Q, k):
+    d = np.sqrt(((Q[:, None, :] - X[None, :, :]) ** 2).sum(axis=2))
+    idx = np.argsort(d, axis=1, kind="stable")[:, :k]
+    return np.take_along_axis(d, idx, axis=1), idx
+
+@pytest.mark.parametrize("kind", ["brute", "kd_tree", "ball_tree"])
+def test_exact_indexes_match_brute_force(data, kind):
+    X, Q = data
+    want_d, want_i = _exact(X, Q, 10)
+    d, i = build_index(kind, X).kneighbors(Q, 10)
+    np.testing.assert_array_equal(i, want_i)
+    np.testing.assert_allclose(d, want_d, atol=1e-6)   # the BLAS expansion loses a little near 0
+    np.testing.assert_array_equal(build_index(kind, X).kneighbors(Q[:1], 10, return_distance=False), want_i[:1])
+
+@pytest.mark.parametrize("kind, params", [
+    ("rp_forest", {"n_trees": 10, "leaf_size": 64, "seed": 42}),
+    pytest.param("hnsw", {"M": 16, "ef_construction": 200, "ef": 64},
+                 marks=pytest.mark.skipif(hnswlib is None, reason="hnswlib not installed")),
+])
+def test_approximate_indexes_have_high_recall(data, kind, params):
+    X, Q = data
+    want_d, want_i = _exact(X, Q, 10)
+    d, i = build_from_spec(index_spec(kind, **params), X).kneighbors(Q, 10)
+    recall = np.mean([len(set(a) & set(b)) / 10 for a, b in zip(i, want_i)])
+    assert recall >= 0.9
+    assert (np.diff(d, axis=1) >= 0).all()                     # sorted by distance
+    np.testing.assert_allclose(d, np.sqrt(((Q[:, None, :] - X[i]) ** 2).sum(axis=2)), atol=1e-4)
+    assert (i[:50, 0] == np.arange(50)).all()                  # an indexed row finds itself first
+
+def test_rp_forest_falls_back_to_exact_for_large_k(data):
+    X, Q = data
+    index = build_index("rp_forest", X, n_trees=1, leaf_size=8)
+    np.testing.assert_array_equal(index.kneighbors(Q[:5], 200)[1], _exact(X, Q[:5], 200)[1])
+
+@pytest.mark.parametrize("kind", INDEX_KINDS)
+def test_k_out_of_range_is_refused(data, kind):
+    if kind not in available_indexes():
+        pytest.skip(f"{kind} not available")
+    X, Q = data
+    small = build_index(kind, X[:20])
+    with pytest.raises(ValueError):
+        small.kneighbors(Q[:1], 21)
+
+def test_unknown_kind_is_refused():
+    with pytest.raises(ValueError, match="Unknown index"):
+        index_spec("annoy")
@@ -0,0 +1,107 @@
+# test_knn_live.py
+"""LiveKNN upserts/deletes keep the neighbour table equal to a brute-force rebuild."""
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import knn_live
+from knn_artifact import KNNArtifact, artifact_from_frame
+from knn_live import LiveKNN
+
+K = 5
+
+@pytest.fixture
+def live(tmp_path):
+    rng = np.random.default_rng(0)
+    n = 120
+    df = pd.DataFrame({
+        "company_id": np.arange(1, n + 1),
+        "industry": rng.choice(["mining", "construction"], n),
+        "f1": rng.normal(size=n), "f2": rng.normal(size=n) * 3, "f3": rng.normal(size=n),
+        "avg_cranes": rng.uniform(0, 5, n), "avg_loaders": rng.uniform(0, 5, n),
+    })
+    artifact_from_frame(tmp_path / "art", df, ["f1", "f2", "f3"], "company_id", k_max=K)
+    return LiveKNN(KNNArtifact(tmp_path / "art"))
+
+def _record(cid, rng, **kwargs):
+    rec = {"company_id": cid, "f1": rng.normal(), "f2": rng.normal() * 3, "f3": rng.normal()}
+    rec.update(kwargs)
+    return rec
+
+def _assert_table_exact(live):
+    n = live.n_rows
+    rows = np.flatnonzero(live.alive[:n])
+    X = live.Xs[rows]
+    for r in rows:
+        d = np.sqrt(((X - live._Xs[r]) ** 2).sum(axis=1))
+        d[rows == r] = np.inf
+        order = np.argsort(d, kind="stable")[:live.k_max]
+        np.testing.assert_allclose(live._nbr_dist[r, :live.k_max], d[order], atol=1e-9)
+        assert set(live._nbr_idx[r, :live.k_max]) == set(rows[order])
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)    # all-NaN asset column
+            want = np.nanmean(live.assets[rows[order]], axis=0)
+        np.testing.assert_allclose(live.nbr_means[r, live.k_max - 1], want, atol=1e-9)
+
+def _assets(live, row):
+    return [live.assets[row, live.asset_index[c]] for c in ("avg_cranes", "avg_loaders")]
+
+def test_insert_replace_and_delete(live):
+    rng = np.random.default_rng(1)
+    n0 = len(live)
+    out = live.upsert(_record("new-1", rng, avg_cranes=1.0, avg_loaders=2.0, industry="mining"))
+    assert out["inserted"] and out["rows"] == n0 + 1 and out["invalidated"] >= 1
+    row = live.index_of("new-1")
+    assert _assets(live, row) == [1.0, 2.0]
+
+    out = live.upsert(_record(7, rng, avg_loaders=4.0))      # replace; unset asset is kept
+    assert not out["inserted"] and out["rows"] == n0 + 1
+    old_cranes = live.artifact.assets[live.artifact.index_of(7), live.asset_index["avg_cranes"]]
+    assert _assets(live, live.index_of(7)) == [old_cranes, 4.0]
+    assert not live.alive[live.artifact.index_of(7)]
+
+    live.delete("new-1")
+    assert live.index_of("new-1") is None and len(live) == n0
+    with pytest.raises(ValueError):
+        live.delete("new-1")
+    assert (live.upserts, live.deletes, live.dirty) == (2, 1, 3)
+    _assert_table_exact(live)
+
+def test_no_table_entry_points_at_a_tombstone(live):
+    rng = np.random.default_rng(2)
+    for cid in range(1, 40, 3):
+        live.delete(cid)
+    for cid in range(2, 40, 3):
+        live.upsert(_record(cid, rng))
+    rows = np.flatnonzero(live.alive[:live.n_rows])
+    assert live.alive[live._nbr_idx[rows, :live.k_max]].all()
+    _assert_table_exact(live)
+
+def test_compaction_and_restandardizing_keep_the_table_exact(live, monkeypatch):
+    monkeypatch.setattr(knn_live, "COMPACT_ROWS", 10)
+    rng = np.random.default_rng(3)
+    for cid in range(1, 30):
+        live.upsert(_record(cid, rng))
+    assert live.compactions >= 1
+    _assert_table_exact(live)
+
+    for i in range(40):                                      # widen f1 well past SCALE_DRIFT
+        live.upsert(_record(f"wide-{i}", rng, f1=rng.normal() * 10))
+    assert live.restandardizations >= 1
+    assert np.all(np.abs(live._running_scale() / live.scale - 1.0) <= knn_live.SCALE_DRIFT)
+    _assert_table_exact(live)
+
+def test_saved_version_reloads_with_the_same_rows(live, tmp_path):
+    rng = np.random.default_rng(4)
+    live.upsert(_record("new-1", rng, avg_cranes=3.0))
+    live.delete(5)
+    version = live.save(tmp_path / "saved")
+    art = KNNArtifact(tmp_path / "saved")
+    assert art.version == version and len(art) == len(live)
+    assert art.index_of(5) is None
+    row = art.index_of("new-1")
+    np.testing.assert_allclose(art.Xs[row], live.vector(live.index_of("new-1"))[0])
+    reloaded = LiveKNN(art)
+    _assert_table_exact(reloaded)
@@ -0,0 +1,110 @@
+# test_metrics.py
+"""The metrics registry and its Prometheus text exposition."""
+import re
+
+import pytest
+from flask import Flask
+
+import metrics
+from metrics import RateWindow, Registry, phase
+
+SAMPLE = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{([a-zA-Z_][a-zA-Z0-9_]*="([^"\\]|\\.)*",?)*\})? '
+                    r'(-?[0-9.e+-]+|NaN|[+-]Inf)$')
+
+def _check_format(text: str):
+    assert text.endswith("\n")
+    for line in text.splitlines():
+        if line.startswith("#"):
+            assert re.match(r"^# (HELP|TYPE) [a-zA-Z_:][a-zA-Z0-9_:]* .+$", line), line
+        else:
+            assert SAMPLE.match(line), line
+
+def test_counter_and_gauge_exposition():
+    reg = Registry()
+    c = reg.counter("jobs_total", "Jobs run.", ("kind",))
+    c.inc("a")
+    c.inc("a", n=2)
+    c.inc('we"ird\\\n')
+    g = reg.gauge("depth", "Queue depth.")
+    g.set(3)
+    text = reg.render()
+    _check_format(text)
+    assert text.splitlines() == [
+        "# HELP depth Queue depth.", "# TYPE depth gauge", "depth 3.0",
+        "# HELP jobs_total Jobs run.", "# TYPE jobs_total counter",
+        'jobs_total{kind="a"} 3.0', 'jobs_total{kind="we\\"ird\\\\\\n"} 1.0',
+    ]
+
+def test_histogram_buckets_are_cumulative():
+    reg = Registry()
+    h = reg.histogram("lat_seconds", "Latency.", ("phase",), buckets=(0.1, 1.0))
+    for v in (0.05, 0.1, 0.5, 3.0):
+        h.observe(v, "score")
+    lines = reg.render().splitlines()
+    _check_format(reg.render())
+    assert lines[2:] == [
+        'lat_seconds_bucket{phase="score",le="0.1"} 2',     # le is inclusive
+        'lat_seconds_bucket{phase="score",le="1.0"} 3',
+        'lat_seconds_bucket{phase="score",le="+Inf"} 4',
+        'lat_seconds_sum{phase="score"} 3.65',
+        'lat_seconds_count{phase="score"} 4',
+    ]
+
+def test_gauge_functions_are_read_at_scrape_time():
+    reg = Registry()
+    g = reg.gauge("rows", "Rows.", ("model",))
+    state = {"n": 1}
+    g.set_function(lambda: state["n"], "knn")
+    g.set_function(lambda: None, "empty")
+    g.set_function(lambda: 1 / 0, "broken")
+    state["n"] = 7
+    assert reg.render().splitlines()[2:] == ['rows{model="knn"} 7.0']
+
+def test_registry_returns_one_metric_per_name():
+    reg = Registry()
+    assert reg.counter("x_total", "X.") is reg.counter("x_total", "X.")
+    with pytest.raises(ValueError, match="already registered"):
+        reg.gauge("x_total", "X.")
+
+def test_disabled_metrics_record_nothing(monkeypatch):
+    reg = Registry()
+    c = reg.counter("n_total", "N.")
+    h = reg.histogram("t_seconds", "T.")
+    monkeypatch.setattr(metrics, "ENABLED", False)
+    c.inc()
+    with phase(h, "score") as p:
+        pass
+    assert p is None                      # the shared no-op context
+    assert reg.render().splitlines() == ["# HELP n_total N.", "# TYPE n_total counter",
+                                         "# HELP t_seconds T.", "# TYPE t_seconds histogram"]
+
+def test_phase_times_into_the_histogram():
+    reg = Registry()
+    h = reg.histogram("t_seconds", "T.", ("phase", "mode"))
+    with phase(h, "parse", "one"):
+        pass
+    assert 't_seconds_count{phase="parse",mode="one"} 1' in reg.render()
+
+def test_rate_window_covers_the_last_n():
+    w = RateWindow(size=4)
+    assert w.rate() is None
+    w.add_many([1, 0, 0, 0])
+    assert w.rate() == 0.25
+    w.add_many([1, 1])                    # the first 1 and a 0 drop out
+    assert w.rate() == 0.5
+
+def test_flask_requests_are_counted_by_route():
+    app = metrics.instrument_flask(Flask(__name__), "test_app")
+
+    @app.get("/items/<item_id>")
+    def item(item_id):
+        return {"id": item_id}
+
+    client = app.test_client()
+    client.get("/items/1")
+    client.get("/items/2")
+    client.get("/nowhere")
+    text = metrics.render()
+    _check_format(text)
+    assert 'http_requests_total{app="test_app",route="/items/<item_id>",method="GET",status="200"} 2.0' in text
+    assert 'http_requests_total{app="test_app",route="unmatched",method="GET",status="404"} 1.0' in text
@@ -0,0 +1,64 @@
+# test_model_format.py
+"""Round trip of the binary model format (model_format.py)."""
+import itertools
+
+import numpy as np
+import pytest
+
+import model_format
+from conftest import SENSOR_CSV
+from features import NUMERIC_COLS
+from inference import dump_model, load_model, save_model, score_x
+from ingest import iter_feature_dicts
+from train_save_river import build_model
+
+@pytest.fixture(scope="module")
+def rows():
+    return [x for _, x in itertools.islice(iter_feature_dicts(SENSOR_CSV, NUMERIC_COLS), 800)]
+
+@pytest.fixture
+def trained(rows):
+    model = build_model(q=0.995)
+    for x in rows[:500]:   # past the first window, so the trees hold learned mass
+        model.learn_one(x)
+    return model
+
+def test_round_trip_keeps_state_and_scores(tmp_path, trained, rows):
+    path = tmp_path / f"model{model_format.SUFFIX}"
+    save_model(trained, path)
+    assert model_format.is_binary(path)
+    restored = load_model(path)
+    assert model_format.dumps(restored) == model_format.dumps(trained)
+    for x in rows[500:]:   # score, then keep learning on both
+        assert score_x(x, restored) == score_x(x, trained)
+        trained.learn_one(x)
+        restored.learn_one(x)
+
+def test_mapped_arrays_match_the_numpy_engine(tmp_path, trained, rows):
+    path = tmp_path / f"model{model_format.SUFFIX}"
+    model_format.save(trained, path)
+    mapped = model_format.load_numpy(path, mode="r")
+    X = np.array([[x.get(c, np.nan) for c in mapped.feature_names] for x in rows[500:]])
+    expected = [score_x(x, trained)[0] for x in rows[500:]]
+    np.testing.assert_allclose(mapped.score(X), expected, rtol=0, atol=1e-12)
+    assert not mapped.hst.l_mass.flags.writeable
+
+def test_pickle_paths_stay_pickles(tmp_path, trained):
+    assert not dump_model(trained, tmp_path / "model.pkl").startswith(model_format.MAGIC)
+
+def test_other_river_version_is_refused(tmp_path, trained, monkeypatch):
+    path = tmp_path / f"model{model_format.SUFFIX}"
+    model_format.save(trained, path)
+    monkeypatch.setattr(model_format, "_river_version", lambda: "0.0.0")
+    with pytest.raises(ValueError, match="River"):
+        model_format.load(path)
+
+def test_bad_magic_and_version(tmp_path, trained):
+    path = tmp_path / f"model{model_format.SUFFIX}"
+    path.write_bytes(b"not a model at all")
+    with pytest.raises(ValueError, match="magic"):
+        model_format.load_arrays(path, mode=None)
+    blob = model_format.dumps(trained).replace(b'"format_version": 2', b'"format_version": 9', 1)
+    path.write_bytes(blob)
+    with pytest.raises(ValueError, match="format 9"):
+        model_format.load_arrays(path, mode=None)
@@ -0,0 +1,56 @@
+# test_quantiles.py
+"""Incremental quantile trackers against np.quantile."""
+import numpy as np
+import pytest
+
+from quantiles import P2Quantile, WindowedQuantile, make_threshold
+
+@pytest.mark.parametrize("q", [0.0, 0.5, 0.9, 0.995, 1.0])
+def test_windowed_matches_numpy_on_the_sliding_window(q):
+    rng = np.random.default_rng(0)
+    xs = np.concatenate([rng.normal(size=600), rng.exponential(size=600) * 3])  # a distribution shift
+    wq = WindowedQuantile(q, window=200)
+    for i, x in enumerate(xs):
+        wq.update(x)
+        assert wq.get() == pytest.approx(np.quantile(xs[max(0, i - 199):i + 1], q), abs=1e-12)
+    assert len(wq) == 200
+
+def test_windowed_handles_ties():
+    wq = WindowedQuantile(0.9, window=50)
+    xs = [1.0, 2.0, 2.0, 2.0, 3.0] * 40
+    for i, x in enumerate(xs):
+        wq.update(x)
+        assert wq.get() == pytest.approx(np.quantile(xs[max(0, i - 49):i + 1], 0.9))
+
+def test_min_count_withholds_the_threshold():
+    for tracker in (WindowedQuantile(0.9, window=10, min_count=3), P2Quantile(0.9, min_count=3)):
+        assert tracker.get() is None
+        for x in (1.0, 2.0, 3.0):
+            tracker.update(x)
+            assert tracker.get() is None
+        tracker.update(4.0)
+        assert tracker.get() is not None
+
+@pytest.mark.parametrize("q", [0.1, 0.5, 0.9, 0.995])
+def test_p2_interpolates_before_five_values(q):
+    p2 = P2Quantile(q)
+    xs = [5.0, 1.0, 4.0, 2.0, 3.0]
+    for i, x in enumerate(xs):
+        p2.update(x)
+        assert p2.get() == pytest.approx(np.quantile(xs[:i + 1], q))
+
+def test_p2_tracks_a_long_stream():
+    xs = np.random.default_rng(1).normal(size=20_000)
+    p2 = P2Quantile(0.99)
+    for x in xs:
+        p2.update(x)
+    assert p2.get() == pytest.approx(np.quantile(xs, 0.99), abs=0.05)
+
+def test_make_threshold():
+    assert make_threshold("river", 0.9) is None
+    assert isinstance(make_threshold("window", 0.9, window=10), WindowedQuantile)
+    assert isinstance(make_threshold("p2", 0.9), P2Quantile)
+    with pytest.raises(ValueError):
+        make_threshold("exact", 0.9)
+    with pytest.raises(ValueError):
+        P2Quantile(1.0)
@@ -0,0 +1,84 @@
+# test_registry.py
+"""Per-key model shards: routing, LRU eviction, spill/reload round trips, loads outside the lock."""
+import itertools
+import threading
+
+import pytest
+
+from conftest import SENSOR_CSV
+from features import NUMERIC_COLS
+from ingest import iter_feature_dicts
+from registry import DEFAULT_SHARD_KEY, ShardRegistry, shard_key
+from train_save_river import build_model
+
+@pytest.fixture(scope="module")
+def rows():
+    return [x for _, x in itertools.islice(iter_feature_dicts(SENSOR_CSV, NUMERIC_COLS), 300)]
+
+def _registry(tmp_path, **kwargs):
+    return ShardRegistry(factory=build_model, shard_dir=tmp_path / "shards", **kwargs)
+
+def test_events_route_by_the_shard_field():
+    assert shard_key({"machine_id": 13}, "machine_id") == "13"
+    assert shard_key({"machine_id": ""}, "machine_id") == DEFAULT_SHARD_KEY
+    assert shard_key({}, "machine_id") == DEFAULT_SHARD_KEY
+
+def test_each_key_gets_its_own_model(tmp_path, rows):
+    reg = _registry(tmp_path)
+    a, b = reg.get("a"), reg.get("b")
+    assert reg.get("a") is a and a.model is not b.model
+    reg.learn("a", rows[:260])   # past the HST window, so scores move
+    assert a.dirty == 260 and b.dirty == 0
+    assert a.model.score_one(rows[280]) != b.model.score_one(rows[280])
+    assert reg.stats()["created_total"] == 2 and reg.stats()["hits_total"] == 2   # the get above and learn()
+
+def test_least_recently_used_shard_is_evicted(tmp_path):
+    reg = _registry(tmp_path, max_resident=2)
+    a, b = reg.get("a"), reg.get("b")
+    reg.get("a")
+    reg.get("c")
+    reg.flush()                          # waits for the background spill
+    assert b.evicted and not a.evicted
+    assert list(reg._shards) == ["a", "c"]
+    assert reg.stats()["evictions_total"] == 1
+    assert not reg.path_for("b").exists()   # nothing learned: nothing to write
+
+def test_spilled_shard_reloads_with_its_learned_state(tmp_path, rows):
+    reg = _registry(tmp_path, max_resident=1)
+    reg.learn("a", rows[:260])   # past the HST window, so scores move
+    want = reg.get("a").model.score_one(rows[280])
+    reg.get("b")                         # evicts "a"
+    reg.flush()
+    assert reg.path_for("a").exists()
+    again = reg.get("a")
+    assert want > 0 and again.dirty == 0 and again.model.score_one(rows[280]) == want
+    assert reg.stats()["loaded_total"] == 1
+    reg.learn("a", rows[260:270])        # keeps learning on the reloaded copy
+    assert reg.get("a").dirty == 10
+
+def test_loads_run_outside_the_registry_lock(tmp_path):
+    entered, gate, calls = threading.Event(), threading.Event(), []
+
+    def slow_factory():
+        calls.append(1)
+        if len(calls) == 1:
+            entered.set()
+            gate.wait(5)
+        return build_model()
+
+    reg = ShardRegistry(factory=slow_factory, shard_dir=tmp_path / "shards")
+    got = []
+    slow = [threading.Thread(target=lambda: got.append(reg.get("slow"))) for _ in range(2)]
+    slow[0].start()
+    assert entered.wait(5)
+    slow[1].start()
+    other = threading.Thread(target=reg.get, args=("other",))
+    other.start()
+    other.join(5)
+    assert not other.is_alive()          # another key is served while "slow" is still loading
+    assert reg.stats()["loading"] == 1
+    gate.set()
+    for t in slow:
+        t.join(5)
+    assert len(got) == 2 and got[0] is got[1]
+    assert len(calls) == 2               # "slow" built once, "other" once
@@ -0,0 +1,71 @@
+# test_result_cache.py
+"""ResultCache hits, expiry, eviction and invalidation."""
+from result_cache import ResultCache
+
+def test_hit_after_store():
+    cache = ResultCache("t", maxsize=10, ttl_s=60)
+    calls = []
+    compute = lambda: calls.append(1) or 42
+    assert cache.get_or_compute("k", compute) == 42
+    assert cache.get_or_compute("k", compute) == 42
+    assert len(calls) == 1
+    assert cache.stats()["hits_total"] == 1
+
+def test_invalidate_drops_every_entry():
+    cache = ResultCache("t", maxsize=10, ttl_s=60)
+    cache.get_or_compute("a", lambda: 1)
+    cache.get_or_compute("b", lambda: 2)
+    cache.invalidate()
+    assert cache.lookup("a")[0] is False
+    assert cache.get_or_compute("b", lambda: 3) == 3
+
+def test_result_computed_across_an_invalidate_is_not_stored():
+    cache = ResultCache("t", maxsize=10, ttl_s=60)
+    hit, _, token = cache.lookup("k")
+    assert not hit
+    cache.invalidate()          # e.g. the model learned while we were scoring
+    cache.store("k", "stale", token)
+    assert cache.lookup("k")[0] is False
+
+def test_new_source_invalidates():
+    cache = ResultCache("t", maxsize=10, ttl_s=60)
+    old, new = object(), object()
+    cache.get_or_compute("k", lambda: "old", source=old)
+    assert cache.get_or_compute("k", lambda: "x", source=old) == "old"
+    assert cache.get_or_compute("k", lambda: "new", source=new) == "new"
+    assert cache.stats()["invalidations_total"] == 1
+
+def test_expired_entries_miss():
+    cache = ResultCache("t", maxsize=10, ttl_s=0.0)
+    cache.get_or_compute("k", lambda: 1)
+    assert cache.lookup("k")[0] is False
+    assert cache.stats()["expired_total"] == 1
+
+def test_lru_eviction():
+    cache = ResultCache("t", maxsize=2, ttl_s=60)
+    for k in "abc":
+        cache.get_or_compute(k, lambda: k)
+    assert cache.lookup("a")[0] is False
+    assert cache.lookup("c")[0] is True
+    assert cache.stats()["evictions_total"] == 1
+
+def test_errors_are_not_cached():
+    cache = ResultCache("t", maxsize=10, ttl_s=60)
+
+    def boom():
+        raise ValueError("bad")
+
+    for _ in range(2):
+        try:
+            cache.get_or_compute("k", boom)
+        except ValueError:
+            pass
+    assert cache.stats()["entries"] == 0
+
+def test_disabled_cache_always_computes():
+    cache = ResultCache("t", maxsize=0)
+    calls = []
+    for _ in range(2):
+        cache.get_or_compute("k", lambda: calls.append(1))
+    assert len(calls) == 2
+    assert not cache.enabled
@@ -0,0 +1,126 @@
+# test_shared_model.py
+"""Owner/follower roles, spool replay, snapshot reload and role swaps of SharedModelService."""
+import itertools
+import threading
+import time
+
+import pytest
+
+import model_format
+import shared_model
+from conftest import SENSOR_CSV
+from features import NUMERIC_COLS
+from inference import load_model, save_model
+from ingest import iter_feature_dicts
+from service import AnomalyService
+from shared_model import LearnSpool, SharedModelService, SnapshotModel, replay_spool
+from train_save_river import build_model
+
+@pytest.fixture(scope="module")
+def rows():
+    return [x for _, x in itertools.islice(iter_feature_dicts(SENSOR_CSV, NUMERIC_COLS), 400)]
+
+@pytest.fixture
+def model_path(tmp_path, rows, monkeypatch):
+    for name, value in [("SNAPSHOT_CHECK_S", 0.05), ("OWNER_RETRY_S", 0.05), ("SPOOL_FLUSH_S", 0.05),
+                        ("SNAPSHOT_EVERY_S", 0.05)]:
+        monkeypatch.setattr(shared_model, name, value)
+    model = build_model()
+    for x in rows[:300]:
+        model.learn_one(x)
+    path = tmp_path / "model.pkl"
+    save_model(model, path)
+    return path
+
+@pytest.fixture
+def workers(model_path):
+    started = []
+
+    def start():
+        started.append(SharedModelService(model_path).start())
+        return started[-1]
+
+    yield start
+    for w in reversed(started):
+        w.stop()
+
+def _wait(cond, timeout=10.0):
+    deadline = time.time() + timeout
+    while not cond():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.02)
+
+def test_first_worker_owns_the_others_follow(workers, rows):
+    owner, follower = workers(), workers()
+    assert (owner.role, follower.role) == ("owner", "follower")
+    assert isinstance(follower.service.model, SnapshotModel)
+    assert owner.stats()["worker"]["owner_pid"] == follower.stats()["worker"]["owner_pid"]
+    for x in rows[300:320]:
+        assert follower.predict(x) == owner.predict(x)
+
+def test_follower_learns_through_the_spool_and_reloads(workers, rows):
+    owner, follower = workers(), workers()
+    learned = owner.service.learner.stats()["learned_total"]
+    follower.predict_batch(rows[300:350], learn=True)
+    _wait(lambda: owner.service.learner.stats()["learned_total"] == learned + 50)
+    assert not list(follower.spool_dir.glob("*.ndjson"))
+    assert owner.replayed == 50
+    _wait(lambda: follower.reloads >= 1 and owner.checkpointer.pending == 0)
+    _wait(lambda: follower.service.model.version == shared_model._file_version(follower.snapshot_path))
+    for x in rows[350:370]:
+        assert follower.predict(x)["score"] == pytest.approx(owner.predict(x)["score"])
+
+def test_replay_keeps_what_the_queue_refuses(tmp_path, model_path, rows):
+    spool = LearnSpool(tmp_path / "spool", max_events=10)
+    spool.put_many([(None, x, 0.5) for x in rows[:25]])
+    spool.flush()
+    svc = AnomalyService(load_model(model_path), tmp_path / "m.pkl", shard_by=None, queue_size=10,
+                         backpressure="reject")
+    assert replay_spool(spool.dir, svc) == 10               # writer not running: the queue fills up
+    assert svc.learner.depth() == 10
+    assert len(list(spool.dir.glob("*.ndjson"))) == 2
+    svc.start()
+    _wait(lambda: svc.learner.depth() == 0)
+    while replay_spool(spool.dir, svc):
+        svc.learner.wait_idle()
+    svc.stop()
+    assert svc.learner.stats()["learned_total"] == 25
+    assert not list(spool.dir.glob("*.ndjson"))
+
+def test_follower_takes_over_and_the_model_file_catches_up(workers, model_path, rows):
+    owner, follower = workers(), workers()
+    owner.predict_batch(rows[300:340], learn=True)
+    owner.stop()
+    assert model_format.dumps(load_model(model_path)) == model_format.dumps(model_format.load(owner.snapshot_path))
+    _wait(lambda: follower.promotions == 1)
+    assert (follower.role, owner.role) == ("owner", "stopped")
+    assert not isinstance(follower.service.model, SnapshotModel)
+    assert model_format.dumps(follower.service.model) == model_format.dumps(load_model(model_path))
+
+def test_swap_waits_for_requests_inside_the_old_service(workers, rows):
+    owner, follower = workers(), workers()
+    old = follower.service
+    entered, gate = threading.Event(), threading.Event()
+    predict = old.predict
+
+    def slow_predict(event, learn=False):
+        entered.set()
+        gate.wait(5)
+        return predict(event, learn=learn)
+
+    old.predict = slow_predict
+    request = threading.Thread(target=follower.predict, args=(rows[300],), kwargs={"learn": True})
+    request.start()
+    assert entered.wait(5)
+    new = AnomalyService(SnapshotModel(follower.snapshot_path), follower.snapshot_path,
+                         learner=LearnSpool(follower.spool_dir)).start()
+    swap = threading.Thread(target=follower._swap, args=(new, "follower"))
+    swap.start()
+    time.sleep(0.1)
+    assert swap.is_alive() and follower.service is old     # the request still holds the old service
+    gate.set()
+    request.join(5)
+    swap.join(5)
+    assert follower.service is new
+    assert old.learner.stats()["enqueued_total"] == 1       # went into the old spool before it stopped
+    _wait(lambda: owner.replayed >= 1)
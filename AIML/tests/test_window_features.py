@@ -0,0 +1,131 @@
+# test_window_features.py
+"""Rolling per-machine features, and the service only appending events it learns."""
+import itertools
+import math
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from concurrency import LearnQueueFull
+from conftest import SENSOR_CSV
+from service import AnomalyService
+from train_save_river import build_model
+from window_features import WindowFeatures, iter_enriched_dicts
+
+COLS = ["a", "b"]
+
+def _window(**kwargs):
+    return WindowFeatures(COLS, n=3, alpha=0.5, **kwargs)
+
+def test_stats_over_the_last_n_readings():
+    wf = _window()
+    rows = [[1.0, 10.0], [2.0, math.nan], [4.0, 30.0], [8.0, 40.0]]
+    for i, row in enumerate(rows):
+        out = dict(zip(wf.output_columns, wf.update("m1", row, now=float(i))))
+    a, b = [2.0, 4.0, 8.0], [30.0, 40.0]                  # the last n readings, NaN left out
+    assert out["a__mean"] == pytest.approx(np.mean(a))
+    assert out["a__std"] == pytest.approx(np.std(a))
+    assert out["b__mean"] == pytest.approx(np.mean(b))
+    assert out["a__delta"] == 8.0 - 1.0                   # against the reading n steps back
+    assert out["a__ewma"] == pytest.approx(((1.0 * 0.5 + 2.0 * 0.5) * 0.5 + 4.0 * 0.5) * 0.5 + 8.0 * 0.5)
+    assert out["b__delta"] == 40.0 - 10.0
+    other = dict(zip(wf.output_columns, wf.update("m2", [5.0, 5.0], now=4.0)))
+    assert other["a__mean"] == 5.0 and other["a__delta"] == 0.0
+
+def test_peek_matches_enrich_without_changing_the_history():
+    wf = _window()
+    for i in range(5):
+        wf.enrich("m1", {"a": float(i), "b": float(i * i)})
+    before = wf.stats()
+    peeked = wf.peek("m1", {"a": 9.0, "b": 1.0})
+    assert wf.peek("m1", {"a": 9.0, "b": 1.0}) == peeked
+    assert wf.peek("new", {"a": 1.0}) == {"a": 1.0, "a__ewma": 1.0, "a__mean": 1.0, "a__std": 0.0, "a__delta": 0.0}
+    assert wf.stats() == before
+    assert wf.enrich("m1", {"a": 9.0, "b": 1.0}) == peeked
+
+def test_peek_many_sees_earlier_readings_of_the_same_machine():
+    wf, ref = _window(), _window()
+    for w in (wf, ref):
+        w.enrich("m1", {"a": 1.0, "b": 2.0})
+    keys = ["m1", "m2", "m1", "m1"]
+    xs = [{"a": 2.0, "b": 3.0}, {"a": 7.0}, {"a": 3.0}, {"b": 5.0}]
+    assert wf.peek_many(keys, xs) == [ref.enrich(k, x) for k, x in zip(keys, xs)]
+    assert wf.stats()["machines"] == 1 and wf.stats()["updates_total"] == 1
+
+def test_transform_replays_like_update():
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(40, 2))
+    X[5, 0] = X[9] = np.nan
+    keys = rng.choice(["m1", "m2", "m3"], 40)
+    ref = _window()
+    want = [ref.update(k, row, now=0.0) if not np.isnan(row).all() else np.full(len(ref.output_columns), np.nan)
+            for k, row in zip(keys, X)]
+    np.testing.assert_array_equal(_window().transform(keys, X, np.zeros(40)), np.array(want))
+
+def test_idle_and_least_recent_machines_are_evicted():
+    wf = _window(max_machines=2, idle_s=10.0)
+    wf.update("m1", [1.0, 1.0], now=0.0)
+    wf.update("m2", [1.0, 1.0], now=5.0)
+    wf.update("m1", [2.0, 2.0], now=6.0)
+    wf.update("m3", [1.0, 1.0], now=7.0)           # full: m2 is the least recently updated
+    assert set(wf._slots) == {"m1", "m3"} and wf.evicted == 1
+    wf.update("m4", [1.0, 1.0], now=100.0)         # both idle: swept
+    assert set(wf._slots) == {"m4"} and wf.evicted == 3
+    out = dict(zip(wf.output_columns, wf.update("m1", [5.0, 5.0], now=101.0)))
+    assert out["a__mean"] == 5.0                   # history starts over
+
+# ---- service ----
+
+@pytest.fixture(scope="module")
+def events():
+    df = pd.read_csv(SENSOR_CSV, nrows=700)
+    return df.drop(columns=["reading_id", "timestamp"]).to_dict("records")
+
+@pytest.fixture(scope="module")
+def window_model():
+    model = build_model()
+    for _, x in itertools.islice(iter_enriched_dicts(SENSOR_CSV, WindowFeatures()), 600):
+        model.learn_one(x)
+    return model
+
+def _service(tmp_path, model, **kwargs):
+    return AnomalyService(model, model_path=tmp_path / "model.pkl", shard_by=None, **kwargs)
+
+def test_service_picks_up_the_window_stage(tmp_path, window_model):
+    svc = _service(tmp_path, window_model)
+    assert svc.window is not None and svc.cache is None
+
+def test_learn_false_calls_do_not_move_the_window(tmp_path, window_model, events):
+    svc = _service(tmp_path, window_model)
+    for e in events[600:650]:
+        svc.window.append(svc.window.key_of(e), svc._features(e))
+    probe = events[650]
+    first = svc.predict(probe)
+    assert [svc.predict(probe) for _ in range(5)] == [first] * 5
+    assert svc.predict_batch([probe]) == [first]
+    pair = svc.predict_batch([probe, probe])             # the second sees the first, as if learned
+    assert pair[0] == first and svc.predict_batch([probe, probe]) == pair
+    assert svc.window.stats()["updates_total"] == 50
+
+def test_only_queued_learn_events_are_appended(tmp_path, window_model, events):
+    svc = _service(tmp_path, window_model, queue_size=2, backpressure="reject")
+    with pytest.raises(LearnQueueFull):
+        svc.predict_batch(events[:3], learn=True)       # refused before scoring
+    assert svc.window.stats()["updates_total"] == 0
+    svc.predict_batch(events[:2] + ["not an event"], learn=True)
+    assert svc.window.stats()["updates_total"] == 2
+    with pytest.raises(LearnQueueFull):
+        svc.predict(events[2], learn=True)
+    assert svc.window.stats()["updates_total"] == 2
+
+def test_batch_scores_match_sequential_learning(tmp_path, window_model, events):
+    batch = events[:20]
+    svc = _service(tmp_path, window_model)
+    got = svc.predict_batch(batch)
+    ref = _service(tmp_path, window_model)
+    want = []
+    for e in batch:
+        want.append(ref.predict(e))
+        ref.window.append(ref.window.key_of(e), ref._features(e))
+    assert got == want
@@ -1,4 +1,6 @@
 # train_knn_save.py
+#   python train_knn_save.py [--index brute|kd_tree|ball_tree|rp_forest|hnsw]
+import argparse
 import pandas as pd
 import numpy as np
 from pathlib import Path
@@ -6,9 +8,22 @@ from sklearn.preprocessing import StandardScaler
 from sklearn.neighbors import NearestNeighbors
 import joblib  # pip install joblib
 
+from knn_artifact import artifact_from_frame, ARTIFACT_DIR, K_MAX
+from knn_index import INDEX_KINDS, index_spec
+
 # ---------- CONFIG ----------
 CSV_PATH = Path(r"AIML\company_cluster_features.csv")
-ARTIFACT_PATH = Path("knn_recommender.joblib")
+ARTIFACT_DIR_PATH = ARTIFACT_DIR                # mmap-able .npy arrays + meta.json (served by flask_knn_api.py)
+ARTIFACT_PATH = Path("knn_recommender.joblib")  # legacy single-file artifact
+WRITE_LEGACY_JOBLIB = False
+NEIGHBORS_K_MAX = K_MAX  # neighbours precomputed per company; larger k falls back to a live query
+KNN_INDEX = "brute"      # see knn_index.py; rp_forest/hnsw trade exactness for speed on large populations
+INDEX_PARAMS = {         # per-kind constructor arguments stored with the artifact
+    "kd_tree": {"leaf_size": 30},
+    "ball_tree": {"leaf_size": 30},
+    "rp_forest": {"n_trees": 10, "leaf_size": 64, "seed": 42},
+    "hnsw": {"M": 16, "ef_construction": 200, "ef": 64},
+}
 
 FEATURE_COLS = ["avg_util", "peak_util_p95", "fleet_now", "stress_index"]
 ID_COL = "company_id"
@@ -16,7 +31,7 @@ ID_COL = "company_id"
 EXTRA_COLS = [c for c in ["industry", "state"] if c]  # keep if present
 # ----------------------------
 
-def main():
+def main(index: str = KNN_INDEX):
     df = pd.read_csv(CSV_PATH)
 
     missing = [c for c in [ID_COL, *FEATURE_COLS] if c not in df.columns]
@@ -26,27 +41,37 @@ def main():
     # Drop rows with missing features
     df = df.dropna(subset=FEATURE_COLS).reset_index(drop=True)
 
-    # Fit scaler and KNN on features
+    # Fit scaler on features (the neighbour index is built from the artifact)
     X = df[FEATURE_COLS].to_numpy(dtype=float)
     scaler = StandardScaler()
     Xs = scaler.fit_transform(X)
 
-    nn = NearestNeighbors(metric="euclidean")
-    nn.fit(Xs)
-
-    # Save artifact: everything needed for inference
-    artifact = {
-        "scaler": scaler,
-        "nn": nn,
-        "feature_cols": FEATURE_COLS,
-        "id_col": ID_COL,
-        # Keep only useful columns for inference/response
-        "df": df[[ID_COL, *FEATURE_COLS, *[c for c in EXTRA_COLS if c in df.columns]
+    # Keep only useful columns for inference/response
+    out_df = df[[ID_COL, *FEATURE_COLS, *[c for c in EXTRA_COLS if c in df.columns]
                  ] + [c for c in df.columns if c.startswith("avg_") or c.startswith("total_") or c.endswith("_count")]].copy()
-        # ^ adjust the asset column heuristic if you want
-    }
-    joblib.dump(artifact, ARTIFACT_PATH, compress=3)
-    print(f"Saved artifact to {ARTIFACT_PATH.resolve()} with {len(df)} rows.")
+    # ^ adjust the asset column heuristic if you want
+
+    # Save artifact as raw arrays plus the precomputed neighbour table; a running
+    # flask_knn_api.py notices the new meta.json and switches over
+    spec = index_spec(index, **INDEX_PARAMS.get(index, {}))
+    artifact_from_frame(ARTIFACT_DIR_PATH, out_df, FEATURE_COLS, ID_COL, scaler=scaler,
+                        index=spec, k_max=NEIGHBORS_K_MAX)
+    print(f"Saved artifact to {ARTIFACT_DIR_PATH.resolve()} with {len(df)} rows ({index} index).")
+
+    if WRITE_LEGACY_JOBLIB:
+        nn = NearestNeighbors(metric="euclidean")
+        nn.fit(Xs)
+        artifact = {
+            "scaler": scaler,
+            "nn": nn,
+            "feature_cols": FEATURE_COLS,
+            "id_col": ID_COL,
+            "df": out_df,
+        }
+        joblib.dump(artifact, ARTIFACT_PATH, compress=3)
+        print(f"Saved legacy artifact to {ARTIFACT_PATH.resolve()}.")
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Train and save the company KNN recommender.")
+    parser.add_argument("--index", choices=INDEX_KINDS, default=KNN_INDEX)
+    main(parser.parse_args().index)
@@ -1,28 +1,19 @@
 # train_and_save.py
-import csv, os
+import os
 from pathlib import Path
-from typing import Dict, Any
-import cloudpickle as pickle  # or pickle/dill
+from typing import Optional
 
 from river import anomaly, preprocessing, compose
 
+from registry import ShardRegistry, shard_key, SHARD_DIR, MAX_RESIDENT_SHARDS
+from features import NUMERIC_COLS
+from inference import save_model
+from ingest import iter_feature_dicts, read_matrix
+from window_features import WINDOW_FEATURES, WindowFeatures, iter_enriched_dicts, read_enriched_matrix
+
 CSV_PATH   = r"AIML\MachineSensorData_anomalies.csv"
 MODEL_PATH = Path("hst_quantile_model.pkl")
 
-NUMERIC_COLS = [
-    "avg_fuel_consumption_rate",
-    "idle_fuel_consumption_pct",
-    "rpm_variance",
-    "coolant_temp_anomalies",
-    "productive_time_mins",
-    "idle_time_mins",
-    "vibration_anomalies",
-    "over_speed_events",
-    "tire_pressure_deviations",
-    "error_code_frequency",
-    "battery_low_voltage_events",
-]
-
 def build_model(q: float = 0.995):
     """Scaler -> HalfSpaceTrees -> QuantileFilter, all in one pipeline."""
     hst = anomaly.HalfSpaceTrees(n_trees=25, height=8, window_size=250, seed=42)
@@ -34,32 +25,55 @@ def build_model(q: float = 0.995):
     )
     return model
 
-def row_to_x(row: Dict[str, Any]) -> Dict[str, float]:
-    x = {}
-    for c in NUMERIC_COLS:
-        v = row.get(c)
-        if v not in (None, ""):
-            try:
-                x[c] = float(v)
-            except Exception:
-                pass
-    return x
+def train_and_save(csv_path: str = CSV_PATH, model_path: Path = MODEL_PATH, engine: str = "river",
+                   cache_dir: Optional[Path] = None, window: bool = WINDOW_FEATURES):
+    """
+    engine="numpy" trains with the vectorized NumPy Half-Space Trees and
+    converts back to the same River pipeline (identical state, much faster
+    on long histories).
+    cache_dir: keep a parsed copy of the CSV there (see ingest.py) so
+    retraining on the same export skips CSV parsing.
+    window=True trains on the per-machine rolling features of
+    window_features.py; the services then add them to incoming events.
+    """
+    wf = WindowFeatures() if window else None
+    if engine == "numpy":
+        from hst_numpy import NumpyHSTPipeline
+        if wf is not None:
+            names, X = wf.output_columns, read_enriched_matrix(csv_path, wf, cache_dir=cache_dir)
+        else:
+            names, X = NUMERIC_COLS, read_matrix(csv_path, NUMERIC_COLS, cache_dir=cache_dir)
+        np_model = NumpyHSTPipeline(names, n_trees=25, height=8, window_size=250, seed=42, q=0.995)
+        np_model.learn(X)
+        save_model(np_model.to_river(), Path(model_path))
+        print(f"Saved trained pipeline to {Path(model_path).resolve()}")
+        return
 
-def train_and_save(csv_path: str = CSV_PATH, model_path: Path = MODEL_PATH):
     model = build_model(q=0.995)
-    with open(csv_path, "r", newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            x = row_to_x(row)
-            if not x:
-                continue
-            # one pass: learn the scaler, filter's internal quantile, and HST
-            model.learn_one(x)
+    rows = (iter_enriched_dicts(csv_path, wf, cache_dir=cache_dir) if wf is not None
+            else iter_feature_dicts(csv_path, NUMERIC_COLS, cache_dir=cache_dir))
+    for _, x in rows:
+        # one pass: learn the scaler, filter's internal quantile, and HST
+        model.learn_one(x)
+
+    # a *.hstm path gets the binary format (model_format.py), anything else a pickle
+    save_model(model, Path(model_path))
+
+    print(f"Saved trained pipeline to {Path(model_path).resolve()}")
 
-    with open(model_path, "wb") as f:
-        pickle.dump(model, f)
+def train_shards(csv_path: str = CSV_PATH, shard_by: str = "machine_id",
+                 shard_dir: Path = SHARD_DIR, max_resident: int = MAX_RESIDENT_SHARDS,
+                 cache_dir: Optional[Path] = None):
+    """Train one pipeline per `shard_by` value, in the layout the sharded API serves from."""
+    registry = ShardRegistry(factory=lambda: build_model(q=0.995), shard_dir=shard_dir, max_resident=max_resident)
+    keys = set()
+    for row, x in iter_feature_dicts(csv_path, NUMERIC_COLS, meta=[shard_by], cache_dir=cache_dir):
+        key = shard_key(row, shard_by)
+        keys.add(key)
+        registry.learn(key, [x])
+    registry.flush()
 
-    print(f"Saved trained pipeline to {model_path.resolve()}")
+    print(f"Saved {len(keys)} shard(s) keyed by {shard_by} to {Path(shard_dir).resolve()}")
 
 if __name__ == "__main__":
     train_and_save()
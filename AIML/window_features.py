@@ -0,0 +1,323 @@
+# window_features.py
+"""
+Per-machine rolling features, computed in front of the anomaly pipeline.
+A single reading cannot tell a short spike from a slow drift; this stage
+keeps a little history per `machine_id` and appends, for every sensor
+column c:
+- c__ewma:  exponentially weighted mean (WINDOW_ALPHA)
+- c__mean:  mean of the last WINDOW_N readings
+- c__std:   standard deviation of the last WINDOW_N readings
+- c__delta: change against the reading WINDOW_N steps back (or the
+            oldest one kept while the window fills)
+State lives in flat float arrays, one slot per machine (a ring of the
+last N readings plus running sums), so an update is O(d) whatever the
+history length. At most `max_machines` are tracked: machines silent for
+`idle_s` are swept out, and at the cap the least recently updated one is
+evicted.
+Missing values (NaN) are left out of the sums and the EWMA.
+enrich()/append() advance the history; peek()/peek_many() return the
+same features without touching it. The services score with peek and
+append only the events they queue for learning, so polls, learn=false
+calls and refused batches leave the history alone. The state is per
+process (in multi-worker mode each worker keeps its own).
+A model trained on these features has `__`-suffixed feature names;
+for_model() recognises it, so the services turn the stage on by themselves.
+Keep WINDOW_N / WINDOW_ALPHA the same between training and serving.
+"""
+import copy
+import math
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from features import NUMERIC_COLS, FeatureSchema
+from registry import shard_key
+
+WINDOW_FEATURES = False        # train / replay with the rolling features (serving follows the model)
+WINDOW_KEY = "machine_id"      # event field whose history is tracked
+WINDOW_N = 10                  # readings in the rolling window
+WINDOW_ALPHA = 0.2             # EWMA weight of the newest reading
+WINDOW_STATS = ("ewma", "mean", "std", "delta")
+WINDOW_MAX_MACHINES = 10000    # machines kept in memory at once
+WINDOW_IDLE_S = 24 * 3600.0    # machines silent this long are dropped
+WINDOW_SWEEP_EVERY = 1000      # updates between idle sweeps
+_INITIAL_SLOTS = 64
+_BUFFERS = ("_ring", "_sum", "_sumsq", "_nvalid", "_ewma", "_head", "_count", "_seen")
+
+class WindowFeatures:
+    def __init__(self, columns: Sequence[str] = NUMERIC_COLS, n: int = WINDOW_N, alpha: float = WINDOW_ALPHA,
+                 stats: Sequence[str] = WINDOW_STATS, key: str = WINDOW_KEY,
+                 max_machines: int = WINDOW_MAX_MACHINES, idle_s: float = WINDOW_IDLE_S,
+                 sweep_every: int = WINDOW_SWEEP_EVERY):
+        unknown = [s for s in stats if s not in WINDOW_STATS]
+        if unknown:
+            raise ValueError(f"Unknown window stats: {unknown}")
+        if n < 1 or not 0.0 < alpha <= 1.0 or max_machines < 1:
+            raise ValueError("Need n >= 1, 0 < alpha <= 1 and max_machines >= 1.")
+        self.schema = FeatureSchema(columns)
+        self.columns = self.schema.columns
+        self.stats_out = [s for s in WINDOW_STATS if s in stats]   # canonical order
+        self.output_columns = self.columns + [f"{c}__{s}" for s in self.stats_out for c in self.columns]
+        self.n, self.alpha, self.key = int(n), float(alpha), key
+        self.max_machines, self.idle_s, self.sweep_every = int(max_machines), float(idle_s), int(sweep_every)
+
+        # flat per-slot buffers: slot s owns [s*n*d, (s+1)*n*d) of the ring and [s*d, (s+1)*d) of the rest
+        self._ring = array("d")       # last n readings, NaN = missing
+        self._sum = array("d")        # sums over the valid ring entries
+        self._sumsq = array("d")
+        self._nvalid = array("d")
+        self._ewma = array("d")
+        self._head = array("q")       # next ring row to write
+        self._count = array("q")      # readings seen (saturates at n)
+        self._seen = array("d")       # last update time
+        self._slots: "OrderedDict[str, int]" = OrderedDict()   # least recently updated first
+        self._free: List[int] = []
+        self._cap = 0
+        self._lock = threading.Lock()
+        self.updates = 0
+        self.evicted = 0
+
+    # ---- slots ----
+    def _grow(self, cap: int):
+        extra, d = cap - self._cap, len(self.columns)
+        self._ring.extend(array("d", [math.nan]) * (extra * self.n * d))
+        for buf in (self._sum, self._sumsq, self._nvalid):
+            buf.extend(array("d", [0.0]) * (extra * d))
+        self._ewma.extend(array("d", [math.nan]) * (extra * d))
+        self._head.extend(array("q", [0]) * extra)
+        self._count.extend(array("q", [0]) * extra)
+        self._seen.extend(array("d", [-math.inf]) * extra)
+        self._free.extend(range(cap - 1, self._cap - 1, -1))   # pop() hands out the lowest first
+        self._cap = cap
+
+    def _release(self, key: str):
+        s = self._slots.pop(key)
+        d, nd = len(self.columns), self.n * len(self.columns)
+        self._ring[s * nd:(s + 1) * nd] = array("d", [math.nan]) * nd
+        for buf in (self._sum, self._sumsq, self._nvalid):
+            buf[s * d:(s + 1) * d] = array("d", [0.0]) * d
+        self._ewma[s * d:(s + 1) * d] = array("d", [math.nan]) * d
+        self._head[s] = self._count[s] = 0
+        self._free.append(s)
+        self.evicted += 1
+
+    def _sweep(self, now: float):
+        # oldest first; stops at the first machine that is not idle
+        cutoff = now - self.idle_s
+        for key, s in list(self._slots.items()):
+            if self._seen[s] >= cutoff:
+                break
+            self._release(key)
+
+    def _slot(self, key: str, now: float) -> int:
+        s = self._slots.get(key)
+        if s is not None:
+            self._slots.move_to_end(key)
+            return s
+        if not self._free:
+            if self._cap < self.max_machines:
+                self._grow(min(max(2 * self._cap, _INITIAL_SLOTS), self.max_machines))
+            else:
+                self._sweep(now)
+                if not self._free:
+                    self._release(next(iter(self._slots)))   # least recently updated
+        s = self._slots[key] = self._free.pop()
+        return s
+
+    # ---- update ----
+    def _update(self, key: str, vals: List[float], now: float) -> List[float]:
+        """One reading (schema order, NaN = missing) -> raw values followed by each stat's values."""
+        s = self._slot(key, now)
+        self._seen[s] = now
+        self.updates += 1
+        if self.updates % self.sweep_every == 0:
+            self._sweep(now)   # never drops `key`: it was just seen
+
+        ring, total, sq, nv, ewma = self._ring, self._sum, self._sumsq, self._nvalid, self._ewma
+        n, d, a = self.n, len(vals), self.alpha
+        h, count = self._head[s], self._count[s]
+        at, row, first = s * d, s * n * d + h * d, s * n * d
+        full = count >= n
+        e_out, m_out, s_out, d_out = [], [], [], []
+        # plain floats: on a handful of columns this beats NumPy's per-call overhead
+        for j in range(d):
+            v, i = vals[j], at + j
+            old = ring[row + j]
+            if full:                       # the reading n steps back leaves the window
+                delta = v - old
+                if old == old:
+                    total[i] -= old
+                    sq[i] -= old * old
+                    nv[i] -= 1.0
+            else:
+                delta = v - ring[first + j] if count else v - v
+            ring[row + j] = v
+            e = ewma[i]
+            if v == v:
+                total[i] += v
+                sq[i] += v * v
+                nv[i] += 1.0
+                e = ewma[i] = v if e != e else e + a * (v - e)
+            k = nv[i]
+            if k:
+                mean = total[i] / k
+                var = sq[i] / k - mean * mean
+                std = math.sqrt(var) if var > 0.0 else 0.0
+            else:
+                mean = std = math.nan
+            e_out.append(e)
+            m_out.append(mean)
+            s_out.append(std)
+            d_out.append(delta)
+
+        h = (h + 1) % n
+        if h == 0:
+            # re-sum the full ring once per lap so the running sums never drift
+            for j in range(d):
+                col = [v for v in ring[first + j:first + n * d:d] if v == v]
+                total[at + j] = math.fsum(col)
+                sq[at + j] = math.fsum(v * v for v in col)
+                nv[at + j] = float(len(col))
+        self._head[s] = h
+        self._count[s] = min(count + 1, n)
+
+        by_stat = {"ewma": e_out, "mean": m_out, "std": s_out, "delta": d_out}
+        out = list(vals)
+        for stat in self.stats_out:
+            out += by_stat[stat]
+        return out
+
+    def update(self, key: str, row: Sequence[float], now: Optional[float] = None) -> np.ndarray:
+        """Append one reading (schema order, NaN = missing) to `key`'s history; returns the enriched row."""
+        now = time.time() if now is None else now
+        vals = [float(v) for v in row]
+        with self._lock:
+            return np.array(self._update(key, vals, now))
+
+    def key_of(self, event: Dict[str, Any]) -> str:
+        return shard_key(event, self.key)
+
+    def enrich(self, key: str, x: Dict[str, float], now: Optional[float] = None) -> Dict[str, float]:
+        """Feature dict (as from event_to_x) -> the same dict plus the rolling features; appends x."""
+        now = time.time() if now is None else now
+        nan = math.nan
+        vals = [x.get(c, nan) for c in self.columns]
+        with self._lock:
+            out = self._update(key, vals, now)
+        return {c: v for c, v in zip(self.output_columns, out) if v == v}
+
+    def append(self, key: str, x: Dict[str, float], now: Optional[float] = None):
+        """Add a reading to `key`'s history (x may be an enriched dict; only the raw columns are read)."""
+        now = time.time() if now is None else now
+        vals = [x.get(c, math.nan) for c in self.columns]
+        with self._lock:
+            self._update(key, vals, now)
+
+    def peek(self, key: str, x: Dict[str, float]) -> Dict[str, float]:
+        """What enrich() would return, without appending x."""
+        return self.peek_many([key], [x])[0]
+
+    def peek_many(self, keys: Sequence[str], xs: Sequence[Dict[str, float]]) -> List[Dict[str, float]]:
+        """
+        What a sequence of enrich() calls would return (later readings of a
+        machine see the earlier ones), without changing any history.
+        """
+        with self._lock:
+            fork = self._fork(list(dict.fromkeys(keys)))
+        return [fork.enrich(k, x, now=0.0) for k, x in zip(keys, xs)]
+
+    def _fork(self, keys: List[str]) -> "WindowFeatures":
+        """Scratch copy holding only `keys`' history (caller holds the lock)."""
+        fork = copy.copy(self)
+        for name in _BUFFERS:
+            setattr(fork, name, array(getattr(self, name).typecode))
+        fork._slots, fork._free, fork._cap = OrderedDict(), [], 0
+        fork._lock = threading.Lock()
+        fork.max_machines, fork.idle_s = max(len(keys), 1), math.inf   # nothing is ever evicted
+        fork._grow(fork.max_machines)
+        d, nd = len(self.columns), self.n * len(self.columns)
+        for key in keys:
+            s = self._slots.get(key)
+            if s is None:
+                continue
+            f = fork._slot(key, 0.0)
+            fork._ring[f * nd:(f + 1) * nd] = self._ring[s * nd:(s + 1) * nd]
+            for name in ("_sum", "_sumsq", "_nvalid", "_ewma"):
+                getattr(fork, name)[f * d:(f + 1) * d] = getattr(self, name)[s * d:(s + 1) * d]
+            fork._head[f], fork._count[f] = self._head[s], self._count[s]
+        return fork
+
+    def transform(self, keys: Sequence[Any], X: np.ndarray, times: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Batch replay: enrich the rows of X in order, exactly as a sequence of
+        update() calls would. Rows without any value stay all-NaN and do
+        not touch the state. times: per-row epoch seconds for idle
+        eviction (default: the current time for every row).
+        """
+        now = time.time()
+        X = np.asarray(X, dtype=np.float64)
+        out = np.full((len(X), len(self.output_columns)), np.nan)
+        present = ~np.isnan(X).all(axis=1)
+        ts = [now] * len(X) if times is None else [now if t != t else t for t in np.asarray(times, float).tolist()]
+        rows = X.tolist()
+        with self._lock:
+            for i in np.flatnonzero(present).tolist():
+                out[i] = self._update(str(keys[i]), rows[i], ts[i])
+        return out
+
+    def stats(self) -> Dict[str, Any]:
+        nbytes = sum(getattr(self, name).itemsize * len(getattr(self, name)) for name in _BUFFERS)
+        return {"machines": len(self._slots), "capacity": self._cap, "max_machines": self.max_machines,
+                "updates_total": self.updates, "evicted_total": self.evicted, "state_bytes": nbytes}
+
+# ---- models trained on window features ----
+
+def model_columns(model) -> List[str]:
+    """Feature names a model was trained on (River pipeline, NumPy pipeline or SnapshotModel)."""
+    names = getattr(model, "names", None) or getattr(model, "feature_names", None)
+    if names is None:
+        scaler = model["scale"]
+        names = list(dict.fromkeys(list(scaler.min) + list(scaler.max)))
+    return list(names)
+
+def for_model(model, **kwargs) -> Optional[WindowFeatures]:
+    """The WindowFeatures stage a model expects, or None if it was trained on plain readings."""
+    derived = [c.rsplit("__", 1) for c in model_columns(model) if "__" in c]
+    stats = {s for _, s in derived if s in WINDOW_STATS}
+    if not stats:
+        return None
+    columns = [c for c in NUMERIC_COLS if any(base == c for base, _ in derived)]
+    return WindowFeatures(columns, stats=[s for s in WINDOW_STATS if s in stats], **kwargs)
+
+# ---- CSV replay ----
+
+def event_time(value: Any) -> float:
+    """ISO-8601 timestamp (as in the sensor export) -> epoch seconds, NaN if unparsable."""
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return math.nan
+
+def iter_enriched_dicts(path, window: WindowFeatures, time_col: str = "timestamp", meta: Sequence[str] = (),
+                        **kwargs) -> Iterator[Tuple[Dict[str, str], Dict[str, float]]]:
+    """ingest.iter_feature_dicts with the rolling features added, ages taken from `time_col`."""
+    from ingest import iter_feature_dicts
+    meta = list(dict.fromkeys([window.key, time_col, *meta]))
+    for row, x in iter_feature_dicts(path, window.columns, meta=meta, **kwargs):
+        t = event_time(row.get(time_col))
+        yield row, window.enrich(window.key_of(row), x, now=None if t != t else t)
+
+def read_enriched_matrix(path, window: WindowFeatures, time_col: str = "timestamp", **kwargs) -> np.ndarray:
+    """ingest.read_matrix with the rolling features added (columns = window.output_columns)."""
+    from ingest import iter_blocks
+    blocks = []
+    for m, X in iter_blocks(path, window.columns, [window.key, time_col], **kwargs):
+        keys = [shard_key({window.key: k}, window.key) for k in m[window.key].tolist()]
+        times = np.array([event_time(t) for t in m[time_col].tolist()])
+        blocks.append(window.transform(keys, X, times))
+    return np.concatenate(blocks) if blocks else np.empty((0, len(window.output_columns)))
@@ -17,4 +17,20 @@ async function detectAnomaly(data, learn = false) {
   }
 }
 
-module.exports = { detectAnomaly };
+// Score many readings in one round-trip; results come back in the same order,
+// with { error: ... } entries for readings that could not be scored.
+async function detectAnomalyBatch(events, learn = false) {
+  try {
+    const response = await axios.post(
+      `${FLASK_API_URL}_batch?learn=${learn}`,
+      events,
+      { headers: { "Content-Type": "application/json" } }
+    );
+    return response.data.results;
+  } catch (error) {
+    console.error("Error calling Flask anomaly batch API:", error.message);
+    throw error;
+  }
+}
+
+module.exports = { detectAnomaly, detectAnomalyBatch };